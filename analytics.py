@@ -0,0 +1,153 @@
+import logging
+
+from config import logging_file
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Vectorized analytics over the `fights` columns of a columnar export (or any
+dict of equal-length arrays with the same names). Nothing here loops over
+fights in Python, so a million fights take seconds.
+
+    fights = columnar.load('export/')['fights']
+    players, wins, losses, isk = analytics.leaderboard(fights)
+"""
+
+
+def require_numpy():
+    if numpy is None:
+        raise RuntimeError("NumPy is required for analytics")
+
+
+def appearances(fights):
+    """ Each fight as two per-player results: (killID, characterID, shipID, won), winner first within a kill """
+
+    require_numpy()
+    count = len(fights['killID'])
+    killIDs = numpy.concatenate([fights['killID'], fights['killID']])
+    characterIDs = numpy.concatenate([fights['attackerID'], fights['victimID']])
+    shipIDs = numpy.concatenate([fights['attacker_shipID'], fights['victim_shipID']])
+    won = numpy.concatenate([numpy.ones(count, dtype=bool), numpy.zeros(count, dtype=bool)])
+    return killIDs, characterIDs, shipIDs, won
+
+
+def groups(*keys):
+    """ Unique rows of the given key columns and, for every input row, the index of its group """
+
+    # One lexsort and a boundary scan, much faster than numpy.unique(axis=0) on wide rows
+    order = numpy.lexsort(keys[::-1])
+    ordered = [numpy.asarray(key)[order] for key in keys]
+
+    change = numpy.ones(len(order), dtype=bool)
+    if len(order):
+        change[1:] = numpy.any([key[1:] != key[:-1] for key in ordered], axis=0)
+
+    inverse = numpy.empty(len(order), dtype='int64')
+    inverse[order] = numpy.cumsum(change) - 1
+    return numpy.stack([key[change] for key in ordered], axis=1), inverse
+
+
+def streaks(fights):
+    """ Same runs as dbactions.runs: (characterID, shipID, won, start, end, matches) columns, ordered by player, ship, start """
+
+    killIDs, characterIDs, shipIDs, won = appearances(fights)
+    if not len(killIDs):
+        empty = numpy.array([], dtype='int64')
+        return empty, empty, numpy.array([], dtype=bool), empty, empty, empty
+
+    # Winner before loser inside one kill, like dbactions.results
+    order = numpy.lexsort((~won, killIDs, shipIDs, characterIDs))
+    killIDs, characterIDs, shipIDs, won = killIDs[order], characterIDs[order], shipIDs[order], won[order]
+
+    boundary = numpy.ones(len(killIDs), dtype=bool)
+    boundary[1:] = (characterIDs[1:] != characterIDs[:-1]) | (shipIDs[1:] != shipIDs[:-1]) | (won[1:] != won[:-1])
+    starts = numpy.flatnonzero(boundary)
+    ends = numpy.append(starts[1:], len(killIDs)) - 1
+
+    return characterIDs[starts], shipIDs[starts], won[starts], killIDs[starts], killIDs[ends], ends - starts + 1
+
+
+def current_streaks(fights):
+    """ The latest run of every player/ship pair, as returned by streaks() """
+
+    columns = streaks(fights)
+    characterIDs, shipIDs = columns[0], columns[1]
+    last = numpy.ones(len(characterIDs), dtype=bool)
+    last[:-1] = (characterIDs[1:] != characterIDs[:-1]) | (shipIDs[1:] != shipIDs[:-1])
+    return tuple(column[last] for column in columns)
+
+
+def leaderboard(fights, by_ship=False):
+    """ Players (or player/ship rows if `by_ship`) with wins, losses and ISK destroyed, most wins first """
+
+    _, characterIDs, shipIDs, won = appearances(fights)
+    value = numpy.concatenate([fights['value'], numpy.zeros(len(fights['value']))])
+
+    keys = (characterIDs, shipIDs) if by_ship else (characterIDs,)
+    unique, inverse = groups(*keys)
+    wins = numpy.bincount(inverse, weights=won, minlength=len(unique)).astype('int64')
+    losses = numpy.bincount(inverse, weights=~won, minlength=len(unique)).astype('int64')
+    isk = numpy.bincount(inverse, weights=value, minlength=len(unique))
+
+    order = numpy.lexsort((losses, -wins))
+    players = unique[order] if by_ship else unique[order, 0]
+    return players, wins[order], losses[order], isk[order]
+
+
+def matchups(fights, top=50):
+    """ Head-to-head wins among the `top` busiest players: (characterIDs, matrix) where matrix[i, j] is i's wins over j """
+
+    require_numpy()
+    attackers, victims = numpy.asarray(fights['attackerID']), numpy.asarray(fights['victimID'])
+    players, counts = numpy.unique(numpy.concatenate([attackers, victims]), return_counts=True)
+    chosen = numpy.sort(players[numpy.argsort(-counts, kind='stable')[:top]])
+
+    both = numpy.isin(attackers, chosen) & numpy.isin(victims, chosen)
+
+    matrix = numpy.zeros((len(chosen), len(chosen)), dtype='int64')
+    numpy.add.at(matrix, (numpy.searchsorted(chosen, attackers[both]), numpy.searchsorted(chosen, victims[both])), 1)
+    return chosen, matrix
+
+
+def activity(fights, bucket=3600):
+    """ Fights and ISK destroyed per `bucket` seconds of killmail time: (bucket starts, fights, isk) """
+
+    require_numpy()
+    times = numpy.asarray(fights['time'])
+    if not len(times):
+        return numpy.array([], dtype='int64'), numpy.array([], dtype='int64'), numpy.array([])
+
+    # Counted from the first bucket boundary, so each slot lines up with its start below
+    slots = times // bucket - times.min() // bucket
+    counts = numpy.bincount(slots)
+    isk = numpy.bincount(slots, weights=fights['value'])
+    starts = times.min() // bucket * bucket + numpy.arange(len(counts)) * bucket
+    present = counts > 0
+    return starts[present], counts[present], isk[present]
+
+
+def win_rates(fights, bucket=86400, minimum=1):
+    """ Per player win rate in each `bucket` of time: (characterIDs, bucket starts, rate) for cells with at least `minimum` fights """
+
+    _, characterIDs, _, won = appearances(fights)
+    times = numpy.concatenate([fights['time'], fights['time']])
+    slots = times // bucket * bucket
+
+    unique, inverse = groups(characterIDs, slots)
+    fought = numpy.bincount(inverse, minlength=len(unique))
+    wins = numpy.bincount(inverse, weights=won, minlength=len(unique))
+    keep = fought >= minimum
+    return unique[keep, 0], unique[keep, 1], wins[keep] / fought[keep]
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+
+from datetime import datetime, timedelta
+
+import metrics
+
+from esi import fetch_all, fetch_kills
+from zkillboard import get_history, get_killreport
+from config import logging_file, zkillboard_concurrency, zkillboard_rate_limit, db_batch_size
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Historical backfill from zkillboard's daily history dumps.
+
+Each day of the range is one killID -> hash file, downloaded in parallel (or
+read from a local directory of YYYYMMDD.json files). Every pair the database
+does not know yet goes straight to the ESI fetch stage. Only matching
+killmails get a zkillboard lookup for their value, and a killmail is stored
+once its `zkill` row is, so no fight is scored without one. Kills the filter
+rejected are remembered in `backfill_seen`, a re-run with the same filter does
+not fetch them again. No zkillboard paging is involved.
+"""
+
+
+def days(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day = day + timedelta(days=1)
+
+
+def read_history(directory, day):
+    """ Local copy of a daily history file, or None if it is not there """
+
+    path = os.path.join(directory, day.strftime("%Y%m%d") + ".json")
+    if not os.path.exists(path):
+        logger.warn("No history file {0}".format(path))
+        return None
+
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def load_histories(start, end, history_dir=None):
+    """ Merge the daily killID -> hash files for `start`..`end` into one dict """
+
+    pairs = {}
+    if history_dir is not None:
+        histories = ((day, read_history(history_dir, day)) for day in days(start, end))
+    else:
+        histories = ((day, history) for (day,), history in fetch_all(get_history, ((day,) for day in days(start, end)), zkillboard_concurrency, zkillboard_rate_limit))
+
+    for day, history in histories:
+        if not history:
+            logger.warn("No history received for {0}".format(day))
+            continue
+
+        for killID, hash in history.items():
+            pairs[int(killID)] = hash
+        logger.info("Loaded {0} kills from the {1} history".format(len(history), day))
+
+    return pairs
+
+
+def matches(killData, systems, ships):
+    """ Is this killmail in one of `systems` and, if `ships` is given, flown or lost in one of them """
+
+    if systems and killData['solar_system_id'] not in systems:
+        return False
+    if ships is None:
+        return True
+    if killData['victim']['ship_type_id'] in ships:
+        return True
+    return any(attacker.get('ship_type_id') in ships for attacker in killData['attackers'])
+
+
+def filter_key(systems, groups):
+    """ Identifies a system/group filter in `backfill_seen` """
+    return json.dumps({'systems': sorted(systems or []), 'groups': None if groups is None else sorted(groups)})
+
+
+@metrics.instrumented
+def backfill(db, start, end, systems, groups=None, history_dir=None, batch_size=db_batch_size):
+    """ Store every kill between `start` and `end` (dates, inclusive) in `systems` through the ESI fetch stage """
+
+    pairs = load_histories(start, end, history_dir)
+    if not pairs:
+        return 0, 0, 0
+
+    key = filter_key(systems, groups)
+    db.cursor.execute('SELECT `killID` FROM `esi` WHERE `killID` BETWEEN ? AND ? '
+        'UNION SELECT `killID` FROM `backfill_seen` WHERE `filter` = ? AND `killID` BETWEEN ? AND ?;', (min(pairs), max(pairs), key, min(pairs), max(pairs)))
+    known = set(killID for killID, in db.cursor.fetchall())
+    pending = [(killID, hash) for killID, hash in sorted(pairs.items()) if killID not in known]
+    logger.info("Backfilling {0} of {1} kills between {2} and {3}".format(len(pending), len(pairs), start, end))
+
+    ships = None if groups is None else db.ship_index(groups)
+    rejected = []
+
+    def kept():
+        batch = []
+        for killID, killData in fetch_kills(pending):
+            if killData is None:
+                logger.warn("No ESI data received for killID {0}".format(killID))
+            elif not matches(killData, systems, ships):
+                rejected.append((key, killID))
+            else:
+                batch.append(killData)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    matched = 0
+    inserted = 0
+    skipped = 0
+    failed = 0
+
+    for batch in kept():
+        matched = matched + len(batch)
+        killIDs = [killData['killmail_id'] for killData in batch]
+        reports = []
+        for (killID,), report in fetch_all(get_killreport, ((killID,) for killID in killIDs), zkillboard_concurrency, zkillboard_rate_limit):
+            if report:
+                reports.append(report[0])
+            else:
+                logger.warn("No zkillboard report for killID {0}, it will be backfilled again on the next run".format(killID))
+        db.ingest_kills(reports)
+
+        # Without its `zkill` row a fight would be scored at 0 ISK for good
+        db.cursor.execute('SELECT `killID` FROM `zkill` WHERE `killID` IN ({0});'.format(', '.join('?' * len(killIDs))), killIDs)
+        valued = set(killID for killID, in db.cursor.fetchall())
+        added, ignored, lost = db.ingest_killdata(killData for killData in batch if killData['killmail_id'] in valued)
+        inserted = inserted + added
+        skipped = skipped + ignored
+        failed = failed + lost
+
+    db.bulk_insert('INSERT OR IGNORE INTO `backfill_seen` (`filter`, `killID`) VALUES (?, ?)', rejected)
+    logger.info("{0} of {1} backfilled kills matched".format(matched, len(pending)))
+    return inserted, skipped, failed
+
+
+if __name__ == '__main__':
+    import argparse
+    import config
+
+    from dbactions import DBHandler
+
+    def parse_date(value):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+
+    parser = argparse.ArgumentParser(description="Backfill a past date range from zkillboard daily history dumps")
+    parser.add_argument('start', type=parse_date, help="First day, YYYY-MM-DD")
+    parser.add_argument('end', type=parse_date, help="Last day, YYYY-MM-DD")
+    parser.add_argument('--system', type=int, action='append', dest='systems', required=True, help="solarSystemID to keep (repeatable)")
+    parser.add_argument('--group', type=int, action='append', dest='groups', help="Ship groupID to keep (repeatable)")
+    parser.add_argument('--history-dir', help="Read YYYYMMDD.json history files from here instead of downloading them")
+    args = parser.parse_args()
+
+    db = DBHandler()
+    db.connect(config.database_file)
+    backfill(db, args.start, args.end, set(args.systems), args.groups, args.history_dir)
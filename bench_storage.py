@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import codec
+import synthetic
+
+
+"""
+Compares the on-disk size and read throughput of the `zkill`/`esi` report
+columns stored as plain JSON text versus each registered codec.
+
+    python bench_storage.py --count 100000 > storage.json
+"""
+
+tables = """
+CREATE TABLE `zkill` (
+    `killID` INT UNSIGNED NOT NULL,
+    `hash` VARCHAR(40) NOT NULL,
+    `value` REAL NOT NULL,
+    `killReport` BLOB NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+
+CREATE TABLE `esi` (
+    `killID` INT UNSIGNED NOT NULL,
+    `killReport` BLOB NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+"""
+
+
+def write(path, reports, codec_name):
+    connection = sqlite3.connect(path)
+    connection.executescript(tables)
+
+    started = time.perf_counter()
+    with connection:
+        connection.executemany('INSERT INTO `zkill` (`killID`, `hash`, `value`, `killReport`) VALUES (?, ?, ?, ?)',
+            ((report['killmail_id'], report['zkb']['hash'], report['zkb']['totalValue'], codec.encode(report, codec_name)) for report, _ in reports))
+        connection.executemany('INSERT INTO `esi` (`killID`, `killReport`) VALUES (?, ?)',
+            ((killData['killmail_id'], codec.encode(killData, codec_name)) for _, killData in reports))
+    elapsed = time.perf_counter() - started
+
+    connection.execute('VACUUM')
+    connection.close()
+    return elapsed
+
+
+def read(path):
+    """ Decode every `esi` report and pull out what parse_spree needs from it """
+
+    connection = sqlite3.connect(path)
+    started = time.perf_counter()
+
+    rows = 0
+    for killID, killReport in connection.execute('SELECT `killID`, `killReport` FROM `esi`'):
+        killData = codec.decode(killReport)
+        killer = [attacker for attacker in killData['attackers'] if attacker['final_blow']][0]
+        victim = killData['victim']
+        rows = rows + 1
+
+    elapsed = time.perf_counter() - started
+    connection.close()
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare raw report storage codecs on synthetic killmails")
+    parser.add_argument('--count', type=int, default=100000, help="Number of synthetic killmails")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    reports = list(synthetic.generate(args.count, args.seed))
+    results = {'count': args.count, 'seed': args.seed, 'codecs': {}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for codec_name in [None] + sorted(codec.codecs):
+            label = codec_name or 'text'
+            path = os.path.join(directory, label + '.db')
+
+            write_time = write(path, reports, codec_name)
+            rows, read_time = read(path)
+
+            results['codecs'][label] = {
+                'file_bytes': os.path.getsize(path),
+                'write_seconds': round(write_time, 3),
+                'read_seconds': round(read_time, 3),
+                'reads_per_second': round(rows / read_time, 1)
+            }
+
+    baseline = results['codecs']['text']
+    for label, result in results['codecs'].items():
+        result['size_ratio'] = round(result['file_bytes'] / baseline['file_bytes'], 3)
+        result['read_ratio'] = round(result['reads_per_second'] / baseline['reads_per_second'], 3)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
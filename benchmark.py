@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+import client
+import esi
+import killcache
+import metrics
+import synthetic
+import zkillboard
+
+from dbactions import DBHandler
+from mockserver import Dataset, MockServer
+from pipeline import Pipeline
+from redisq import Consumer
+
+
+"""
+Offline benchmark suite. Every scenario runs against a synthetic dataset and
+the local zkillboard/ESI stand-in, never the live APIs, and the results are
+printed as JSON so runs from different commits can be diffed.
+
+    python benchmark.py --count 2000 --latency 0.05 --output bench.json
+"""
+
+views = ['history', 'player_leaderboard', 'ship_leaderboard', 'undefeated', 'player_iskboard', 'ship_iskboard', 'streaks', 'current_streaks']
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    return round(time.perf_counter() - started, 4)
+
+
+def new_database(directory, name):
+    db = DBHandler()
+    db.connect(os.path.join(directory, name))
+    db.create_schema()
+    db.connection.executemany('INSERT INTO `ships` (`shipID`, `groupID`, `name`) VALUES (?, 25, ?)',
+        [(shipID, "Frigate {0}".format(shipID)) for shipID in synthetic.frigates])
+    db.connection.commit()
+    return db
+
+
+def point_at(server, rate):
+    """ Send every zkillboard/ESI request to the stand-in, without the governor's pacing or the killmail cache """
+
+    killcache.killcache_dir = None
+    client.governor_interval = 0
+    client.governor_min_interval = 0
+    client.governors.clear()
+    esi.esi_url = server.url
+    esi.esi_rate_limit = rate
+    zkillboard.zkillboard_url = server.url
+    zkillboard.redisq_url = server.url + '/listen.php'
+
+
+def scenario_update(directory, args):
+    """ The update.py flow end to end: zkill paging, ESI kills, sprees, players """
+
+    server = MockServer(Dataset(args.count, args.seed), args.latency).start()
+    point_at(server, args.rate)
+    db = new_database(directory, 'update.db')
+    query = "{0}/api/systemID/31000382/groupID/25/".format(server.url)
+
+    try:
+        result = {
+            'sync_query': timed(db.sync_query, query),
+            'fetch_missing_kills': timed(db.fetch_missing_kills),
+            'parse_spree': timed(db.parse_spree),
+            'fetch_missing_players': timed(db.fetch_missing_players),
+            'resync_query': timed(db.sync_query, query),
+        }
+        result['total'] = round(sum(result.values()), 4)
+        result['requests'] = dict(server.requests)
+    finally:
+        server.stop()
+
+    return result
+
+
+def scenario_pipeline(directory, args):
+    """ The same end to end update through the staged pipeline, stages overlapping """
+
+    server = MockServer(Dataset(args.count, args.seed), args.latency).start()
+    point_at(server, args.rate)
+    path = os.path.join(directory, 'pipeline.db')
+    new_database(directory, 'pipeline.db').connection.close()
+    query = "{0}/api/systemID/31000382/groupID/25/".format(server.url)
+
+    try:
+        started = time.perf_counter()
+        progress = Pipeline(query, path, rate=args.rate).run()
+        result = {'total': round(time.perf_counter() - started, 4), 'progress': progress}
+        result['requests'] = dict(server.requests)
+    finally:
+        server.stop()
+
+    return result
+
+
+def scenario_stream(directory, args):
+    """ The RedisQ consumer draining every kill, published at once, into a fresh database """
+
+    server = MockServer(Dataset(args.count, args.seed), args.latency).start()
+    point_at(server, args.rate)
+    path = os.path.join(directory, 'stream.db')
+    new_database(directory, 'stream.db').connection.close()
+    consumer = Consumer(path, 'benchmark', systems=None)
+
+    try:
+        started = time.perf_counter()
+        server.publish()
+        thread = threading.Thread(target=consumer.run, daemon=True)
+        thread.start()
+        while consumer.progress['received'] < args.count or consumer.progress['stored'] < consumer.progress['matched']:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        consumer.stop.set()
+        thread.join()
+
+        result = {'total': round(elapsed, 4), 'kills_per_second': round(args.count / elapsed, 1), 'progress': consumer.progress}
+        result['requests'] = dict(server.requests)
+    finally:
+        consumer.stop.set()
+        server.stop()
+
+    return result
+
+
+def populated(directory, args, name):
+    """ A database holding the whole synthetic dataset, ingested without HTTP """
+
+    db = new_database(directory, name)
+    pairs = list(synthetic.generate(args.count, args.seed))
+    db.ingest_kills(report for report, _ in pairs)
+    db.ingest_killdata(killData for _, killData in pairs)
+    return db, pairs
+
+
+def scenario_spree(directory, args):
+    """ parse_spree from scratch, then full reprocessing serially and on every core """
+
+    db, _ = populated(directory, args, 'spree.db')
+    return {
+        'parse_spree': timed(db.parse_spree),
+        'reprocess_serial': timed(db.parse_spree, reprocess=True, processes=1),
+        'reprocess_parallel': timed(db.parse_spree, reprocess=True, processes=None),
+        'check_aggregates': timed(db.check_aggregates),
+        'rebuild_streaks': timed(db.rebuild_streaks),
+        'rebuild_scores': timed(db.rebuild_scores),
+    }
+
+
+def scenario_views(directory, args):
+    """ Every leaderboard/streak view, read `repeat` times each """
+
+    db, pairs = populated(directory, args, 'views.db')
+    db.parse_spree()
+
+    characters = set()
+    for _, killData in pairs:
+        characters.add(killData['victim']['character_id'])
+        characters.update(attacker['character_id'] for attacker in killData['attackers'])
+    db.connection.executemany('INSERT INTO `character` (`characterID`, `name`, `corporationID`) VALUES (?, ?, 0)',
+        [(characterID, "Pilot {0}".format(characterID)) for characterID in characters])
+    db.connection.commit()
+
+    result = {}
+    for view in views:
+        query = 'SELECT * FROM `{0}`;'.format(view)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            rows = db.connection.execute(query).fetchall()
+        elapsed = time.perf_counter() - started
+        result[view] = {'rows': len(rows), 'seconds_per_read': round(elapsed / args.repeat, 6)}
+
+    return result
+
+
+scenarios = {
+    'update': scenario_update,
+    'pipeline': scenario_pipeline,
+    'spree': scenario_spree,
+    'stream': scenario_stream,
+    'views': scenario_views,
+}
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark scenarios and print JSON results")
+    parser.add_argument('--count', type=int, default=2000, help="Synthetic killmails per scenario")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the stand-in server waits before each response")
+    parser.add_argument('--rate', type=float, default=1000, help="ESI requests per second allowed against the stand-in")
+    parser.add_argument('--repeat', type=int, default=20, help="Reads per view")
+    parser.add_argument('--scenario', action='append', choices=sorted(scenarios), help="Scenario to run (repeatable, default all)")
+    parser.add_argument('--output', help="Write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    results = {
+        'revision': revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'parameters': {'count': args.count, 'seed': args.seed, 'latency': args.latency, 'rate': args.rate, 'repeat': args.repeat},
+        'scenarios': {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.scenario or sorted(scenarios):
+            metrics.registry.reset()
+            results['scenarios'][name] = scenarios[name](directory, args)
+            results['scenarios'][name]['metrics'] = metrics.registry.dump()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+import logging
+import random
+import requests
+import threading
+import time
+
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+from config import logging_file, http_pool_size, http_cache_size, http_retries
+from config import governor_interval, governor_min_interval, governor_max_interval, governor_backoff, governor_max_backoff
+from config import governor_error_floor, governor_breaker_failures, governor_breaker_cooldown
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+# Keep-alive connection pool shared by every module that talks HTTP
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+# url -> (ETag, Last-Modified, decoded body) of the last 200 response
+validators = OrderedDict()
+validators_lock = threading.Lock()
+
+# host -> Governor
+governors = {}
+governors_lock = threading.Lock()
+
+# 420 is ESI's error-limit status, the rest are worth retrying after a pause
+retry_statuses = frozenset([420, 429, 500, 502, 503, 504])
+
+
+class RateLimiter(object):
+    """ Spaces out requests so no more than `rate` start per second, shared across threads """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            slot = max(time.monotonic(), self.next_slot)
+            self.next_slot = slot + self.interval
+
+        delay = slot - time.monotonic()
+        metrics.sleep(delay, 'limiter')
+        return delay
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """ Raised instead of sending while a host's circuit breaker is open """
+
+
+def retry_after(value):
+    """ Seconds to wait from a Retry-After header, given as seconds or an HTTP date """
+
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Governor(object):
+    """ Paces one host from what its responses say: ESI error budget, Retry-After,
+    jittered exponential backoff on 420/429/5xx and a circuit breaker after repeated failures """
+
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()
+        self.interval = governor_interval
+        self.next_slot = time.monotonic()
+        self.paused_until = 0.0
+        self.failures = 0
+        self.error_remain = None
+        self.error_reset = None
+        self.opened_until = None
+        self.probing = False
+
+    def acquire(self, paced=True):
+        """ Wait for this host's next slot, `paced` False leaves spacing to the caller's RateLimiter.
+        Returns True when this request is the half-open circuit's probe """
+
+        probe = False
+        with self.lock:
+            now = time.monotonic()
+            if self.opened_until is not None:
+                if now < self.opened_until or self.probing:
+                    raise CircuitOpen("Circuit open for {0}".format(self.host))
+                # Cooldown over, let a single probe through
+                self.probing = True
+                probe = True
+
+            slot = max(now, self.paused_until)
+            if paced:
+                slot = max(slot, self.next_slot)
+                self.next_slot = slot + self.interval
+
+        metrics.sleep(slot - time.monotonic(), 'governor')
+        return probe
+
+    def end_probe(self):
+        """ Let another probe through once a probe ended, whether or not it got to record() """
+
+        with self.lock:
+            self.probing = False
+
+    def record(self, status, headers=None):
+        """ Adapt to one response, None `status` for a timeout. Returns the pause imposed, if any """
+
+        headers = headers or {}
+        with self.lock:
+            now = time.monotonic()
+            pause = 0.0
+
+            remain = headers.get('X-ESI-Error-Limit-Remain')
+            reset = headers.get('X-ESI-Error-Limit-Reset')
+            if remain is not None and reset is not None:
+                self.error_remain = int(remain)
+                self.error_reset = now + int(reset)
+                if self.error_remain <= governor_error_floor:
+                    logger.warn("{0} error budget down to {1}, pausing {2}s until it resets".format(self.host, remain, reset))
+                    pause = float(reset)
+
+            if status is None or status in retry_statuses:
+                self.failures = self.failures + 1
+                self.interval = min(governor_max_interval, max(self.interval, governor_min_interval) * 2)
+
+                backoff = min(governor_max_backoff, governor_backoff * 2 ** (self.failures - 1))
+                backoff = backoff / 2 + random.uniform(0, backoff / 2)
+                waited = retry_after(headers.get('Retry-After'))
+                pause = max(pause, backoff if waited is None else waited)
+                metrics.increment('http_backoff_total', host=self.host, status=status or 'timeout')
+
+                if self.probing or self.failures >= governor_breaker_failures:
+                    logger.error("Opening circuit for {0} after {1} failures".format(self.host, self.failures))
+                    self.opened_until = now + max(pause, governor_breaker_cooldown)
+                    metrics.increment('http_circuit_open_total', host=self.host)
+            else:
+                if self.opened_until is not None:
+                    logger.info("Closing circuit for {0}".format(self.host))
+                self.failures = 0
+                self.opened_until = None
+                self.interval = max(governor_min_interval, self.interval * 0.9)
+
+            self.probing = False
+            self.paused_until = max(self.paused_until, now + pause)
+            return pause
+
+    def budget(self):
+        """ Snapshot of the pacing state, for logs and status pages """
+
+        with self.lock:
+            now = time.monotonic()
+            return {
+                'host': self.host,
+                'interval': self.interval,
+                'paused_for': max(0.0, self.paused_until - now),
+                'failures': self.failures,
+                'error_limit_remain': self.error_remain,
+                'error_limit_reset': None if self.error_reset is None else max(0.0, self.error_reset - now),
+                'circuit': 'closed' if self.opened_until is None else ('half-open' if now >= self.opened_until else 'open'),
+            }
+
+
+def governor(host):
+    with governors_lock:
+        if host not in governors:
+            governors[host] = Governor(host)
+        return governors[host]
+
+
+def budget(host=None):
+    """ Current budget of one host, or of every host seen so far """
+
+    if host is not None:
+        return governor(host).budget()
+    with governors_lock:
+        known = list(governors.values())
+    return dict((g.host, g.budget()) for g in known)
+
+
+def get_cached(url):
+    with validators_lock:
+        cached = validators.get(url)
+        if cached is not None:
+            validators.move_to_end(url)
+        return cached
+
+
+def store_cached(url, etag, last_modified, data):
+    with validators_lock:
+        validators[url] = (etag, last_modified, data)
+        validators.move_to_end(url)
+        while len(validators) > http_cache_size:
+            validators.popitem(last=False)
+
+
+def send(method, url, headers, limiter=None, **kwargs):
+    """ Issue one request over the shared session, paced by the host's governor and retried on timeouts, connection errors and 420/429/5xx """
+
+    logger.debug("Requesting %s", url)
+    host = urlsplit(url).netloc
+    pacer = governor(host)
+    request = None
+
+    for attempt in range(http_retries):
+        probe = False
+        try:
+            probe = pacer.acquire(paced=limiter is None)
+            if limiter is not None:
+                limiter.wait()
+            started = time.perf_counter()
+            request = method(url, headers=headers, timeout=30, **kwargs)
+            metrics.observe('http_request_seconds', time.perf_counter() - started, host=host, status=request.status_code)
+            metrics.increment('http_requests_total', host=host, status=request.status_code)
+        except CircuitOpen as e:
+            logger.error("Not requesting {0}: {1}".format(url, e))
+            return
+        except requests.exceptions.Timeout as errt:
+            metrics.increment('http_requests_total', host=host, status='timeout')
+            logger.error("Timeout Error: {0}".format(errt))
+            pacer.record(None)
+            request = None
+        except requests.exceptions.RequestException as errc:
+            metrics.increment('http_requests_total', host=host, status='error')
+            logger.error("Connection Error: {0}".format(errc))
+            pacer.record(None)
+            request = None
+        else:
+            pause = pacer.record(request.status_code, request.headers)
+            if request.status_code not in retry_statuses:
+                return request
+            logger.warn("Received HTTP {0} from {1}, backing off {2:.1f}s".format(request.status_code, url, pause))
+        finally:
+            if probe:
+                pacer.end_probe()
+
+        if attempt + 1 < http_retries:
+            logger.info("Retrying {0} more times.".format(http_retries - attempt - 1))
+
+    if request is not None:
+        logger.error("Giving up on {0} after HTTP {1}".format(url, request.status_code))
+    return
+
+
+def get_json(url, headers, limiter=None):
+    """ GET `url` over the shared session, revalidating against the last ETag/Last-Modified seen for it """
+
+    request_headers = dict(headers)
+    cached = get_cached(url)
+    if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+            request_headers["If-None-Match"] = etag
+        if last_modified:
+            request_headers["If-Modified-Since"] = last_modified
+
+    request = send(session.get, url, request_headers, limiter)
+    if request is None:
+        return
+
+    if request.status_code == 304 and cached is not None:
+        logger.debug("Not modified, reusing stored body for {0}".format(url))
+        return cached[2]
+
+    data = request.json()
+
+    etag = request.headers.get("ETag")
+    last_modified = request.headers.get("Last-Modified")
+    if etag or last_modified:
+        store_cached(url, etag, last_modified, data)
+
+    # Break if the page is empty
+    if len(data) == 0:
+        logger.warn("Received an empty page")
+
+    return data
+
+
+def post_json(url, payload, headers, limiter=None):
+    """ POST `payload` as JSON over the shared session and decode the response """
+
+    request = send(session.post, url, headers, limiter, json=payload)
+    if request is None:
+        return
+
+    if request.status_code != 200:
+        logger.error("Received HTTP {0} from {1}: {2}".format(request.status_code, url, request.text))
+        return
+
+    return request.json()
@@ -0,0 +1,63 @@
+import json
+import logging
+import time
+import zlib
+
+import metrics
+
+from config import logging_file, storage_codec
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Raw reports are stored either as plain JSON TEXT (the original format) or as
+a BLOB whose first byte tags the codec that produced the rest of it, so rows
+written with different codecs can live side by side in the same table.
+"""
+
+codecs = {}
+tags = {}
+
+
+def register(name, tag, encode, decode):
+    """ Make a codec available under `name`, stored with the single byte `tag` """
+
+    codecs[name] = (tag, encode, decode)
+    tags[tag] = (name, decode)
+
+
+register('zlib', 1, lambda data: zlib.compress(data, 6), zlib.decompress)
+
+
+def encode(report, codec=storage_codec):
+    """ Serialize a report for the `killReport` columns """
+
+    text = json.dumps(report, separators=(',', ':'))
+    if codec is None:
+        return text
+
+    tag, compress, _ = codecs[codec]
+    return bytes((tag,)) + compress(text.encode('utf-8'))
+
+
+def decode(stored):
+    """ Deserialize a `killReport` column, whichever format it was written in """
+
+    started = time.perf_counter()
+    if isinstance(stored, str):
+        name = 'text'
+        report = json.loads(stored)
+    else:
+        name, decompress = tags[stored[0]]
+        report = json.loads(decompress(stored[1:]))
+
+    metrics.observe('decode_seconds', time.perf_counter() - started, codec=name)
+    return report
@@ -0,0 +1,141 @@
+import logging
+import os
+
+from config import logging_file, columnar_chunk_size
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Columnar export of the fight data for analytics.py. Each column becomes a
+`<table>_<column>.npy` file that load() memory-maps back, so a reader only
+pages in the columns it touches. With pyarrow installed, each table can also
+be written as `<table>.parquet` for other tools.
+
+    python columnar.py export/ --parquet
+"""
+
+tables = {
+    'fights': ("""SELECT S.`killID`, IFNULL(CAST(strftime('%s', K.`time`) AS INTEGER), 0), S.`attackerID`, S.`attacker_shipID`, S.`weaponID`,
+            S.`victimID`, S.`victim_shipID`, IFNULL(Z.`value`, 0) FROM `spree` S
+            LEFT JOIN `killmail` K ON K.`killID` = S.`killID`
+            LEFT JOIN `zkill` Z ON Z.`killID` = S.`killID`
+        ORDER BY S.`killID`;""",
+        [('killID', 'int64'), ('time', 'int64'), ('attackerID', 'int64'), ('attacker_shipID', 'int64'), ('weaponID', 'int64'),
+         ('victimID', 'int64'), ('victim_shipID', 'int64'), ('value', 'float64')]),
+    'characters': ('SELECT `characterID`, `name`, `corporationID` FROM `character` ORDER BY `characterID`;',
+        [('characterID', 'int64'), ('name', 'str'), ('corporationID', 'int64')]),
+    'ships': ('SELECT `shipID`, `groupID`, `name` FROM `ships` ORDER BY `shipID`;',
+        [('shipID', 'int64'), ('groupID', 'int64'), ('name', 'str')]),
+}
+
+
+def require_numpy():
+    if numpy is None:
+        raise RuntimeError("NumPy is required for the columnar export")
+
+
+def read_table(connection, query, columns, chunk_size=columnar_chunk_size):
+    """ {column: array} for a query, fetched in chunks so no full list of row tuples is ever held """
+
+    require_numpy()
+    cursor = connection.execute(query)
+    parts = dict((name, []) for name, _ in columns)
+
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for index, (name, dtype) in enumerate(columns):
+            values = [row[index] for row in rows]
+            if dtype == 'str':
+                parts[name].append(numpy.array(values, dtype=str))
+            else:
+                parts[name].append(numpy.array([0 if value is None else value for value in values], dtype=dtype))
+
+    arrays = {}
+    for name, dtype in columns:
+        if parts[name]:
+            arrays[name] = numpy.concatenate(parts[name])
+        else:
+            arrays[name] = numpy.array([], dtype=str if dtype == 'str' else dtype)
+    return arrays
+
+
+def export(connection, directory, parquet=False):
+    """ Write every table in `tables` as .npy columns (and .parquet files if `parquet`), returns the row counts """
+
+    require_numpy()
+    if parquet and pyarrow is None:
+        raise RuntimeError("pyarrow is required for the Parquet export")
+
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+
+    for table, (query, columns) in tables.items():
+        arrays = read_table(connection, query, columns)
+        for name, array in arrays.items():
+            numpy.save(os.path.join(directory, '{0}_{1}.npy'.format(table, name)), array)
+        if parquet:
+            pyarrow.parquet.write_table(pyarrow.table(arrays), os.path.join(directory, '{0}.parquet'.format(table)))
+
+        counts[table] = len(arrays[columns[0][0]])
+        logger.info("Exported {0} rows of {1} to {2}".format(counts[table], table, directory))
+
+    return counts
+
+
+def load(directory, mmap=True):
+    """ {table: {column: array}} from an export, memory-mapped read-only unless `mmap` is False """
+
+    require_numpy()
+    data = {}
+    for table, (_, columns) in tables.items():
+        data[table] = dict((name, numpy.load(os.path.join(directory, '{0}_{1}.npy'.format(table, name)), mmap_mode='r' if mmap else None)) for name, _ in columns)
+    return data
+
+
+def load_parquet(directory):
+    """ The same layout as load(), read from the .parquet files """
+
+    require_numpy()
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is required to read Parquet")
+
+    data = {}
+    for table in tables:
+        parquet_table = pyarrow.parquet.read_table(os.path.join(directory, '{0}.parquet'.format(table)), memory_map=True)
+        data[table] = dict((name, parquet_table.column(name).to_numpy()) for name in parquet_table.column_names)
+    return data
+
+
+if __name__ == '__main__':
+    import argparse
+    import config
+    import sqlite3
+
+    parser = argparse.ArgumentParser(description="Export the spree database to columnar files")
+    parser.add_argument('directory')
+    parser.add_argument('--database', default=config.database_file)
+    parser.add_argument('--parquet', action='store_true', help="Also write .parquet files (needs pyarrow)")
+    args = parser.parse_args()
+
+    print(export(sqlite3.connect(args.database), args.directory, args.parquet))
@@ -2,6 +2,98 @@ database_file = 'spree.db'
 logging_file = 'sample.log'
 logging_format = '%(asctime)-15s %(clientip)s %(user)-8s %(message)s'
 
+# Per-row log messages are sampled, one in this many is formatted
+log_sample_every = 100
+
+# Export pipeline metrics here after an update run (.prom/.txt for Prometheus text, JSON otherwise)
+metrics_file = None
+
+# ESI fetch tuning
+esi_concurrency = 8
+esi_rate_limit = 20
+esi_batch_size = 100
+esi_bulk_size = 1000
+
+# zkillboard requests per second when fetching in parallel
+zkillboard_concurrency = 2
+zkillboard_rate_limit = 1
+
+# Rows per transaction for bulk inserts
+db_batch_size = 500
+
+# Ship groups that count for sprees, e.g. [25] for frigates; None accepts every ship in `ships`
+ship_groups = None
+
+# Worker processes for parse_spree/shred_missing, None uses every core and 1 stays serial
+spree_processes = 1
+spree_shard_size = 5000
+
+# Codec for raw killReport columns, None keeps plain JSON text
+storage_codec = 'zlib'
+
+# Rendered reports kept by reports.ReportCache
+report_cache_size = 64
+
+# SQLite concurrency, see dbpool
+wal_mode = True
+read_pool_size = 4
+write_batch_size = 200
+write_queue_size = 1000
+
+# Staged ingest, see pipeline
+update_query = 'https://zkillboard.com/api/systemID/31000382/groupID/25/startTime/202003131100/'
+pipeline_queue_size = 500
+pipeline_batch_size = 50
+pipeline_flush_seconds = 1.0
+
+# Tracked events for events.py, each {'name', 'query', 'start', 'end'} with the
+# window given as UTC times ('2020-03-13T11:00:00Z', '2020-03-13 11:00') or None for open
+events = []
+
+# Local killmail store checked by esi.fetch_kill, None turns it off
+killcache_dir = 'killcache'
+killcache_max_bytes = 2 * 1024 ** 3
+killcache_segment_bytes = 64 * 1024 ** 2
+# Segments written to more recently than this are never evicted
+killcache_idle_seconds = 300
+
+# Rows fetched per round trip by columnar.export
+columnar_chunk_size = 100000
+
+# API endpoints
+esi_url = 'https://esi.evetech.net'
+zkillboard_url = 'https://zkillboard.com'
+redisq_url = 'https://zkillredisq.stream/listen.php'
+
+# Live stream consumer, see redisq. Kills are kept when they happen in one of
+# `redisq_systems` (None for any) and the victim or final blow flew a ship of
+# `redisq_groups` (None falls back to ship_groups)
+redisq_queue_id = 'spree-tracker'
+redisq_ttw = 10
+redisq_systems = [31000382]
+redisq_groups = None
+redisq_batch_size = 50
+redisq_flush_seconds = 1.0
+redisq_buffer_size = 1000
+redisq_max_backoff = 60
+
+# Shared HTTP client
+http_pool_size = 16
+http_cache_size = 1000
+
+# Per-host rate governor, see client.Governor. Spacing starts at
+# governor_interval and shrinks towards governor_min_interval while the host
+# is healthy, requests without their own RateLimiter are paced by it
+governor_interval = 1.0
+governor_min_interval = 0.2
+governor_max_interval = 30
+governor_backoff = 1.0
+governor_max_backoff = 300
+governor_error_floor = 10
+governor_breaker_failures = 5
+governor_breaker_cooldown = 60
+http_retries = 3
+
 """
 CREATE TABLE `zkill` (
     `killID` INT UNSIGNED NOT NULL,
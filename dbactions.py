@@ -1,9 +1,17 @@
 import logging
-import json
+import multiprocessing
 import sqlite3
 
-from esi import fetch_kill, fetch_player
-from config import logging_file, database_file
+import codec
+import metrics
+
+from ships import ShipIndex, load_ships, load_ship_groups
+from dbpool import enable_wal
+from migrations import create, migrate
+
+from esi import fetch_kill, fetch_kills, fetch_players, resolve_names, fetch_affiliations
+from zkillboard import iter_killreports, iter_killreports_query
+from config import logging_file, database_file, esi_batch_size, db_batch_size, ship_groups, spree_processes, spree_shard_size, log_sample_every, wal_mode
 
 # Logging Configuration
 logging.basicConfig(filename=logging_file, level=logging.DEBUG)
@@ -14,167 +22,197 @@ formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
 console.setFormatter(formatter)
 logger.addHandler(console)
 
+# Per-row messages only format one in `log_sample_every`
+rowlog = metrics.SampledLogger(logger, log_sample_every)
+
+
+player_score_query = """SELECT `characterID`, SUM(`wins`), SUM(`losses`), SUM(`isk_destroyed`) FROM (
+        SELECT S.`attackerID` AS `characterID`, 1 AS `wins`, 0 AS `losses`, IFNULL(Z.`value`, 0) AS `isk_destroyed` FROM `spree` S
+        LEFT JOIN `zkill` Z ON Z.`killID` = S.`killID`
+        UNION ALL
+        SELECT `victimID`, 0, 1, 0 FROM `spree`
+    ) GROUP BY `characterID` ORDER BY `characterID`"""
+
+ship_score_query = """SELECT `characterID`, `shipID`, SUM(`wins`), SUM(`losses`), SUM(`isk_destroyed`) FROM (
+        SELECT S.`attackerID` AS `characterID`, S.`attacker_shipID` AS `shipID`, 1 AS `wins`, 0 AS `losses`, IFNULL(Z.`value`, 0) AS `isk_destroyed` FROM `spree` S
+        LEFT JOIN `zkill` Z ON Z.`killID` = S.`killID`
+        UNION ALL
+        SELECT `victimID`, `victim_shipID`, 0, 1, 0 FROM `spree`
+    ) GROUP BY `characterID`, `shipID` ORDER BY `characterID`, `shipID`"""
+
+
+event_score_query = """WITH `fights` AS (
+        SELECT S.`killID`, S.`attackerID`, S.`attacker_shipID`, S.`victimID`, S.`victim_shipID`, IFNULL(Z.`value`, 0) AS `value` FROM `event_kill` EK
+            JOIN `event` E ON E.`eventID` = EK.`eventID`
+            JOIN `spree` S ON S.`killID` = EK.`killID`
+            JOIN `killmail` K ON K.`killID` = EK.`killID`
+            LEFT JOIN `zkill` Z ON Z.`killID` = EK.`killID`
+        WHERE EK.`eventID` = :eventID AND (E.`start` IS NULL OR K.`time` >= E.`start`) AND (E.`end` IS NULL OR K.`time` < E.`end`)
+    )
+    SELECT :eventID, `characterID`, `shipID`, SUM(`wins`), SUM(`losses`), SUM(`isk_destroyed`) FROM (
+        SELECT `attackerID` AS `characterID`, `attacker_shipID` AS `shipID`, 1 AS `wins`, 0 AS `losses`, `value` AS `isk_destroyed` FROM `fights`
+        UNION ALL
+        SELECT `victimID`, `victim_shipID`, 0, 1, 0 FROM `fights`
+    ) GROUP BY `characterID`, `shipID`"""
+
+
+def sync_key(identifier, base):
+    """ Key of an identifier/base combination in `sync_state` """
+    return "{0}/{1}".format(base, identifier)
+
+
+spree_query = """SELECT K.`killID`, A.`characterID`, A.`shipID`, IFNULL(A.`weaponID`, 0), V.`characterID`, V.`shipID` FROM `killmail` K
+        JOIN `attacker` A ON A.`killID` = K.`killID` AND A.`final_blow` = 1
+        JOIN `victim` V ON V.`killID` = K.`killID`
+        LEFT JOIN `spree` S ON S.`killID` = K.`killID`
+    WHERE S.`killID` IS NULL AND A.`characterID` IS NOT NULL AND V.`characterID` IS NOT NULL
+        AND K.`killID` BETWEEN ? AND ?
+    ORDER BY K.`killID`;"""
+
+insert_spree = 'INSERT OR IGNORE INTO `spree` (`killID`, `attackerID`, `attacker_shipID`, `weaponID`, `victimID`, `victim_shipID`, `valid`, `eligible`)  VALUES ( ?, ?, ?, ?, ?, ?, ?, ?)'
+
+missing_kills_query = "SELECT Z.`killID`, Z.`hash` from `zkill` Z LEFT JOIN `esi` E ON Z.`killID` = E.`killID` WHERE E.`killID` IS NULL;"
+
+missing_players_query = """SELECT id FROM (
+            SELECT DISTINCT `attackerID` AS `id` FROM `spree` UNION
+            SELECT DISTINCT `victimID` AS `id` FROM `spree`
+        ) LEFT JOIN `character` C ON C.`characterID` = `id` WHERE C.`characterID` IS NULL;"""
+
+unshredded_query = """SELECT E.`killID`, E.`killReport` FROM `esi` E
+        LEFT JOIN `killmail` K ON E.`killID` = K.`killID`
+    WHERE K.`killID` IS NULL AND E.`killID` BETWEEN ? AND ?
+    ORDER BY E.`killID` LIMIT ?;"""
+
+
+def shred(killReports):
+    """ Splits ESI kill reports into `killmail`, `attacker`, `victim` and `item` rows """
+
+    killmails = []
+    attackers = []
+    victims = []
+    items = []
+
+    for killReport in killReports:
+        killID = killReport['killmail_id']
+        victim = killReport['victim']
+
+        killmails.append((killID, killReport['killmail_time'], killReport['solar_system_id'], len(killReport['attackers'])))
+        victims.append((killID, victim.get('character_id'), victim.get('corporation_id'), victim.get('alliance_id'), victim['ship_type_id'], victim.get('damage_taken', 0)))
+
+        for position, attacker in enumerate(killReport['attackers']):
+            attackers.append((killID, position, attacker.get('character_id'), attacker.get('corporation_id'), attacker.get('alliance_id'),
+                attacker.get('ship_type_id'), attacker.get('weapon_type_id'), attacker.get('damage_done', 0), 1 if attacker.get('final_blow') else 0))
+
+        for position, item in enumerate(victim.get('items', [])):
+            items.append((killID, position, item['item_type_id'], item['flag'], item.get('quantity_destroyed', 0), item.get('quantity_dropped', 0), item.get('singleton', 0)))
+
+    return killmails, attackers, victims, items
+
+
+def spree_rows(candidates, ships):
+    """ Turns final blow/victim candidates into `spree` rows, keeping fights where both ships are in `ships` """
+
+    for killID, attackerID, attacker_shipID, weaponID, victimID, victim_shipID in candidates:
+        if attacker_shipID in ships and victim_shipID in ships:
+            yield (killID, attackerID, attacker_shipID, weaponID, victimID, victim_shipID, 0, 0)
+        else:
+            rowlog.info("Ships were not valid for %s: %s vs %s", killID, attacker_shipID, victim_shipID)
+
+
+def resolve_players(characterIDs):
+    """ (characterID, name, corporationID) rows from the bulk endpoints, and the IDs they could not resolve """
+
+    names = resolve_names(characterIDs)
+    affiliations = fetch_affiliations(characterIDs)
+    resolved = [(characterID, names[characterID], affiliations[characterID]) for characterID in characterIDs if characterID in names and characterID in affiliations]
+
+    # Anything the bulk endpoints could not resolve needs the full profile
+    unresolved = set(characterIDs) - set(player[0] for player in resolved)
+    return resolved, unresolved
+
+
+def shards(killIDs, size):
+    """ Splits sorted killIDs into inclusive (low, high) ranges of at most `size` kills """
+
+    for start in range(0, len(killIDs), size):
+        chunk = killIDs[start:start + size]
+        yield chunk[0], chunk[-1]
+
+
+def read_only(database_file):
+    return sqlite3.connect('file:{0}?mode=ro'.format(database_file), uri=True)
+
+
+def evaluate_shard(task):
+    """ Worker: evaluate the unprocessed kills of one killID range against the ship set """
+
+    database_file, low, high, shipIDs = task
+    connection = read_only(database_file)
+    try:
+        candidates = connection.execute(spree_query, (low, high)).fetchall()
+    finally:
+        connection.close()
+
+    return list(spree_rows(candidates, shipIDs))
+
+
+def shred_shard(task):
+    """ Worker: decode the unshredded `esi` reports of one killID range """
+
+    database_file, low, high = task
+    connection = read_only(database_file)
+    try:
+        rows = connection.execute(unshredded_query, (low, high, -1)).fetchall()
+    finally:
+        connection.close()
+
+    return shred(codec.decode(killReport) for _, killReport in rows)
+
+
+def results(fights):
+    """ Splits (killID, attackerID, attacker_shipID, victimID, victim_shipID) rows into per-player results """
+
+    for killID, attackerID, attacker_shipID, victimID, victim_shipID in fights:
+        yield killID, attackerID, attacker_shipID, 'W'
+        yield killID, victimID, victim_shipID, 'L'
+
+
+def runs(results):
+    """ Collapses killID-ordered results into (characterID, shipID, result, start, end, matches) streaks in one pass """
+
+    current = {}
+    for killID, characterID, shipID, result in results:
+        key = (characterID, shipID)
+        run = current.get(key)
+        if run is not None and run[2] == result:
+            run[4] = killID
+            run[5] = run[5] + 1
+            continue
+
+        if run is not None:
+            yield tuple(run)
+        current[key] = [characterID, shipID, result, killID, killID, 1]
+
+    for run in current.values():
+        yield tuple(run)
 
-"""
-TABLES
-======
-CREATE TABLE `zkill` (
-    `killID` INT UNSIGNED NOT NULL,
-    `hash` VARCHAR(40) NOT NULL,
-    `value` REAL NOT NULL,
-    `killReport` TEXT NOT NULL,
-    PRIMARY KEY (`killID`)
-);
-
-CREATE TABLE `esi` (
-    `killID` INT UNSIGNED NOT NULL,
-    `killReport` TEXT NOT NULL,
-    PRIMARY KEY (`killID`)
-);
-
-CREATE TABLE `spree`(
-    `killID` INT UNSIGNED NOT NULL,
-    `attackerID` INT UNSIGNED NOT NULL,
-    `attacker_shipID` INT UNSIGNED NOT NULL,
-    `weaponID` INT UNSIGNED NOT NULL,
-    `victimID` INT UNSIGNED NOT NULL,
-    `victim_shipID` INT UNSIGNED NOT NULL,
-    `valid` INT UNSIGNED NOT NULL,
-    `eligible` INT UNSIGNED NOT NULL,
-    PRIMARY KEY (`killID`)
-);
-
-CREATE TABLE `character` (
-    `characterID` INT UNSIGNED NOT NULL,
-    `name` TEXT NOT NULL,
-    `corporationID` IN UNSIGNED NOT NULL,
-    `race` INT UNSIGNED NOT NULL,
-    `birthday` DATETIME NOT NULL,
-    PRIMARY KEY (`characterID`)
-);
-
-CREATE TABLE `ships` (
-    `shipID` INT UNSIGNED NOT NULL,
-    `name` TEXT NOT NULL,
-    PRIMARY KEY (`shipID`)
-);
-
-CREATE VIEW `history`
-AS
-SELECT S.`killID`, A.`name` AS `attacker`, SA.`name` AS `attacker_ship`, V.`name` AS `victim`, SV.`name` AS `victim_ship`, Z.`value`, S.`valid`, S.`eligible` FROM `spree` S
-    JOIN `zkill` Z ON S.`killID` = Z.`killID`
-    JOIN `character` A ON S.`attackerID` = A.`characterID`
-    JOIN `character` V ON S.`victimID` = V.`characterID`
-    JOIN `ships` SA ON S.`attacker_shipID` = SA.`shipID`
-    JOIN `ships` SV ON S.`victim_shipID` = SV.`shipID`
-ORDER BY S.`killID`;
-
-CREATE VIEW `ship_leaderboard` AS
-SELECT 
-    C.`name` AS `player`
-    , S.`name` AS `ship`
-    , (SELECT COUNT(*) FROM `spree` WHERE attackerID = P.player AND attacker_shipID = P.shipID) AS `wins`
-    , (SELECT COUNT(*) FROM `spree` WHERE victimID = P.player AND victim_shipID = P.shipID) AS `losses`
-FROM (
-    SELECT DISTINCT attackerID AS `player`, attacker_shipID AS `shipID` FROM `spree`
-    UNION
-    SELECT DISTINCT victimID AS `player`, victim_shipID AS `shipID` FROM `spree`
-) AS P 
-JOIN `character` C ON P.`player` = C.`characterID`
-JOIN `ships` S ON P.`shipID` = S.`shipID`
-ORDER BY wins DESC;
-
-CREATE VIEW `undefeated` AS
-SELECT 
-    C.`name` AS `player`
-    , S.`name` AS `ship`
-    , (SELECT COUNT(*) FROM `spree` WHERE attackerID = P.player AND attacker_shipID = P.shipID) AS `wins`
-    , (SELECT COUNT(*) FROM `spree` WHERE victimID = P.player AND victim_shipID = P.shipID) AS `losses`
-FROM (
-    SELECT DISTINCT attackerID AS `player`, attacker_shipID AS `shipID` FROM `spree`
-    UNION
-    SELECT DISTINCT victimID AS `player`, victim_shipID AS `shipID` FROM `spree`
-) AS P 
-JOIN `character` C ON P.`player` = C.`characterID`
-JOIN `ships` S ON P.`shipID` = S.`shipID`
-WHERE `losses` = 0
-ORDER BY wins DESC;
-
-CREATE VIEW `player_leaderboard` AS
-SELECT 
-    C.`name`
-    , (SELECT COUNT(*) FROM `spree` WHERE attackerID = P.player) AS `wins`
-    , (SELECT COUNT(*) FROM `spree` WHERE victimID = P.player) AS `losses`
-FROM (
-    SELECT DISTINCT attackerID AS `player` FROM `spree`
-    UNION
-    SELECT DISTINCT victimID AS `player` FROM `spree`
-) AS P 
-JOIN `character` C ON P.`player` = C.`characterID`
-ORDER BY wins DESC;
-
-CREATE VIEW `player_iskboard` AS
-SELECT C.`characterID`, C.`name` AS `player`, SUM(Z.`value`) AS `isk_destroyed` FROM `spree` S
-JOIN `character` C ON C.`characterID` = S.`attackerID`
-JOIN `zkill` Z ON Z.`killID` = S.`killID`
-GROUP BY S.`attackerID`
-ORDER BY `isk_destroyed` DESC;
-
-CREATE VIEW `ship_iskboard` AS
-SELECT C.`characterID`, C.`name` AS `player`, S.`name` AS `ship`, SUM(Z.`value`) AS `isk_destroyed` FROM `spree` S
-JOIN `character` C ON C.`characterID` = S.`attackerID`
-JOIN `ships` S ON S.`shipID` = S.`attacker_shipID`
-JOIN `zkill` Z ON Z.`killID` = S.`killID`
-GROUP BY S.`attackerID`, S.`attacker_shipID`
-ORDER BY `isk_destroyed` DESC;
-
-
-CREATE VIEW player_results AS
-SELECT `killid`, `player`, `ship`, `result` FROM (
-    SELECT `killid`, `attacker` AS `player`, `attacker_ship` AS `ship`, 'W' AS `result` FROM `history`
-    UNION SELECT `killid`, `victim` AS `player`, `victim_ship` AS `ship`, 'L' AS `result` FROM `history`
-) ORDER BY `killid`;
-
-
-CREATE VIEW streaks AS
-SELECT 
-    `player`
-    , `ship`
-    , `result`
-    , MIN(`killid`) AS `start`
-    , MAX(`killid`) AS `end`
-    , COUNT(*) AS `matches`
-FROM (
-    SELECT
-        `killid`
-        , `player`
-        , `ship`
-        , `result`
-        , (SELECT COUNT(*) FROM player_results R
-            WHERE 
-            R.player = PR.player
-            AND R.ship = PR.ship
-            AND R.result <> PR.result
-            AND R.killid <= PR.killid) AS `rungroup`
-    FROM player_results PR
-) A
-GROUP BY `player`, `ship`, `result`, `rungroup`
-ORDER BY `end`;
-
-
-"""
 
 class DBHandler(object):
     def __init__(self):
         self.connection = None
         self.cursor = None
+        self.database_file = None
+        self.ships = {}
 
     def connect(self, database_file):
         # Create SQL Connection
         try:
             logger.info("Connecting to database file {0}.".format(database_file))
             self.connection = sqlite3.connect(database_file)
+            if wal_mode and database_file != ':memory:':
+                enable_wal(self.connection)
             self.cursor = self.connection.cursor()
+            self.database_file = database_file
             logger.debug("Successfully established connection to database ({0}).".format(database_file))
             return self.cursor
         except Exception as e:
@@ -182,8 +220,20 @@ class DBHandler(object):
             logger.exception(e)
             return None
 
+    def create_schema(self):
+        """ Create the tables and views of a new database """
+
+        logger.info("Creating schema in {0}.".format(self.database_file))
+        create(self.connection)
+
+    def migrate(self):
+        """ Create or upgrade the schema to the current version """
+
+        return migrate(self)
+
     def __del__(self):
-        self.connection.close()
+        if self.connection is not None:
+            self.connection.close()
 
     def parse_kills(self, killReports, commit=True):
         """ Inserts kill reports into `zkill` """
@@ -192,17 +242,16 @@ class DBHandler(object):
         for killReport in killReports:
             insert_kill = 'INSERT INTO `zkill` (`killID`, `hash`, `value`, `killReport`)  VALUES ( ?, ?, ?, ?)'
 
-            logger.info("Parsing loss data for killID {0}".format(killReport['killmail_id']))
+            rowlog.info("Parsing loss data for killID %s", killReport['killmail_id'])
 
             if self.kill_exists(killReport['killmail_id']):
                 logger.warn("Kill #{0} is already present in the DB.".format(killReport['killmail_id']))
                 return None
 
             try:
-                kill = (killReport['killmail_id'], killReport['zkb']['hash'], killReport['zkb']['totalValue'], json.dumps(killReport))
-                logger.debug("Executing INSERT on `zkill` for data {0}".format(kill))
+                kill = (killReport['killmail_id'], killReport['zkb']['hash'], killReport['zkb']['totalValue'], codec.encode(killReport))
+                rowlog.debug("Executing INSERT on `zkill` for killID %s", kill[0])
                 self.cursor.execute(insert_kill, kill)
-                logger.info("Successfully parsed kill data for killID {0}".format(killReport['killmail_id']))
                 
                 if commit: 
                     self.connection.commit()
@@ -216,13 +265,13 @@ class DBHandler(object):
 
         insert_kill = 'INSERT INTO `esi` (`killID`, `killReport`)  VALUES ( ?, ?)'
 
-        logger.info("Parsing loss data for killID {0}".format(killReport['killmail_id']))
+        rowlog.info("Parsing loss data for killID %s", killReport['killmail_id'])
 
         try:
-            kill = (killReport['killmail_id'], json.dumps(killReport))
-            logger.debug("Executing INSERT on `esi` for data {0}".format(kill))
+            kill = (killReport['killmail_id'], codec.encode(killReport))
+            rowlog.debug("Executing INSERT on `esi` for killID %s", kill[0])
             self.cursor.execute(insert_kill, kill)
-            logger.info("Successfully parsed kill data for killID {0}".format(killReport['killmail_id']))
+            self.shred_killdata([killReport])
             
             if commit: 
                 self.connection.commit()
@@ -236,13 +285,12 @@ class DBHandler(object):
 
         insert_player = 'INSERT INTO `character` (`characterID`, `name`, `corporationID`, `race`, `birthday`) VALUES (?, ?, ?, ?, ?)'
 
-        logger.info("Parsing player {0}".format(characterID))
+        rowlog.info("Parsing player %s", characterID)
 
         try:
             player = (characterID, playerProfile['name'], playerProfile['corporation_id'], playerProfile['race_id'], playerProfile['birthday'])
-            logger.debug("Executing INSERT on `character` for data {0}".format(player))
+            rowlog.debug("Executing INSERT on `character` for data %s", player)
             self.cursor.execute(insert_player, player)
-            logger.info("Successfully parsed kill data for killID {0}".format(characterID))
             
             if commit: 
                 self.connection.commit()
@@ -252,9 +300,476 @@ class DBHandler(object):
             logger.exception(e)     
 
 
+    def bulk_insert(self, statement, rows, batch_size=db_batch_size, on_batch=None):
+        """ Runs `statement` over `rows`, one transaction per batch, passing the rows it inserted to `on_batch`. Returns (inserted, skipped, failed) """
+
+        inserted = 0
+        skipped = 0
+        failed = 0
+        batch = []
+
+        for row in rows:
+            if row is None:
+                skipped = skipped + 1
+                continue
+
+            batch.append(row)
+            if len(batch) >= batch_size:
+                added = self.insert_batch(statement, batch, on_batch)
+                if added is None:
+                    failed = failed + len(batch)
+                else:
+                    inserted = inserted + added
+                    skipped = skipped + len(batch) - added
+                batch = []
+
+        if batch:
+            added = self.insert_batch(statement, batch, on_batch)
+            if added is None:
+                failed = failed + len(batch)
+            else:
+                inserted = inserted + added
+                skipped = skipped + len(batch) - added
+
+        if failed:
+            logger.error("{0} rows were not stored: {1}".format(failed, statement))
+        return inserted, skipped, failed
+
+    def insert_batch(self, statement, batch, on_batch=None):
+        """ Inserts one batch inside a single transaction, rolling it back on error. Returns the rows added, None if it failed """
+
+        try:
+            logger.debug("Executing batch of %s rows: %s", len(batch), statement)
+            if on_batch is None:
+                self.cursor.executemany(statement, batch)
+                # rowcount, unlike total_changes, leaves out the `data_version` trigger updates
+                added = self.cursor.rowcount
+            else:
+                # Rows another writer stored first are ignored here, and must not reach on_batch a second time
+                rows = []
+                for row in batch:
+                    self.cursor.execute(statement, row)
+                    if self.cursor.rowcount > 0:
+                        rows.append(row)
+                on_batch(rows)
+                added = len(rows)
+
+            with metrics.timer('db_commit_seconds'):
+                self.connection.commit()
+            return added
+
+        except Exception as e:
+            self.connection.rollback()
+            logger.error("Unexpected error occurred while inserting a batch of {0} rows.".format(len(batch)))
+            logger.exception(e)
+            return None
+
+    @metrics.instrumented
+    def ingest_kills(self, killReports, batch_size=db_batch_size):
+        """ Bulk inserts zkillboard reports into `zkill`, skipping kills already present """
+
+        insert_kill = 'INSERT OR IGNORE INTO `zkill` (`killID`, `hash`, `value`, `killReport`)  VALUES ( ?, ?, ?, ?)'
+
+        def rows():
+            for killReport in killReports:
+                try:
+                    yield (killReport['killmail_id'], killReport['zkb']['hash'], killReport['zkb']['totalValue'], codec.encode(killReport))
+                except (KeyError, TypeError):
+                    logger.error("Malformed killreport for `zkill`: {0}".format(killReport))
+                    yield None
+
+        inserted, skipped, failed = self.bulk_insert(insert_kill, rows(), batch_size)
+        logger.info("Ingested {0} kills into `zkill`, skipped {1}, failed {2}.".format(inserted, skipped, failed))
+        return inserted, skipped, failed
+
+    @metrics.instrumented
+    def ingest_killdata(self, killReports, batch_size=db_batch_size):
+        """ Bulk inserts ESI kill reports into `esi`, skipping kills already present """
+
+        insert_kill = 'INSERT OR IGNORE INTO `esi` (`killID`, `killReport`)  VALUES ( ?, ?)'
+
+        pending = {}
+
+        def rows():
+            for killReport in killReports:
+                try:
+                    pending[killReport['killmail_id']] = killReport
+                    yield (killReport['killmail_id'], codec.encode(killReport))
+                except (KeyError, TypeError):
+                    logger.error("Malformed killreport for `esi`: {0}".format(killReport))
+                    yield None
+
+        def shred_batch(batch):
+            self.shred_killdata([pending.pop(killID) for killID, _ in batch])
+
+        inserted, skipped, failed = self.bulk_insert(insert_kill, rows(), batch_size, shred_batch)
+        logger.info("Ingested {0} kills into `esi`, skipped {1}, failed {2}.".format(inserted, skipped, failed))
+        return inserted, skipped, failed
+
+    def shred_killdata(self, killReports):
+        """ Splits ESI kill reports into the relational killmail tables, inside the caller's transaction """
+        return self.insert_shredded(shred(killReports))
+
+    def insert_shredded(self, tables):
+        insert_killmail = 'INSERT OR IGNORE INTO `killmail` (`killID`, `time`, `solarSystemID`, `attackers`) VALUES (?, ?, ?, ?)'
+        insert_attacker = 'INSERT OR IGNORE INTO `attacker` (`killID`, `position`, `characterID`, `corporationID`, `allianceID`, `shipID`, `weaponID`, `damage`, `final_blow`) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        insert_victim = 'INSERT OR IGNORE INTO `victim` (`killID`, `characterID`, `corporationID`, `allianceID`, `shipID`, `damage_taken`) VALUES (?, ?, ?, ?, ?, ?)'
+        insert_item = 'INSERT OR IGNORE INTO `item` (`killID`, `position`, `itemID`, `flag`, `quantity_destroyed`, `quantity_dropped`, `singleton`) VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+        killmails, attackers, victims, items = tables
+        self.cursor.executemany(insert_killmail, killmails)
+        self.cursor.executemany(insert_attacker, attackers)
+        self.cursor.executemany(insert_victim, victims)
+        self.cursor.executemany(insert_item, items)
+        return len(killmails)
+
+    def parallel(self, processes):
+        """ Number of worker processes to use, or None when work has to stay in this process """
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes <= 1 or self.database_file == ':memory:':
+            return None
+        return processes
+
+    @metrics.instrumented
+    def shred_missing(self, batch_size=db_batch_size, processes=1):
+        """ Backfill the relational killmail tables from `esi` rows stored before they existed """
+
+        shredded = 0
+        processes = self.parallel(processes)
+
+        if processes is None:
+            while True:
+                self.cursor.execute(unshredded_query, (0, 2 ** 63 - 1, batch_size))
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+
+                with self.connection:
+                    shredded = shredded + self.shred_killdata(codec.decode(killReport) for _, killReport in rows)
+        else:
+            self.cursor.execute('SELECT E.`killID` FROM `esi` E LEFT JOIN `killmail` K ON E.`killID` = K.`killID` WHERE K.`killID` IS NULL ORDER BY E.`killID`;')
+            killIDs = [killID for killID, in self.cursor.fetchall()]
+            tasks = [(self.database_file, low, high) for low, high in shards(killIDs, batch_size)]
+
+            logger.info("Shredding {0} stored ESI reports in {1} shards on {2} processes".format(len(killIDs), len(tasks), processes))
+            with multiprocessing.Pool(processes) as pool:
+                for tables in pool.imap(shred_shard, tasks):
+                    with self.connection:
+                        shredded = shredded + self.insert_shredded(tables)
+
+        if shredded:
+            logger.info("Shredded {0} stored ESI reports into the killmail tables".format(shredded))
+        return shredded
+
+    def apply_spree(self, fights):
+        """ Keeps the materialized boards in step with a batch of spree rows, inside the caller's transaction """
+
+        self.update_scores(fights)
+        self.extend_streaks(fights)
+
+    def update_scores(self, fights):
+        """ Adds a batch of spree rows to `player_score` and `ship_score` """
+
+        isk = 'IFNULL((SELECT `value` FROM `zkill` WHERE `killID` = ?), 0)'
+        player_win = ('INSERT INTO `player_score` (`characterID`, `wins`, `isk_destroyed`) VALUES (?, 1, ' + isk + ') '
+            'ON CONFLICT(`characterID`) DO UPDATE SET `wins` = `wins` + 1, `isk_destroyed` = `isk_destroyed` + excluded.`isk_destroyed`')
+        player_loss = ('INSERT INTO `player_score` (`characterID`, `losses`) VALUES (?, 1) '
+            'ON CONFLICT(`characterID`) DO UPDATE SET `losses` = `losses` + 1')
+        ship_win = ('INSERT INTO `ship_score` (`characterID`, `shipID`, `wins`, `isk_destroyed`) VALUES (?, ?, 1, ' + isk + ') '
+            'ON CONFLICT(`characterID`, `shipID`) DO UPDATE SET `wins` = `wins` + 1, `isk_destroyed` = `isk_destroyed` + excluded.`isk_destroyed`')
+        ship_loss = ('INSERT INTO `ship_score` (`characterID`, `shipID`, `losses`) VALUES (?, ?, 1) '
+            'ON CONFLICT(`characterID`, `shipID`) DO UPDATE SET `losses` = `losses` + 1')
+
+        self.cursor.executemany(player_win, [(fight[1], fight[0]) for fight in fights])
+        self.cursor.executemany(player_loss, [(fight[4],) for fight in fights])
+        self.cursor.executemany(ship_win, [(fight[1], fight[2], fight[0]) for fight in fights])
+        self.cursor.executemany(ship_loss, [(fight[4], fight[5]) for fight in fights])
+
+    @metrics.instrumented
+    def rebuild_scores(self, commit=True):
+        """ Recomputes `player_score` and `ship_score` from `spree` """
+
+        try:
+            logger.info("Rebuilding `player_score` and `ship_score` from `spree`")
+            self.cursor.execute('DELETE FROM `player_score`')
+            self.cursor.execute('INSERT INTO `player_score` (`characterID`, `wins`, `losses`, `isk_destroyed`) ' + player_score_query)
+            self.cursor.execute('DELETE FROM `ship_score`')
+            self.cursor.execute('INSERT INTO `ship_score` (`characterID`, `shipID`, `wins`, `losses`, `isk_destroyed`) ' + ship_score_query)
+
+            if commit:
+                self.connection.commit()
+
+        except Exception as e:
+            logger.error("Unexpected error occurred while rebuilding scores.")
+            logger.exception(e)
+            if not commit:
+                raise
+            self.connection.rollback()
+
+    def check_aggregates(self, repair=False):
+        """ Compares the materialized scores and streaks against `spree`, rebuilding the ones that drifted if `repair` """
+
+        def rounded(rows):
+            return [row[:-1] + (round(row[-1], 2),) for row in rows]
+
+        checks = {
+            'player_score': (player_score_query, 'SELECT `characterID`, `wins`, `losses`, `isk_destroyed` FROM `player_score` ORDER BY `characterID`'),
+            'ship_score': (ship_score_query, 'SELECT `characterID`, `shipID`, `wins`, `losses`, `isk_destroyed` FROM `ship_score` ORDER BY `characterID`, `shipID`'),
+        }
+
+        drifted = []
+        for table, (expected_query, stored_query) in checks.items():
+            self.cursor.execute(expected_query)
+            expected = rounded(self.cursor.fetchall())
+            self.cursor.execute(stored_query)
+            if rounded(self.cursor.fetchall()) != expected:
+                drifted.append(table)
+
+        self.cursor.execute('SELECT `killID`, `attackerID`, `attacker_shipID`, `victimID`, `victim_shipID` FROM `spree` ORDER BY `killID`')
+        expected = sorted(runs(results(self.cursor.fetchall())), key=lambda streak: (streak[0], streak[1], streak[3]))
+        self.cursor.execute('SELECT `characterID`, `shipID`, `result`, `start`, `end`, `matches` FROM `streak` ORDER BY `characterID`, `shipID`, `start`')
+        if self.cursor.fetchall() != expected:
+            drifted.append('streak')
+
+        for table in drifted:
+            logger.warn("Materialized table `{0}` does not match `spree`.".format(table))
+
+        if repair and drifted:
+            if 'streak' in drifted:
+                self.rebuild_streaks()
+            if 'player_score' in drifted or 'ship_score' in drifted:
+                self.rebuild_scores()
+
+        return drifted
+
+    def extend_streaks(self, fights):
+        """ Extends `streak` with newly inserted spree rows, inside the caller's transaction """
+
+        latest = 'SELECT `result`, `start`, `end` FROM `streak` WHERE `characterID` = ? AND `shipID` = ? ORDER BY `start` DESC LIMIT 1'
+        extend = 'UPDATE `streak` SET `end` = ?, `matches` = `matches` + 1 WHERE `characterID` = ? AND `shipID` = ? AND `start` = ?'
+        insert = 'INSERT INTO `streak` (`characterID`, `shipID`, `result`, `start`, `end`, `matches`) VALUES (?, ?, ?, ?, ?, 1)'
+
+        stale = set()
+        for killID, characterID, shipID, result in results(sorted(fight[:3] + fight[4:6] for fight in fights)):
+            if (characterID, shipID) in stale:
+                continue
+
+            self.cursor.execute(latest, (characterID, shipID))
+            run = self.cursor.fetchone()
+
+            if run is None:
+                self.cursor.execute(insert, (characterID, shipID, result, killID, killID))
+            elif killID < run[2]:
+                # Arrived out of order, the runs for this pair have to be recounted
+                stale.add((characterID, shipID))
+            elif run[0] == result:
+                self.cursor.execute(extend, (killID, characterID, shipID, run[1]))
+            else:
+                self.cursor.execute(insert, (characterID, shipID, result, killID, killID))
+
+        for characterID, shipID in stale:
+            logger.info("Rebuilding streaks for player {0} in ship {1}".format(characterID, shipID))
+            self.rebuild_streaks(characterID, shipID, commit=False)
+
+    @metrics.instrumented
+    def rebuild_streaks(self, characterID=None, shipID=None, commit=True):
+        """ Recomputes `streak` from `spree` in a single ordered pass, optionally for one player/ship pair only """
+
+        query = 'SELECT `killID`, `attackerID`, `attacker_shipID`, `victimID`, `victim_shipID` FROM `spree`'
+        clear = 'DELETE FROM `streak`'
+        params = ()
+
+        if characterID is not None:
+            query = query + ' WHERE (`attackerID` = ? AND `attacker_shipID` = ?) OR (`victimID` = ? AND `victim_shipID` = ?)'
+            clear = clear + ' WHERE `characterID` = ? AND `shipID` = ?'
+            params = (characterID, shipID)
+
+        insert = 'INSERT INTO `streak` (`characterID`, `shipID`, `result`, `start`, `end`, `matches`) VALUES (?, ?, ?, ?, ?, ?)'
+
+        try:
+            logger.debug("Executing Query {0}".format(query))
+            self.cursor.execute(query + ' ORDER BY `killID`;', params + params)
+            fights = self.cursor.fetchall()
+
+            streaks = runs(results(fights))
+            if characterID is not None:
+                streaks = [streak for streak in streaks if streak[:2] == (characterID, shipID)]
+
+            self.cursor.execute(clear, params)
+            self.cursor.executemany(insert, streaks)
+            logger.info("Rebuilt streaks from {0} spree rows".format(len(fights)))
+
+            if commit:
+                self.connection.commit()
+
+        except Exception as e:
+            logger.error("Unexpected error occurred while rebuilding streaks.")
+            logger.exception(e)
+            if not commit:
+                raise
+            self.connection.rollback()
+
+    @metrics.instrumented
+    def compress_reports(self, codec_name=codec.storage_codec, batch_size=db_batch_size, vacuum=True):
+        """ Migrate `zkill` and `esi` reports still stored as JSON text to `codec_name` """
+
+        if codec_name is None:
+            logger.warn("No codec given, reports are left as JSON text.")
+            return
+
+        for table in ('zkill', 'esi'):
+            query = 'SELECT `killID`, `killReport` FROM `{0}` WHERE typeof(`killReport`) = \'text\' LIMIT ?;'.format(table)
+            update = 'UPDATE `{0}` SET `killReport` = ? WHERE `killID` = ?'.format(table)
+            converted = 0
+
+            while True:
+                self.cursor.execute(query, (batch_size,))
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+
+                with self.connection:
+                    self.cursor.executemany(update, [(codec.encode(codec.decode(killReport), codec_name), killID) for killID, killReport in rows])
+                converted = converted + len(rows)
+
+            logger.info("Converted {0} reports in `{1}` to {2}".format(converted, table, codec_name))
+
+        if vacuum:
+            logger.info("Vacuuming database to release freed pages")
+            self.connection.execute('VACUUM')
+
     def get_lastkill(self, identifier, base):
         """ Get last known kill based on the identifier/base combination """
-        pass
+        return self.get_lastkill_query(sync_key(identifier, base))
+
+    def get_lastkill_query(self, query):
+        """ Get the highest killID ingested for a sync query, or None if it was never synced """
+
+        try:
+            self.cursor.execute('SELECT `last_killID` FROM `sync_state` WHERE `query` = ?;', (query,))
+            response = self.cursor.fetchone()
+            logger.debug("Last known kill for {0}: {1}".format(query, response))
+            return None if response is None else response[0]
+        except Exception as e:
+            logger.error("Unexpected error occurred while querying sync state for {0}.".format(query))
+            logger.exception(e)
+            return None
+
+    def set_lastkill(self, query, killID, commit=True):
+        """ Raise the high-water mark of a sync query to `killID` """
+
+        update = ('INSERT INTO `sync_state` (`query`, `last_killID`) VALUES (?, ?) '
+            'ON CONFLICT(`query`) DO UPDATE SET `last_killID` = MAX(`last_killID`, excluded.`last_killID`)')
+
+        logger.info("Setting last known kill for {0} to {1}".format(query, killID))
+        self.cursor.execute(update, (query, killID))
+        if commit:
+            self.connection.commit()
+
+    @metrics.instrumented
+    def sync(self, identifier, base):
+        """ Ingest reports newer than the last known kill for an identifier/base combination """
+
+        query = sync_key(identifier, base)
+        return self.ingest_new(query, iter_killreports(identifier, base, self.get_lastkill_query(query)))
+
+    @metrics.instrumented
+    def sync_query(self, query):
+        """ Ingest reports newer than the last known kill for a raw zkillboard query """
+
+        return self.ingest_new(query, iter_killreports_query(query, self.get_lastkill_query(query)))
+
+    def ingest_new(self, query, killReports):
+        """ Stream a sync result into `zkill` and move the query's high-water mark once all of it is stored without a failed batch """
+
+        newest = []
+        failed = []
+
+        def tracked():
+            try:
+                for killReport in killReports:
+                    if not newest or killReport['killmail_id'] > newest[0]:
+                        newest[:] = [killReport['killmail_id']]
+                    yield killReport
+            except IOError as e:
+                failed.append(e)
+
+        inserted, skipped, lost = self.ingest_kills(tracked())
+
+        if failed:
+            # Kills below the failed page were never seen, the next sync has to page down to the old mark again
+            logger.error("Sync of {0} stopped early ({1}), keeping its last known kill.".format(query, failed[0]))
+        elif lost:
+            # Rolled back kills sit below the new mark, only paging down to the old one brings them back
+            logger.error("Sync of {0} could not store {1} kills, keeping its last known kill.".format(query, lost))
+        elif not newest:
+            logger.info("No new kills for {0}".format(query))
+        else:
+            self.set_lastkill(query, newest[0])
+
+        return inserted, skipped
+
+    def register_events(self, events):
+        """ Upsert event definitions ({name, query, start, end} dicts) into `event`, returns {name: eventID} """
+
+        upsert = ('INSERT INTO `event` (`name`, `query`, `start`, `end`) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(`name`) DO UPDATE SET `query` = excluded.`query`, `start` = excluded.`start`, `end` = excluded.`end`')
+
+        rows = [(event['name'], event['query'], self.killmail_time(event.get('start')), self.killmail_time(event.get('end'))) for event in events]
+        with self.connection:
+            self.cursor.executemany(upsert, rows)
+        self.cursor.execute('SELECT `name`, `eventID` FROM `event`;')
+        return dict(self.cursor.fetchall())
+
+    def killmail_time(self, value):
+        """ A window bound in the form of `killmail`.`time`, which the event queries compare it to as text """
+
+        if value is None:
+            return None
+
+        self.cursor.execute("SELECT strftime('%Y-%m-%dT%H:%M:%SZ', ?);", (value,))
+        normalized = self.cursor.fetchone()[0]
+        if normalized is None:
+            raise ValueError("Unrecognized event time {0}".format(value))
+        return normalized
+
+    @metrics.instrumented
+    def sync_event(self, eventID, query):
+        """ Ingest an event's new reports, storing each kill once however many events share it, and assign them all to the event """
+
+        key = "event/{0}/{1}".format(eventID, query)
+        killIDs = []
+
+        def tracked():
+            for killReport in iter_killreports_query(query, self.get_lastkill_query(key)):
+                killIDs.append(killReport['killmail_id'])
+                yield killReport
+
+        inserted, skipped = self.ingest_new(key, tracked())
+        self.assign_kills(eventID, killIDs)
+        return inserted, skipped
+
+    def assign_kills(self, eventID, killIDs):
+        """ Add kills to an event's partition in `event_kill` """
+
+        with self.connection:
+            self.cursor.executemany('INSERT OR IGNORE INTO `event_kill` (`eventID`, `killID`) VALUES (?, ?)', [(eventID, killID) for killID in killIDs])
+        logger.info("Assigned {0} kills to event {1}".format(len(killIDs), eventID))
+
+    @metrics.instrumented
+    def rebuild_event_scores(self, eventID):
+        """ Recomputes one event's `event_score` partition from its kills inside the event window """
+
+        try:
+            with self.connection:
+                self.cursor.execute('DELETE FROM `event_score` WHERE `eventID` = ?', (eventID,))
+                self.cursor.execute('INSERT INTO `event_score` (`eventID`, `characterID`, `shipID`, `wins`, `losses`, `isk_destroyed`) ' + event_score_query, {'eventID': eventID})
+            logger.info("Rebuilt scores for event {0}".format(eventID))
+        except Exception as e:
+            logger.error("Unexpected error occurred while rebuilding scores for event {0}.".format(eventID))
+            logger.exception(e)
 
     def kill_exists(self, killID):
         """ Check `zkill` table for this `killID` """
@@ -277,29 +792,42 @@ class DBHandler(object):
             return True
 
     def valid_ship(self, shipID):
-        """ Check `ships` table for this `shipID` """
+        """ Check `ships` for this `shipID`, through the cached ship index """
+        return shipID in self.ship_index(ship_groups)
 
-        query = "SELECT `shipID` FROM `ships` WHERE `shipID` = {0};".format(shipID)
-        try:
-            logger.debug("Executing Query {0}".format(query))
-            self.cursor.execute(query)
-            response = self.cursor.fetchone()
-            logger.debug("Query Response: {0}".format(response))
-            if response is None:
-                logger.info("ShipID {0} was not found in the database.".format(shipID))
-                return False
-            else:
-                logger.info("ShipID {0} was found in the database.".format(shipID))
-                return True
-        except Exception as e:
-            logger.error("Unexpected error occurred while querying for shipID {0}.".format(shipID))
-            logger.exception(e)
-            return False
+    def ship_index(self, groups=None):
+        """ Frozen lookup of `ships`, optionally limited to `groups`, loaded once per handler """
 
+        key = None if groups is None else frozenset(groups)
+        if key not in self.ships:
+            self.cursor.execute('SELECT `shipID`, `groupID`, `name` FROM `ships`;')
+            self.ships[key] = ShipIndex(self.cursor.fetchall(), groups)
+            logger.info("Loaded {0} ships into the ship index".format(len(self.ships[key])))
+        return self.ships[key]
 
-    def fetch_missing_kills(self):
+    @metrics.instrumented
+    def import_ships(self, path, groups=None, groups_path=None, batch_size=db_batch_size):
+        """ Bulk load ship types of `groups`, or of the Ship category groups listed in `groups_path`, from a static data dump into `ships` """
+
+        insert_ship = 'INSERT OR REPLACE INTO `ships` (`shipID`, `groupID`, `name`) VALUES (?, ?, ?)'
+
+        if groups is None and groups_path is not None:
+            groups = load_ship_groups(groups_path)
+        if groups is None:
+            raise ValueError("Not importing every type in {0}, give the ship groups or an invGroups dump".format(path))
+
+        logger.info("Importing ships from {0}".format(path))
+        inserted, skipped, failed = self.bulk_insert(insert_ship, load_ships(path, groups), batch_size)
+        logger.info("Imported {0} ships, skipped {1}, failed {2}.".format(inserted, skipped, failed))
+
+        self.ships = {}
+        return inserted, skipped, failed
+
+
+    @metrics.instrumented
+    def fetch_missing_kills(self, concurrent=True, batch_size=esi_batch_size):
         """ Fill `esi` table with missing data """
-        query = "SELECT Z.`killID`, Z.`hash` from `zkill` Z LEFT JOIN `esi` E ON Z.`killID` = E.`killID` WHERE E.`killID` IS NULL;"
+        query = missing_kills_query
 
         try:
             logger.debug("Executing Query {0}".format(query))
@@ -309,63 +837,96 @@ class DBHandler(object):
 
             logger.info("Missing Records to process: {0}".format(len(data)))
 
-            for killID, key in data:
-                self.parse_killdata(fetch_kill(killID, key))
+            if not concurrent:
+                for killID, key in data:
+                    self.parse_killdata(fetch_kill(killID, key))
+                return
+
+            def received():
+                for killID, killData in fetch_kills(data):
+                    if killData is None:
+                        logger.warn("No ESI data received for killID {0}, it will be retried on the next run.".format(killID))
+                        continue
+                    yield killData
+
+            self.ingest_killdata(received(), batch_size)
 
         except Exception as e:
             logger.error("Unexpected error occurred while querying for missing kills.")
             logger.exception(e)
             return
 
-    def parse_spree(self, commit=True):
-        """Fill `esi` table with missing data """
+    @metrics.instrumented
+    def parse_spree(self, batch_size=db_batch_size, reprocess=False, processes=spree_processes):
+        """Fill `spree` table from unprocessed kills, or from every kill again if `reprocess`
+
+        With more than one process, unprocessed killIDs are sharded into ranges that
+        worker processes evaluate on their own read-only connections, while this
+        process stays the single writer and applies the shards in killID order.
+        """
 
-        query = 'SELECT E.`killID`, E.`killReport` FROM `esi` E LEFT JOIN `spree` S ON E.`killID` = S.`killID` WHERE S.`killID` IS NULL;'
-        insert_spree = 'INSERT INTO `spree` (`killID`, `attackerID`, `attacker_shipID`, `weaponID`, `victimID`, `victim_shipID`, `valid`, `eligible`)  VALUES ( ?, ?, ?, ?, ?, ?, ?, ?)'
+        processes = self.parallel(processes)
 
         try:
-            logger.debug("Executing Query {0}".format(query))
-            self.cursor.execute(query)
+            self.shred_missing(processes=processes or 1)
 
-            data = self.cursor.fetchall()
-            logger.info("Spree Records to process: {0}".format(len(data)))
+            if reprocess:
+                logger.info("Clearing `spree` and its materialized boards for reprocessing")
+                with self.connection:
+                    for table in ('spree', 'player_score', 'ship_score', 'streak'):
+                        self.cursor.execute('DELETE FROM `{0}`'.format(table))
+
+            ships = self.ship_index(ship_groups)
+
+            if processes is None:
+                logger.debug("Executing Query {0}".format(spree_query))
+                self.cursor.execute(spree_query, (0, 2 ** 63 - 1))
+
+                data = self.cursor.fetchall()
+                logger.info("Spree Records to process: {0}".format(len(data)))
+                rows = spree_rows(data, ships)
+            else:
+                self.cursor.execute('SELECT K.`killID` FROM `killmail` K LEFT JOIN `spree` S ON S.`killID` = K.`killID` WHERE S.`killID` IS NULL ORDER BY K.`killID`;')
+                killIDs = [killID for killID, in self.cursor.fetchall()]
+                tasks = [(self.database_file, low, high, ships.shipIDs) for low, high in shards(killIDs, spree_shard_size)]
+
+                logger.info("Spree Records to process: {0} in {1} shards on {2} processes".format(len(killIDs), len(tasks), processes))
+                pool = multiprocessing.Pool(processes)
+                rows = (row for shard in pool.imap(evaluate_shard, tasks) for row in shard)
 
         except Exception as e:
             logger.error("Unexpected error occurred while querying for missing kills.")
             logger.exception(e)
             return
 
-        for killID, killReport in data:
-            killData = json.loads(killReport)
-            for attacker in killData['attackers']:
-                if(attacker["final_blow"] == True):
-                    killer = attacker
+        try:
+            inserted, skipped, failed = self.bulk_insert(insert_spree, rows, batch_size, self.apply_spree)
+        finally:
+            if processes is not None:
+                pool.terminate()
 
-            if self.valid_ship(killer['ship_type_id']) and self.valid_ship(killData['victim']['ship_type_id']):
-                kill = (killID, killer['character_id'], killer['ship_type_id'], killer['weapon_type_id'], killData['victim']['character_id'], killData['victim']['ship_type_id'], 0, 0)
-                
-                try:
-                    logger.debug("Executing INSERT on `esi` for data {0}".format(kill))
-                    self.cursor.execute(insert_spree, kill)
-                    logger.info("Successfully parsed kill data for killID {0}".format(killData['killmail_id']))
-                    
-                    if commit: 
-                        self.connection.commit()
-
-                except Exception as e:
-                    logger.error("Unexpected error occurred while working with killreport for `spree`: {0}".format(killID))
-                    logger.exception(e)
-            else:
-                logger.info("Ships were not valid for {0}: {1} vs {2}".format(killID, killer['ship_type_id'], killData['victim']['ship_type_id']))
+        logger.info("Inserted {0} kills into `spree`, skipped {1}, failed {2}.".format(inserted, skipped, failed))
+        return inserted, skipped, failed
+
+    def spree_range(self, low, high):
+        """ Evaluate the unprocessed kills between two killIDs into `spree`, returns the rows inserted """
+
+        inserted = []
+
+        def apply(fights):
+            self.apply_spree(fights)
+            inserted.extend(fights)
+
+        self.cursor.execute(spree_query, (low, high))
+        self.bulk_insert(insert_spree, spree_rows(self.cursor.fetchall(), self.ship_index(ship_groups)), db_batch_size, apply)
+        return inserted
 
+    @metrics.instrumented
     def fetch_missing_players(self):
         """Fill `character` table with missing data """
-        
-        query = """SELECT id FROM (
-                    SELECT DISTINCT `attackerID` AS `id` FROM `spree` UNION 
-                    SELECT DISTINCT `victimID` AS `id` FROM `spree`
-                ) LEFT JOIN `character` C ON C.`characterID` = `id` WHERE C.`characterID` IS NULL;"""
-        
+
+        query = missing_players_query
+
         try:
             logger.debug("Executing Query {0}".format(query))
             self.cursor.execute(query)
@@ -373,14 +934,68 @@ class DBHandler(object):
             data = self.cursor.fetchall()
 
             logger.info("Missing Records to process: {0}".format(len(data)))
-            for characterID in data:
-                self.parse_player(characterID[0], fetch_player(characterID[0]))
+            characterIDs = [characterID for characterID, in data]
 
         except Exception as e:
-            logger.error("Unexpected error occurred while querying for missing kills.")
+            logger.error("Unexpected error occurred while querying for missing players.")
             logger.exception(e)
             return
 
+        resolved, unresolved = resolve_players(characterIDs)
+        self.store_players(resolved, fetch_players(unresolved))
+        logger.info("Resolved {0} of {1} players in bulk".format(len(resolved), len(characterIDs)))
+
+        self.fetch_missing_profiles()
+
+    def store_players(self, resolved, profiles):
+        """ Insert bulk-resolved (characterID, name, corporationID) rows, then (characterID, profile) pairs for the rest """
+
+        insert_player = 'INSERT OR IGNORE INTO `character` (`characterID`, `name`, `corporationID`) VALUES (?, ?, ?)'
+        inserted, _, _ = self.bulk_insert(insert_player, resolved)
+
+        for characterID, playerProfile in profiles:
+            if playerProfile is None:
+                logger.warn("No profile received for player {0}, it will be retried on the next run.".format(characterID))
+                continue
+            self.parse_player(characterID, playerProfile, commit=False)
+        self.connection.commit()
+        return inserted
+
+    @metrics.instrumented
+    def fetch_missing_profiles(self, batch_size=esi_batch_size):
+        """ Fill race and birthday, which the bulk endpoints do not return, from per-character profiles """
+
+        query = 'SELECT `characterID` FROM `character` WHERE `race` IS NULL OR `birthday` IS NULL;'
+
+        try:
+            logger.debug("Executing Query {0}".format(query))
+            self.cursor.execute(query)
+
+            data = self.cursor.fetchall()
+            logger.info("Profiles to complete: {0}".format(len(data)))
+
+        except Exception as e:
+            logger.error("Unexpected error occurred while querying for incomplete players.")
+            logger.exception(e)
+            return
+
+        return self.complete_profiles(fetch_players(characterID for characterID, in data), batch_size)
+
+    def complete_profiles(self, profiles, batch_size=esi_batch_size):
+        """ Store race and birthday from (characterID, profile) pairs, skipping the profiles that were not received """
+
+        update_player = 'UPDATE `character` SET `race` = ?, `birthday` = ? WHERE `characterID` = ?'
+
+        def rows():
+            for characterID, playerProfile in profiles:
+                if playerProfile is None:
+                    logger.warn("No profile received for player {0}, it will be retried on the next run.".format(characterID))
+                    yield None
+                    continue
+                yield (playerProfile['race_id'], playerProfile['birthday'], characterID)
+
+        return self.bulk_insert(update_player, rows(), batch_size)
+
     def get_query(self, query):
         try:
             logger.debug("Executing Query {0}".format(query))
@@ -0,0 +1,229 @@
+import logging
+import queue
+import sqlite3
+import threading
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import metrics
+
+from config import logging_file, read_pool_size, write_batch_size, write_queue_size
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Concurrent access to the SQLite database: WAL mode, a pool of read-only
+connections for report queries, and a single writer thread that applies
+every mutation from a bounded queue. Readers never wait on the writer under
+WAL, and there is only ever one writer, so nothing hits `database is locked`.
+"""
+
+
+def enable_wal(connection):
+    mode = connection.execute('PRAGMA journal_mode=WAL;').fetchone()[0]
+    connection.execute('PRAGMA synchronous=NORMAL;')
+    if mode.lower() != 'wal':
+        logger.warn("Database did not switch to WAL, journal mode is {0}".format(mode))
+    return mode
+
+
+class Result(object):
+    """ Fully fetched query result, detached from the pooled connection that produced it """
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class ReadPool(object):
+    """ Read-only connections handed out one per concurrent query """
+
+    def __init__(self, database_file, size=read_pool_size):
+        self.database_file = database_file
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(None)
+
+    def open(self):
+        connection = sqlite3.connect('file:{0}?mode=ro'.format(self.database_file), uri=True, check_same_thread=False, timeout=30)
+        logger.debug("Opened read-only connection to %s", self.database_file)
+        return connection
+
+    @contextmanager
+    def connection(self):
+        connection = self.connections.get()
+        try:
+            if connection is None:
+                connection = self.open()
+            yield connection
+        finally:
+            self.connections.put(connection)
+
+    def execute(self, query, params=()):
+        with self.connection() as connection:
+            with metrics.timer('db_read_seconds'):
+                cursor = connection.execute(query, params)
+                return Result(cursor.description, cursor.fetchall())
+
+    def close(self):
+        while not self.connections.empty():
+            connection = self.connections.get_nowait()
+            if connection is not None:
+                connection.close()
+
+
+class Writer(threading.Thread):
+    """ The only thread that writes. Queued statements are grouped into one transaction per batch,
+    queued calls get exclusive use of a DBHandler bound to the writer connection """
+
+    stop = object()
+
+    def __init__(self, database_file, batch_size=write_batch_size, queue_size=write_queue_size):
+        threading.Thread.__init__(self, name='sqlite-writer', daemon=True)
+        self.database_file = database_file
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = None
+        self.ready = threading.Event()
+
+    def run(self):
+        from dbactions import DBHandler
+
+        self.handler = DBHandler()
+        self.handler.connect(self.database_file)
+        self.ready.set()
+
+        try:
+            pending = None
+            while True:
+                item = pending if pending is not None else self.queue.get()
+                pending = None
+                if item is self.stop:
+                    break
+
+                if item[0] == 'call':
+                    self.run_call(item)
+                    continue
+
+                batch = [item]
+                while len(batch) < self.batch_size:
+                    try:
+                        following = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if following is self.stop or following[0] == 'call':
+                        # Whatever ends a batch runs right after it, keeping queue order
+                        pending = following
+                        break
+                    batch.append(following)
+
+                self.run_batch(batch)
+        finally:
+            # Closed here, on the thread that opened it, a failed call's traceback can keep the handler alive past this thread
+            self.handler.connection.close()
+            self.handler.connection = None
+
+    def run_call(self, item):
+        _, function, future = item
+        try:
+            future.set_result(function(self.handler))
+        except Exception as e:
+            logger.error("Unexpected error occurred in a queued database call.")
+            logger.exception(e)
+            future.set_exception(e)
+
+    def run_batch(self, batch):
+        connection = self.handler.connection
+        try:
+            with metrics.timer('db_write_batch_seconds'):
+                with connection:
+                    results = [self.execute(connection, item) for item in batch]
+            metrics.observe('db_write_batch_rows', len(batch))
+            for item, result in zip(batch, results):
+                item[-1].set_result(result)
+            return
+        except Exception as e:
+            logger.error("Write batch of {0} statements failed, retrying them one by one.".format(len(batch)))
+            logger.exception(e)
+
+        for item in batch:
+            try:
+                with connection:
+                    result = self.execute(connection, item)
+            except Exception as e:
+                item[-1].set_exception(e)
+            else:
+                # Only once committed, so a reader acting on the result sees the row
+                item[-1].set_result(result)
+
+    def execute(self, connection, item):
+        _, statement, params, many, _ = item
+        if many:
+            return connection.executemany(statement, params).rowcount
+        return connection.execute(statement, params).rowcount
+
+    def submit(self, statement, params=(), many=False):
+        """ Queue one statement (or executemany when `many`), blocking while the queue is full """
+
+        if many:
+            # A generator would be spent by the batch, leaving nothing for the one-by-one retry
+            params = list(params)
+
+        future = Future()
+        self.queue.put(('sql', statement, params, many, future))
+        return future
+
+    def call(self, function):
+        """ Queue `function(handler)` to run alone on the writer connection, e.g. lambda db: db.parse_spree() """
+
+        future = Future()
+        self.queue.put(('call', function, future))
+        return future
+
+    def close(self):
+        self.queue.put(self.stop)
+        self.join()
+
+
+class Database(object):
+    """ WAL database with pooled readers and a single queued writer """
+
+    def __init__(self, database_file, readers=read_pool_size):
+        self.database_file = database_file
+
+        connection = sqlite3.connect(database_file)
+        enable_wal(connection)
+        connection.close()
+
+        self.writer = Writer(database_file)
+        self.writer.start()
+        self.writer.ready.wait()
+        self.readers = ReadPool(database_file, readers)
+
+    def execute(self, query, params=()):
+        return self.readers.execute(query, params)
+
+    def write(self, statement, params=(), many=False):
+        return self.writer.submit(statement, params, many)
+
+    def call(self, function):
+        return self.writer.call(function)
+
+    def close(self):
+        self.writer.close()
+        self.readers.close()
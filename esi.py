@@ -1,9 +1,12 @@
 import logging
-import requests
 import re
-import time
 
-from config import logging_file
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import killcache
+
+from client import RateLimiter, get_json, post_json
+from config import logging_file, esi_concurrency, esi_rate_limit, esi_bulk_size, esi_url
 
 # Logging Configuration
 logging.basicConfig(filename=logging_file, level=logging.DEBUG)
@@ -14,47 +17,127 @@ formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
 console.setFormatter(formatter)
 logger.addHandler(console)
 
-def basic_request(url):
+
+def basic_request(url, limiter=None):
     request_headers = {
         "Accept-Encoding": "gzip",
         "Conent-Type": "application/json",
         "User-Agent": "Biwako Acami Scrapper (biwakoacami@gmail.com)"
     }
 
-    logger.debug("Requesting {0}".format(url))
-    attempt = True
-    retry = 3
+    return get_json(url, request_headers, limiter)
+
+
+def bulk_request(url, payload, limiter=None):
+    request_headers = {
+        "Accept-Encoding": "gzip",
+        "User-Agent": "Biwako Acami Scrapper (biwakoacami@gmail.com)"
+    }
+
+    return post_json(url, payload, request_headers, limiter)
+
+
+def fetch_kill(killID, hash, limiter=None):
+    """ Killmail for (killID, hash), from the local killmail cache when it has it """
+
+    cache = killcache.shared()
+    if cache is not None:
+        killData = cache.get(killID, hash)
+        if killData is not None:
+            return killData
+
+    url = "{0}/latest/killmails/{1}/{2}/?datasource=tranquility".format(esi_url, killID, hash)
+    killData = basic_request(url, limiter)
+
+    if cache is not None and isinstance(killData, dict) and killData.get('killmail_id') == killID:
+        cache.put(killID, hash, killData)
+    return killData
+
+
+def fetch_all(fetch, keys, concurrency=None, rate=None):
+    """ Runs fetch(*key, limiter) for each distinct key on a thread pool, yielding (key, result) as they complete """
+
+    concurrency = concurrency or esi_concurrency
+    rate = rate or esi_rate_limit
+    limiter = RateLimiter(rate)
+    queued = set()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+        for key in keys:
+            if key in queued:
+                logger.warn("{0} was already queued for fetching.".format(key))
+                continue
+            queued.add(key)
+            futures[executor.submit(fetch, *key, limiter=limiter)] = key
+
+        logger.info("Fetching {0} records with {1} workers at {2} requests/second".format(len(futures), concurrency, rate))
+
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                yield key, future.result()
+            except Exception as e:
+                logger.error("Unexpected error occurred while fetching {0}.".format(key))
+                logger.exception(e)
+                yield key, None
+
+
+def fetch_kills(kills, concurrency=None, rate=None):
+    """ Fetch (killID, hash) pairs on a thread pool, yielding (killID, killmail) as they complete """
+
+    for (killID, hash), killData in fetch_all(fetch_kill, ((killID, hash) for killID, hash in kills), concurrency, rate):
+        yield killID, killData
+
+
+def fetch_player(characterID, limiter=None):
+    url = "{0}/latest/characters/{1}/?datasource=tranquility".format(esi_url, characterID)
+    return basic_request(url, limiter)
+
+
+def fetch_players(characterIDs, concurrency=None, rate=None):
+    """ Fetch character profiles on a thread pool, yielding (characterID, profile) as they complete """
+
+    for (characterID,), playerProfile in fetch_all(fetch_player, ((characterID,) for characterID in characterIDs), concurrency, rate):
+        yield characterID, playerProfile
+
+
+def chunks(ids, size=esi_bulk_size):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def bulk_lookup(url, ids):
+    """ POST `ids` to a bulk endpoint in chunks, yielding its entries
 
-    while attempt == True:
-        try:
-            logger.debug("Waiting 5 seconds before query")
-            time.sleep(5)
-            request = requests.get(url, headers=request_headers, timeout=30)
-            attempt = False
-        except requests.exceptions.Timeout as errt:
-            logger.error("Timeout Error: {0}".format(errt))
-            
-            retry = retry - 1
+    ESI rejects a whole chunk over a single invalid ID, so a failed chunk is
+    halved and retried until only the IDs it cannot answer for are left out.
+    """
 
-            if retry == 0:
-                return
-            else:
-                logger.info("Retrying {0} more times.".format(retry))
+    pending = list(chunks(ids))
+    while pending:
+        chunk = pending.pop()
+        data = bulk_request(url, chunk)
+        if data is not None:
+            for entry in data:
+                yield entry
+        elif len(chunk) > 1:
+            middle = len(chunk) // 2
+            pending.extend([chunk[middle:], chunk[:middle]])
+        else:
+            logger.warn("{0} could not resolve ID {1}".format(url, chunk[0]))
 
-    data = request.json()
 
-    # Break if the page is empty
-    if len(data) == 0:
-        logger.warn("Received an empty page")
-    
-    return data
+def resolve_names(ids):
+    """ Resolve IDs to names through POST /universe/names/, returning {id: name} """
 
+    url = "{0}/latest/universe/names/?datasource=tranquility".format(esi_url)
+    return dict((entry['id'], entry['name']) for entry in bulk_lookup(url, ids))
 
-def fetch_kill(killID, hash):
-    url = "https://esi.evetech.net/latest/killmails/{0}/{1}/?datasource=tranquility".format(killID, hash)
-    return basic_request(url)
 
+def fetch_affiliations(characterIDs):
+    """ Resolve characters to their corporation through POST /characters/affiliation/, returning {characterID: corporationID} """
 
-def fetch_player(characterID):
-    url = "https://esi.evetech.net/latest/characters/{0}/?datasource=tranquility".format(characterID)
-    return basic_request(url)
\ No newline at end of file
+    url = "{0}/latest/characters/affiliation/?datasource=tranquility".format(esi_url)
+    return dict((entry['character_id'], entry['corporation_id']) for entry in bulk_lookup(url, characterIDs))
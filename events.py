@@ -0,0 +1,68 @@
+import logging
+
+import config
+import metrics
+
+from dbactions import DBHandler
+from config import logging_file
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Multi-event mode. Every event in config.events is synced from its own
+zkillboard query, but kills land once in the shared tables: a killmail that
+several events match is stored and fetched from ESI a single time and only
+gains an `event_kill` row per event. ESI fetching, spree evaluation and
+player lookups then run once for all events together, under one rate limit,
+and each event's `event_score` partition is rebuilt from its own kills.
+"""
+
+
+def update_events(db, events):
+    """ Sync, fetch and score every event in `events`, returns {name: (inserted, skipped)} of the sync """
+
+    eventIDs = db.register_events(events)
+    synced = {}
+
+    for event in events:
+        logger.info("Syncing event {0}".format(event['name']))
+        synced[event['name']] = db.sync_event(eventIDs[event['name']], event['query'])
+
+    # Shared by every event, each missing killmail and player is fetched once
+    db.fetch_missing_kills()
+    db.parse_spree()
+    db.fetch_missing_players()
+
+    for event in events:
+        db.rebuild_event_scores(eventIDs[event['name']])
+
+    return synced
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Update every configured event from zkillboard and ESI")
+    parser.add_argument('--database', default=config.database_file)
+    parser.add_argument('--event', action='append', help="Only update this event (repeatable)")
+    args = parser.parse_args()
+
+    selected = [event for event in config.events if not args.event or event['name'] in args.event]
+    if not selected:
+        parser.error("No events configured, add them to config.events")
+
+    db = DBHandler()
+    db.connect(args.database)
+    db.migrate()
+    print(update_events(db, selected))
+
+    if config.metrics_file:
+        metrics.write(config.metrics_file)
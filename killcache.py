@@ -0,0 +1,290 @@
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+import codec
+import metrics
+
+from config import logging_file, killcache_dir, killcache_max_bytes, killcache_segment_bytes, killcache_idle_seconds
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+On-disk store of ESI killmails, addressed by (killID, hash). A killmail never
+changes once it has a hash, so entries are never updated, only appended and
+eventually evicted.
+
+Records are appended to numbered segment files, each record a fixed header
+followed by the report in codec's tagged zlib form. `index.db` maps keys to
+(segment, offset, length). Every KillCache instance writes to a segment of
+its own, so several databases or processes can share one cache directory.
+Eviction drops whole segments, oldest first, once the cache outgrows
+`killcache_max_bytes`, passing over segments written to in the last
+`killcache_idle_seconds` since another instance may still be appending to
+them. A writer whose segment was evicted anyway notices when it indexes the
+record and moves to a new segment. The bulk export format is the segment
+format itself.
+
+    python killcache.py export kills.kmc
+    python killcache.py import kills.kmc
+"""
+
+# magic, killID, hash, payload length
+header = struct.Struct('>4sQ40sI')
+magic = b'KMC1'
+
+index_schema = """
+CREATE TABLE IF NOT EXISTS `entry` (
+    `killID` INT UNSIGNED NOT NULL,
+    `hash` VARCHAR(40) NOT NULL,
+    `segment` INT UNSIGNED NOT NULL,
+    `offset` INT UNSIGNED NOT NULL,
+    `length` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`killID`, `hash`)
+);
+CREATE INDEX IF NOT EXISTS `entry_segment` ON `entry` (`segment`);
+
+CREATE TABLE IF NOT EXISTS `segment` (
+    `segment` INTEGER NOT NULL,
+    `bytes` INT UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (`segment`)
+);
+"""
+
+
+def records(handle):
+    """ (killID, hash, payload) for every record in a segment or export stream """
+
+    while True:
+        head = handle.read(header.size)
+        if len(head) < header.size:
+            return
+        mark, killID, hash, length = header.unpack(head)
+        if mark != magic:
+            raise ValueError("Not a killmail cache record at offset {0}".format(handle.tell() - header.size))
+        payload = handle.read(length)
+        if len(payload) < length:
+            logger.warn("Truncated record for killID {0}, stopping".format(killID))
+            return
+        yield killID, hash.rstrip(b'\x00').decode('ascii'), payload
+
+
+class KillCache(object):
+    """ Content-addressed killmail store backed by segment files and an SQLite index """
+
+    def __init__(self, directory, max_bytes=killcache_max_bytes, segment_bytes=killcache_segment_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.active = None
+        self.writer = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False, timeout=30)
+        self.index.execute('PRAGMA journal_mode=WAL;')
+        self.index.executescript(index_schema)
+
+    def path(self, segment):
+        return os.path.join(self.directory, 'segment-{0:06d}.kmc'.format(segment))
+
+    def get(self, killID, hash):
+        """ The cached killmail for (killID, hash), or None """
+
+        with self.lock:
+            found = self.index.execute('SELECT `segment`, `offset`, `length` FROM `entry` WHERE `killID` = ? AND `hash` = ?', (killID, hash)).fetchone()
+        if found is None:
+            metrics.increment('killcache_total', result='miss')
+            return None
+
+        segment, offset, length = found
+        try:
+            with open(self.path(segment), 'rb') as handle:
+                handle.seek(offset + header.size)
+                payload = handle.read(length)
+        except OSError:
+            # Evicted by another instance between the lookup and the read, or its file is gone
+            self.forget(segment)
+            metrics.increment('killcache_total', result='miss')
+            return None
+
+        metrics.increment('killcache_total', result='hit')
+        return codec.decode(payload)
+
+    def put(self, killID, hash, report):
+        """ Store a killmail unless it is already cached """
+
+        self.put_payload(killID, hash, codec.encode(report, 'zlib'))
+
+    def forget(self, segment):
+        """ Drop the index rows of a segment whose file no longer exists """
+
+        with self.lock:
+            if os.path.exists(self.path(segment)):
+                return
+            with self.index:
+                removed = self.index.execute('DELETE FROM `entry` WHERE `segment` = ?', (segment,)).rowcount
+                self.index.execute('DELETE FROM `segment` WHERE `segment` = ?', (segment,))
+        if removed:
+            logger.info("Dropped {0} orphaned entries of killmail cache segment {1}".format(removed, segment))
+
+    def put_payload(self, killID, hash, payload):
+        with self.lock:
+            if self.index.execute('SELECT 1 FROM `entry` WHERE `killID` = ? AND `hash` = ?', (killID, hash)).fetchone():
+                return False
+
+            while True:
+                if self.writer is None or self.writer.tell() >= self.segment_bytes:
+                    self.roll()
+
+                offset = self.writer.tell()
+                self.writer.write(header.pack(magic, killID, hash.encode('ascii'), len(payload)))
+                self.writer.write(payload)
+                self.writer.flush()
+
+                with self.index:
+                    self.index.execute('INSERT OR IGNORE INTO `entry` (`killID`, `hash`, `segment`, `offset`, `length`) VALUES (?, ?, ?, ?, ?)',
+                        (killID, hash, self.active, offset, len(payload)))
+                    if self.index.execute('UPDATE `segment` SET `bytes` = ? WHERE `segment` = ?', (self.writer.tell(), self.active)).rowcount:
+                        return True
+                    # Another instance evicted the segment under us, the record went to a deleted file
+                    self.index.execute('DELETE FROM `entry` WHERE `segment` = ?', (self.active,))
+
+                logger.warn("Killmail cache segment {0} was evicted while in use, starting a new one".format(self.active))
+                self.writer.close()
+                self.writer = None
+
+    def roll(self):
+        """ Start a new segment owned by this instance, evicting old ones if over the size limit """
+
+        if self.writer is not None:
+            self.writer.close()
+
+        with self.index:
+            self.active = self.index.execute('INSERT INTO `segment` (`bytes`) VALUES (0)').lastrowid
+        self.writer = open(self.path(self.active), 'ab')
+        logger.debug("Writing killmail cache segment {0}".format(self.active))
+        self.evict()
+
+    def idle(self, segment):
+        try:
+            return time.time() - os.path.getmtime(self.path(segment)) >= killcache_idle_seconds
+        except OSError:
+            return True
+
+    def evict(self):
+        total = self.index.execute('SELECT IFNULL(SUM(`bytes`), 0) FROM `segment`').fetchone()[0]
+        for segment, size in self.index.execute('SELECT `segment`, `bytes` FROM `segment` WHERE `segment` <> ? ORDER BY `segment`', (self.active,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            if not self.idle(segment):
+                # Likely the active segment of another instance
+                continue
+            logger.info("Evicting killmail cache segment {0} ({1} bytes)".format(segment, size))
+            with self.index:
+                self.index.execute('DELETE FROM `entry` WHERE `segment` = ?', (segment,))
+                self.index.execute('DELETE FROM `segment` WHERE `segment` = ?', (segment,))
+            try:
+                os.remove(self.path(segment))
+            except OSError:
+                pass
+            total = total - size
+            metrics.increment('killcache_evicted_total')
+
+    def stats(self):
+        with self.lock:
+            entries = self.index.execute('SELECT COUNT(*) FROM `entry`').fetchone()[0]
+            segments, size = self.index.execute('SELECT COUNT(*), IFNULL(SUM(`bytes`), 0) FROM `segment`').fetchone()
+        return {'entries': entries, 'segments': segments, 'bytes': size, 'max_bytes': self.max_bytes}
+
+    def export(self, path):
+        """ Write every cached killmail to one file in segment format, returns the count """
+
+        with self.lock:
+            entries = self.index.execute('SELECT `killID`, `hash`, `segment`, `offset`, `length` FROM `entry` ORDER BY `segment`, `offset`').fetchall()
+
+        exported = 0
+        handles = {}
+        try:
+            with open(path, 'wb') as output:
+                for killID, hash, segment, offset, length in entries:
+                    if segment not in handles:
+                        handles[segment] = open(self.path(segment), 'rb')
+                    handles[segment].seek(offset)
+                    output.write(handles[segment].read(header.size + length))
+                    exported = exported + 1
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+        logger.info("Exported {0} killmails to {1}".format(exported, path))
+        return exported
+
+    def import_file(self, path):
+        """ Add every killmail of an export (or a segment from another cache) not cached yet, returns the count added """
+
+        added = 0
+        with open(path, 'rb') as handle:
+            for killID, hash, payload in records(handle):
+                if self.put_payload(killID, hash, payload):
+                    added = added + 1
+
+        logger.info("Imported {0} killmails from {1}".format(added, path))
+        return added
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            self.index.close()
+
+
+shared_cache = None
+shared_lock = threading.Lock()
+
+
+def shared():
+    """ The process-wide cache in `killcache_dir`, or None when caching is turned off """
+
+    global shared_cache
+    if killcache_dir is None:
+        return None
+    with shared_lock:
+        if shared_cache is None:
+            shared_cache = KillCache(killcache_dir)
+        return shared_cache
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect, export or import the killmail cache")
+    parser.add_argument('action', choices=['stats', 'export', 'import'])
+    parser.add_argument('path', nargs='?', help="Export file to write or read")
+    parser.add_argument('--directory', default=killcache_dir)
+    args = parser.parse_args()
+
+    if args.directory is None:
+        parser.error("No cache directory, set config.killcache_dir or pass --directory")
+    if args.action != 'stats' and args.path is None:
+        parser.error("{0} needs a file path".format(args.action))
+
+    cache = KillCache(args.directory)
+    if args.action == 'export':
+        cache.export(args.path)
+    elif args.action == 'import':
+        cache.import_file(args.path)
+    print(cache.stats())
+    cache.close()
@@ -0,0 +1,200 @@
+import bisect
+import itertools
+import json
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+
+from config import logging_file
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Process-wide counters and latency histograms for the fetch/ingest pipeline.
+
+    http_requests_total / http_request_seconds   {host, status}
+    sleep_seconds                                {source}
+    db_rows_total / db_method_seconds            {method}
+    db_commit_seconds
+    decode_seconds                               {codec}
+
+Export with to_json() or to_prometheus(), or write() to a file.
+"""
+
+buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+
+class Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def dump(self):
+        """ Snapshot of every metric as plain data """
+
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': dict(zip([str(bound) for bound in buckets] + ['+Inf'], itertools.accumulate(histogram.counts)))
+            } for (name, labels), histogram in sorted(self.histograms.items())]
+
+        return {'counters': counters, 'histograms': histograms}
+
+
+registry = Registry()
+
+
+def increment(name, value=1, **labels):
+    registry.increment(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """ Observe the wall time of the `with` block into histogram `name` """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - started, **labels)
+
+
+def sleep(seconds, source):
+    """ time.sleep that accounts the wait under sleep_seconds{source} """
+
+    if seconds > 0:
+        registry.observe('sleep_seconds', seconds, source=source)
+        time.sleep(seconds)
+
+
+def instrumented(method):
+    """ Times a DBHandler method and counts the rows it reports as (inserted, skipped) or (inserted, skipped, failed) """
+
+    name = method.__name__
+
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        result = method(*args, **kwargs)
+        registry.observe('db_method_seconds', time.perf_counter() - started, method=name)
+        if isinstance(result, tuple) and len(result) in (2, 3):
+            for outcome, count in zip(('inserted', 'skipped', 'failed'), result):
+                registry.increment('db_rows_total', count, method=name, outcome=outcome)
+        return result
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+def to_json():
+    return json.dumps(registry.dump(), indent=2)
+
+
+def labelled(name, labels, extra=None):
+    pairs = list(labels.items()) + list((extra or {}).items())
+    if not pairs:
+        return name
+    return '{0}{{{1}}}'.format(name, ','.join('{0}="{1}"'.format(key, str(value).replace('"', '\\"')) for key, value in pairs))
+
+
+def to_prometheus():
+    """ Render every metric in the Prometheus text exposition format """
+
+    snapshot = registry.dump()
+    lines = []
+    typed = set()
+
+    for counter in snapshot['counters']:
+        if counter['name'] not in typed:
+            lines.append('# TYPE {0} counter'.format(counter['name']))
+            typed.add(counter['name'])
+        lines.append('{0} {1}'.format(labelled(counter['name'], counter['labels']), counter['value']))
+
+    for histogram in snapshot['histograms']:
+        name = histogram['name']
+        if name not in typed:
+            lines.append('# TYPE {0} histogram'.format(name))
+            typed.add(name)
+        for bound, count in histogram['buckets'].items():
+            lines.append('{0} {1}'.format(labelled(name + '_bucket', histogram['labels'], {'le': bound}), count))
+        lines.append('{0} {1}'.format(labelled(name + '_sum', histogram['labels']), histogram['sum']))
+        lines.append('{0} {1}'.format(labelled(name + '_count', histogram['labels']), histogram['count']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write(path):
+    """ Export to `path`, as Prometheus text for .prom/.txt files and JSON otherwise """
+
+    output = to_prometheus() if path.endswith('.prom') or path.endswith('.txt') else to_json()
+    with open(path, 'w') as handle:
+        handle.write(output)
+    logger.info("Wrote metrics to {0}".format(path))
+
+
+class SampledLogger(object):
+    """ Per-row logging that only formats one message in `every`, and nothing when the level is disabled """
+
+    def __init__(self, logger, every):
+        self.logger = logger
+        self.every = max(1, every)
+        self.calls = itertools.count()
+
+    def log(self, level, message, *args):
+        if next(self.calls) % self.every == 0 and self.logger.isEnabledFor(level):
+            self.logger.log(level, message, *args)
+
+    def debug(self, message, *args):
+        self.log(logging.DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(logging.INFO, message, *args)
@@ -0,0 +1,523 @@
+import logging
+import sqlite3
+
+from config import logging_file
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Versioned schema. `schema` is always the current layout and a new database
+is created from it directly. Databases made by an older revision carry a
+lower `PRAGMA user_version` and are brought forward by the steps in
+`migrations`, each applied in its own transaction.
+"""
+
+schema = """
+-- TABLES
+-- ======
+CREATE TABLE `zkill` (
+    `killID` INT UNSIGNED NOT NULL,
+    `hash` VARCHAR(40) NOT NULL,
+    `value` REAL NOT NULL,
+    `killReport` BLOB NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+
+CREATE TABLE `esi` (
+    `killID` INT UNSIGNED NOT NULL,
+    `killReport` BLOB NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+
+CREATE TABLE `killmail` (
+    `killID` INT UNSIGNED NOT NULL,
+    `time` DATETIME NOT NULL,
+    `solarSystemID` INT UNSIGNED NOT NULL,
+    `attackers` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+
+CREATE TABLE `attacker` (
+    `killID` INT UNSIGNED NOT NULL,
+    `position` INT UNSIGNED NOT NULL,
+    `characterID` INT UNSIGNED,
+    `corporationID` INT UNSIGNED,
+    `allianceID` INT UNSIGNED,
+    `shipID` INT UNSIGNED,
+    `weaponID` INT UNSIGNED,
+    `damage` INT UNSIGNED NOT NULL,
+    `final_blow` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`killID`, `position`)
+);
+CREATE INDEX `attacker_final_blow` ON `attacker` (`killID`) WHERE `final_blow` = 1;
+CREATE INDEX `attacker_character` ON `attacker` (`characterID`);
+
+CREATE TABLE `victim` (
+    `killID` INT UNSIGNED NOT NULL,
+    `characterID` INT UNSIGNED,
+    `corporationID` INT UNSIGNED,
+    `allianceID` INT UNSIGNED,
+    `shipID` INT UNSIGNED NOT NULL,
+    `damage_taken` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+CREATE INDEX `victim_character` ON `victim` (`characterID`);
+
+CREATE TABLE `item` (
+    `killID` INT UNSIGNED NOT NULL,
+    `position` INT UNSIGNED NOT NULL,
+    `itemID` INT UNSIGNED NOT NULL,
+    `flag` INT UNSIGNED NOT NULL,
+    `quantity_destroyed` INT UNSIGNED NOT NULL,
+    `quantity_dropped` INT UNSIGNED NOT NULL,
+    `singleton` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`killID`, `position`)
+);
+CREATE INDEX `item_type` ON `item` (`itemID`);
+
+CREATE TABLE `spree`(
+    `killID` INT UNSIGNED NOT NULL,
+    `attackerID` INT UNSIGNED NOT NULL,
+    `attacker_shipID` INT UNSIGNED NOT NULL,
+    `weaponID` INT UNSIGNED NOT NULL,
+    `victimID` INT UNSIGNED NOT NULL,
+    `victim_shipID` INT UNSIGNED NOT NULL,
+    `valid` INT UNSIGNED NOT NULL,
+    `eligible` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+CREATE INDEX `spree_attacker` ON `spree` (`attackerID`, `attacker_shipID`, `killID`);
+CREATE INDEX `spree_victim` ON `spree` (`victimID`, `victim_shipID`, `killID`);
+
+CREATE TABLE `character` (
+    `characterID` INT UNSIGNED NOT NULL,
+    `name` TEXT NOT NULL,
+    `corporationID` INT UNSIGNED NOT NULL,
+    `race` INT UNSIGNED,
+    `birthday` DATETIME,
+    PRIMARY KEY (`characterID`)
+);
+
+CREATE TABLE `ships` (
+    `shipID` INT UNSIGNED NOT NULL,
+    `groupID` INT UNSIGNED,
+    `name` TEXT NOT NULL,
+    PRIMARY KEY (`shipID`)
+);
+
+CREATE VIEW `history`
+AS
+SELECT S.`killID`, A.`name` AS `attacker`, SA.`name` AS `attacker_ship`, V.`name` AS `victim`, SV.`name` AS `victim_ship`, Z.`value`, S.`valid`, S.`eligible` FROM `spree` S
+    JOIN `zkill` Z ON S.`killID` = Z.`killID`
+    JOIN `character` A ON S.`attackerID` = A.`characterID`
+    JOIN `character` V ON S.`victimID` = V.`characterID`
+    JOIN `ships` SA ON S.`attacker_shipID` = SA.`shipID`
+    JOIN `ships` SV ON S.`victim_shipID` = SV.`shipID`
+ORDER BY S.`killID`;
+
+CREATE TABLE `player_score` (
+    `characterID` INT UNSIGNED NOT NULL,
+    `wins` INT UNSIGNED NOT NULL DEFAULT 0,
+    `losses` INT UNSIGNED NOT NULL DEFAULT 0,
+    `isk_destroyed` REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (`characterID`)
+);
+
+CREATE TABLE `ship_score` (
+    `characterID` INT UNSIGNED NOT NULL,
+    `shipID` INT UNSIGNED NOT NULL,
+    `wins` INT UNSIGNED NOT NULL DEFAULT 0,
+    `losses` INT UNSIGNED NOT NULL DEFAULT 0,
+    `isk_destroyed` REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (`characterID`, `shipID`)
+);
+
+CREATE VIEW `ship_leaderboard` AS
+SELECT C.`name` AS `player`, SH.`name` AS `ship`, P.`wins`, P.`losses` FROM `ship_score` P
+JOIN `character` C ON P.`characterID` = C.`characterID`
+JOIN `ships` SH ON P.`shipID` = SH.`shipID`
+ORDER BY P.`wins` DESC;
+
+CREATE VIEW `undefeated` AS
+SELECT C.`name` AS `player`, SH.`name` AS `ship`, P.`wins`, P.`losses` FROM `ship_score` P
+JOIN `character` C ON P.`characterID` = C.`characterID`
+JOIN `ships` SH ON P.`shipID` = SH.`shipID`
+WHERE P.`losses` = 0
+ORDER BY P.`wins` DESC;
+
+CREATE VIEW `player_leaderboard` AS
+SELECT C.`name`, P.`wins`, P.`losses` FROM `player_score` P
+JOIN `character` C ON P.`characterID` = C.`characterID`
+ORDER BY P.`wins` DESC;
+
+CREATE VIEW `player_iskboard` AS
+SELECT C.`characterID`, C.`name` AS `player`, P.`isk_destroyed` FROM `player_score` P
+JOIN `character` C ON C.`characterID` = P.`characterID`
+WHERE P.`wins` > 0
+ORDER BY P.`isk_destroyed` DESC;
+
+CREATE VIEW `ship_iskboard` AS
+SELECT C.`characterID`, C.`name` AS `player`, SH.`name` AS `ship`, P.`isk_destroyed` FROM `ship_score` P
+JOIN `character` C ON C.`characterID` = P.`characterID`
+JOIN `ships` SH ON SH.`shipID` = P.`shipID`
+WHERE P.`wins` > 0
+ORDER BY P.`isk_destroyed` DESC;
+
+CREATE TABLE `streak` (
+    `characterID` INT UNSIGNED NOT NULL,
+    `shipID` INT UNSIGNED NOT NULL,
+    `result` CHAR(1) NOT NULL,
+    `start` INT UNSIGNED NOT NULL,
+    `end` INT UNSIGNED NOT NULL,
+    `matches` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`characterID`, `shipID`, `start`)
+);
+
+CREATE TABLE `sync_state` (
+    `query` TEXT NOT NULL,
+    `last_killID` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`query`)
+);
+
+CREATE TABLE `backfill_seen` (
+    `filter` TEXT NOT NULL,
+    `killID` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`filter`, `killID`)
+);
+
+CREATE TABLE `event` (
+    `eventID` INTEGER NOT NULL,
+    `name` TEXT NOT NULL UNIQUE,
+    `query` TEXT NOT NULL,
+    `start` DATETIME,
+    `end` DATETIME,
+    PRIMARY KEY (`eventID`)
+);
+
+CREATE TABLE `event_kill` (
+    `eventID` INT UNSIGNED NOT NULL,
+    `killID` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`eventID`, `killID`)
+);
+CREATE INDEX `event_kill_kill` ON `event_kill` (`killID`);
+
+CREATE TABLE `event_score` (
+    `eventID` INT UNSIGNED NOT NULL,
+    `characterID` INT UNSIGNED NOT NULL,
+    `shipID` INT UNSIGNED NOT NULL,
+    `wins` INT UNSIGNED NOT NULL DEFAULT 0,
+    `losses` INT UNSIGNED NOT NULL DEFAULT 0,
+    `isk_destroyed` REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (`eventID`, `characterID`, `shipID`)
+);
+
+CREATE TABLE `data_version` (
+    `id` INT UNSIGNED NOT NULL CHECK (`id` = 0),
+    `version` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`id`)
+);
+INSERT INTO `data_version` (`id`, `version`) VALUES (0, 0);
+CREATE TRIGGER `zkill_insert_version` AFTER INSERT ON `zkill` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `zkill_update_version` AFTER UPDATE ON `zkill` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `zkill_delete_version` AFTER DELETE ON `zkill` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `spree_insert_version` AFTER INSERT ON `spree` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `spree_update_version` AFTER UPDATE ON `spree` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `spree_delete_version` AFTER DELETE ON `spree` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `character_insert_version` AFTER INSERT ON `character` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `character_update_version` AFTER UPDATE ON `character` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `character_delete_version` AFTER DELETE ON `character` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `ships_insert_version` AFTER INSERT ON `ships` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `ships_update_version` AFTER UPDATE ON `ships` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `ships_delete_version` AFTER DELETE ON `ships` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `event_kill_insert_version` AFTER INSERT ON `event_kill` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `event_kill_update_version` AFTER UPDATE ON `event_kill` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `event_kill_delete_version` AFTER DELETE ON `event_kill` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `event_score_insert_version` AFTER INSERT ON `event_score` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `event_score_update_version` AFTER UPDATE ON `event_score` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+CREATE TRIGGER `event_score_delete_version` AFTER DELETE ON `event_score` BEGIN UPDATE `data_version` SET `version` = `version` + 1; END;
+
+CREATE VIEW player_results AS
+SELECT `killid`, `player`, `ship`, `result` FROM (
+    SELECT `killid`, `attacker` AS `player`, `attacker_ship` AS `ship`, 'W' AS `result` FROM `history`
+    UNION ALL SELECT `killid`, `victim` AS `player`, `victim_ship` AS `ship`, 'L' AS `result` FROM `history`
+) ORDER BY `killid`;
+
+CREATE VIEW streaks AS
+SELECT
+    C.`name` AS `player`
+    , SH.`name` AS `ship`
+    , T.`result`
+    , T.`start`
+    , T.`end`
+    , T.`matches`
+FROM `streak` T
+JOIN `character` C ON T.`characterID` = C.`characterID`
+JOIN `ships` SH ON T.`shipID` = SH.`shipID`
+ORDER BY T.`end`;
+
+CREATE VIEW current_streaks AS
+SELECT
+    C.`name` AS `player`
+    , SH.`name` AS `ship`
+    , T.`result`
+    , T.`start`
+    , T.`end`
+    , T.`matches`
+FROM (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY `characterID`, `shipID` ORDER BY `start` DESC) AS `recency` FROM `streak`
+) T
+JOIN `character` C ON T.`characterID` = C.`characterID`
+JOIN `ships` SH ON T.`shipID` = SH.`shipID`
+WHERE T.`recency` = 1
+ORDER BY T.`matches` DESC;
+
+CREATE VIEW `event_history` AS
+SELECT E.`name` AS `event`, H.* FROM `event_kill` EK
+JOIN `event` E ON E.`eventID` = EK.`eventID`
+JOIN `killmail` K ON K.`killID` = EK.`killID`
+JOIN `history` H ON H.`killID` = EK.`killID`
+WHERE (E.`start` IS NULL OR K.`time` >= E.`start`) AND (E.`end` IS NULL OR K.`time` < E.`end`)
+ORDER BY E.`name`, H.`killID`;
+
+CREATE VIEW `event_player_leaderboard` AS
+SELECT E.`name` AS `event`, C.`name` AS `player`, SUM(P.`wins`) AS `wins`, SUM(P.`losses`) AS `losses`, SUM(P.`isk_destroyed`) AS `isk_destroyed` FROM `event_score` P
+JOIN `event` E ON E.`eventID` = P.`eventID`
+JOIN `character` C ON C.`characterID` = P.`characterID`
+GROUP BY P.`eventID`, P.`characterID`
+ORDER BY E.`name`, `wins` DESC;
+
+CREATE VIEW `event_ship_leaderboard` AS
+SELECT E.`name` AS `event`, C.`name` AS `player`, SH.`name` AS `ship`, P.`wins`, P.`losses`, P.`isk_destroyed` FROM `event_score` P
+JOIN `event` E ON E.`eventID` = P.`eventID`
+JOIN `character` C ON C.`characterID` = P.`characterID`
+JOIN `ships` SH ON SH.`shipID` = P.`shipID`
+ORDER BY E.`name`, P.`wins` DESC;
+"""
+
+
+def reference():
+    """ In-memory database holding the current schema, to diff older databases against """
+
+    connection = sqlite3.connect(':memory:')
+    connection.executescript(schema)
+    return connection
+
+
+def objects(connection, kind):
+    query = 'SELECT `name`, `tbl_name`, `sql` FROM `sqlite_master` WHERE `type` = ? AND `sql` IS NOT NULL ORDER BY `rowid`'
+    return connection.execute(query, (kind,)).fetchall()
+
+
+def recreate_views(handler):
+    """ Drops every view and creates the current ones, views hold no data """
+
+    for name, _, _ in objects(handler.connection, 'view'):
+        handler.connection.execute('DROP VIEW `{0}`'.format(name))
+    for name, _, sql in objects(reference(), 'view'):
+        handler.connection.execute(sql)
+
+
+def reconcile(handler):
+    """ Brings a database made by any earlier revision up to the current tables, indexes, triggers and views """
+
+    connection = handler.connection
+    current = reference()
+    tables = set(name for name, _, _ in objects(connection, 'table'))
+    created = []
+
+    for name, _, sql in objects(current, 'table'):
+        if name not in tables:
+            logger.info("Creating missing table `{0}`".format(name))
+            connection.execute(sql)
+            created.append(name)
+            continue
+
+        columns = set(column[1] for column in connection.execute('PRAGMA table_info(`{0}`)'.format(name)))
+        for _, column, kind, notnull, default, _ in current.execute('PRAGMA table_info(`{0}`)'.format(name)):
+            if column in columns:
+                continue
+            if notnull and default is None:
+                raise ValueError("Cannot add NOT NULL column `{0}`.`{1}` without a default".format(name, column))
+            logger.info("Adding column `{0}`.`{1}`".format(name, column))
+            definition = '`{0}` {1}'.format(column, kind)
+            if default is not None:
+                definition = definition + ' DEFAULT ' + default
+            if notnull:
+                definition = definition + ' NOT NULL'
+            connection.execute('ALTER TABLE `{0}` ADD COLUMN {1}'.format(name, definition))
+
+    for kind in ('index', 'trigger'):
+        existing = set(name for name, _, _ in objects(connection, kind))
+        for name, _, sql in objects(current, kind):
+            if name not in existing:
+                connection.execute(sql)
+
+    if 'data_version' in created:
+        connection.execute('INSERT INTO `data_version` (`id`, `version`) VALUES (0, 0)')
+
+    recreate_views(handler)
+
+    # Aggregates that did not exist yet are filled from whatever `spree` already holds
+    if 'player_score' in created or 'ship_score' in created:
+        handler.rebuild_scores(commit=False)
+    if 'streak' in created:
+        handler.rebuild_streaks(commit=False)
+
+
+def relax_columns(handler):
+    """ Rebuilds tables with NOT NULL columns the current schema allows to be NULL, SQLite cannot drop a constraint in place """
+
+    connection = handler.connection
+    current = reference()
+    rebuilt = []
+
+    for name, _, sql in objects(current, 'table'):
+        existing = dict((column[1], column[3]) for column in connection.execute('PRAGMA table_info(`{0}`)'.format(name)))
+        wanted = [(column[1], column[3]) for column in current.execute('PRAGMA table_info(`{0}`)'.format(name))]
+        if not any(existing.get(column) and not notnull for column, notnull in wanted):
+            continue
+
+        if not rebuilt:
+            # Renaming a table rewrites the views naming it, drop them first, reconcile brings them back
+            for view, _, _ in objects(connection, 'view'):
+                connection.execute('DROP VIEW `{0}`'.format(view))
+
+        logger.info("Rebuilding table `{0}` with nullable columns".format(name))
+        columns = ', '.join('`{0}`'.format(column) for column, _ in wanted if column in existing)
+        connection.execute(sql.replace('CREATE TABLE `{0}`'.format(name), 'CREATE TABLE `{0}_rebuild`'.format(name), 1))
+        connection.execute('INSERT INTO `{0}_rebuild` ({1}) SELECT {1} FROM `{0}`'.format(name, columns))
+        connection.execute('DROP TABLE `{0}`'.format(name))
+        connection.execute('ALTER TABLE `{0}_rebuild` RENAME TO `{0}`'.format(name))
+        rebuilt.append(name)
+
+    # Indexes and triggers went with the old tables
+    reconcile(handler)
+
+
+migrations = [
+    (1, 'adopt unversioned database', reconcile),
+    (2, 'index spree by attacker and victim', [
+        'CREATE INDEX IF NOT EXISTS `spree_attacker` ON `spree` (`attackerID`, `attacker_shipID`, `killID`)',
+        'CREATE INDEX IF NOT EXISTS `spree_victim` ON `spree` (`victimID`, `victim_shipID`, `killID`)',
+    ]),
+    (3, 'window function current_streaks, UNION ALL player_results', recreate_views),
+    (4, 'event tables, per-event scores and views', reconcile),
+    (5, 'nullable character race and birthday', relax_columns),
+    (6, 'kills backfill checked and rejected', reconcile),
+]
+
+latest = migrations[-1][0]
+
+
+def version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def create(connection):
+    """ Creates the current schema in an empty database """
+
+    connection.executescript(schema)
+    connection.execute('PRAGMA user_version = {0}'.format(latest))
+
+
+def migrate(handler):
+    """ Applies every migration newer than the database, returns the version it ends on """
+
+    connection = handler.connection
+    current = version(connection)
+
+    if current == 0 and not objects(connection, 'table'):
+        logger.info("Creating schema version {0} in {1}.".format(latest, handler.database_file))
+        create(connection)
+        return latest
+
+    if current > latest:
+        logger.warn("Database is at version {0}, newer than this code ({1}).".format(current, latest))
+        return current
+
+    for number, description, step in migrations:
+        if number <= current:
+            continue
+
+        logger.info("Migrating {0} to version {1}: {2}".format(handler.database_file, number, description))
+        connection.execute('BEGIN')
+        try:
+            if callable(step):
+                step(handler)
+            else:
+                for statement in step:
+                    connection.execute(statement)
+            connection.execute('PRAGMA user_version = {0}'.format(number))
+            connection.commit()
+        except Exception as e:
+            logger.error("Migration to version {0} failed, database left at version {1}.".format(number, current))
+            logger.exception(e)
+            connection.rollback()
+            raise
+        current = number
+
+    return current
+
+
+def explain(connection, query):
+    """ (id, parent, detail) rows of EXPLAIN QUERY PLAN for `query` """
+
+    return [(row[0], row[1], row[3]) for row in connection.execute('EXPLAIN QUERY PLAN ' + query)]
+
+
+def regressions(plan):
+    """ Plan steps that run once per outer row: correlated subqueries and full scans nested in a join """
+
+    found = []
+    loops = {}
+    for node, parent, detail in plan:
+        if detail.startswith('CORRELATED'):
+            found.append(detail)
+        if not (detail.startswith('SCAN ') or detail.startswith('SEARCH ')) or detail == 'SCAN CONSTANT ROW':
+            continue
+        if parent in loops and detail.startswith('SCAN '):
+            found.append(detail)
+        loops.setdefault(parent, node)
+    return found
+
+
+def check_plans(connection, queries=None):
+    """ Maps each view (or given name/query) whose plan regressed to its offending steps """
+
+    if queries is None:
+        queries = dict((name, 'SELECT * FROM `{0}`'.format(name)) for name, _, _ in objects(connection, 'view'))
+
+    regressed = {}
+    for name, query in sorted(queries.items()):
+        found = regressions(explain(connection, query))
+        if found:
+            logger.warn("Query plan of {0} regressed: {1}".format(name, '; '.join(found)))
+            regressed[name] = found
+    return regressed
+
+
+if __name__ == '__main__':
+    import argparse
+    import config
+
+    from dbactions import DBHandler
+
+    parser = argparse.ArgumentParser(description="Migrate the spree database to the current schema")
+    parser.add_argument('--database', default=config.database_file)
+    parser.add_argument('--check', action='store_true', help="Also check the view query plans")
+    args = parser.parse_args()
+
+    db = DBHandler()
+    db.connect(args.database)
+    print("Schema version {0}".format(migrate(db)))
+    if args.check:
+        regressed = check_plans(db.connection)
+        print("{0} views regressed".format(len(regressed)) if regressed else "All view plans OK")
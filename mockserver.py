@@ -0,0 +1,258 @@
+import json
+import logging
+import re
+import threading
+import time
+
+from collections import Counter, deque
+from urllib.parse import parse_qs, urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import synthetic
+
+from config import logging_file
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Local stand-in for the zkillboard and ESI endpoints this project uses, serving
+a synthetic dataset. Point config.zkillboard_url and config.esi_url (or the
+module globals in zkillboard/esi) at MockServer.url.
+
+ESI routes carry X-ESI-Error-Limit-Remain/Reset the way ESI does, every error
+response spends the budget and an empty budget answers 420. MockServer.script
+queues canned failures (429 with Retry-After, 503, ...) for the next requests.
+
+/listen.php behaves like zkillboard's RedisQ: it long-polls for up to `ttw`
+seconds and hands out one package per call from what MockServer.publish
+queued, or {"package": null} when nothing arrived.
+"""
+
+page_size = 200
+error_limit = 100
+error_window = 60
+
+esi_routes = frozenset(['killmail', 'character', 'names', 'affiliation'])
+
+routes = [
+    ('killid', re.compile(r'^/api/killID/(\d+)/$')),
+    ('history', re.compile(r'^/api/history/(\d{8})\.json$')),
+    ('page', re.compile(r'^/api/.*/page/(\d+)/$')),
+    ('killmail', re.compile(r'^/latest/killmails/(\d+)/(\w+)/$')),
+    ('character', re.compile(r'^/latest/characters/(\d+)/$')),
+    ('names', re.compile(r'^/latest/universe/names/$')),
+    ('affiliation', re.compile(r'^/latest/characters/affiliation/$')),
+    ('redisq', re.compile(r'^/listen\.php$')),
+]
+
+
+class Dataset(object):
+    """ Synthetic kills indexed the way the mock endpoints look them up """
+
+    def __init__(self, count, seed=0, **kwargs):
+        self.zkill = {}
+        self.esi = {}
+        for report, killData in synthetic.generate(count, seed, **kwargs):
+            self.zkill[report['killmail_id']] = report
+            self.esi[report['killmail_id']] = killData
+
+        self.newest_first = sorted(self.zkill, reverse=True)
+        self.characters = set()
+        for killData in self.esi.values():
+            self.characters.add(killData['victim']['character_id'])
+            self.characters.update(attacker['character_id'] for attacker in killData['attackers'])
+
+    def history(self, day):
+        """ killID -> hash of the kills whose killmail_time falls on `day` (YYYYMMDD) """
+
+        stamp = "{0}-{1}-{2}".format(day[:4], day[4:6], day[6:])
+        return dict((str(killID), self.zkill[killID]['zkb']['hash']) for killID, killData in self.esi.items() if killData['killmail_time'].startswith(stamp))
+
+    def page(self, number):
+        killIDs = self.newest_first[(number - 1) * page_size:number * page_size]
+        return [self.zkill[killID] for killID in killIDs]
+
+    def package(self, killID):
+        """ A RedisQ package for one kill, the killmail inline as RedisQ sends it """
+
+        return {"killID": killID, "killmail": self.esi[killID], "zkb": self.zkill[killID]['zkb']}
+
+    def profile(self, characterID):
+        return {
+            "name": "Pilot {0}".format(characterID),
+            "corporation_id": 98000000 + characterID % 50,
+            "race_id": 1 + characterID % 4,
+            "birthday": "2015-03-24T11:37:00Z"
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as two writes, Nagle would hold the body back for a delayed ACK
+    disable_nagle_algorithm = True
+    esi = False
+
+    def log_message(self, format, *args):
+        logger.debug("mock: " + format % args)
+
+    def reply(self, status, body=None, headers=None):
+        payload = b'' if body is None else json.dumps(body).encode('utf-8')
+        headers = dict(headers or {})
+        if self.esi:
+            headers.update(self.server.error_limit(status))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def route(self):
+        path = self.path.split('?')[0]
+        for name, pattern in routes:
+            match = pattern.match(path)
+            if match:
+                return name, match.groups()
+        return None, ()
+
+    def do_GET(self):
+        self.handle_request(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.handle_request(json.loads(self.rfile.read(length) or b'null'))
+
+    def handle_request(self, payload):
+        server = self.server
+        name, groups = self.route()
+        server.count(name)
+        self.esi = name in esi_routes
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        scripted = server.scripted(name)
+        if self.esi and server.error_budget() <= 0:
+            self.reply(420, {"error": "This software has exceeded the error limit for ESI."})
+            return
+        if scripted is not None:
+            self.reply(scripted[0], {"error": "Scripted failure"}, scripted[1])
+            return
+
+        data = server.dataset
+        if name == 'redisq':
+            ttw = float(parse_qs(urlsplit(self.path).query).get('ttw', ['10'])[0])
+            self.reply(200, {"package": server.listen(ttw)})
+        elif name == 'page':
+            self.reply(200, data.page(int(groups[0])))
+        elif name == 'history':
+            self.reply(200, data.history(groups[0]))
+        elif name == 'killid' and int(groups[0]) in data.zkill:
+            self.reply(200, [data.zkill[int(groups[0])]])
+        elif name == 'killmail' and int(groups[0]) in data.esi:
+            self.reply(200, data.esi[int(groups[0])])
+        elif name == 'character':
+            self.reply(200, data.profile(int(groups[0])))
+        elif name == 'names' and not set(payload) <= data.characters:
+            # ESI turns the whole request down over one ID it does not know
+            self.reply(404, {"error": "Ensure all IDs are valid before resolving."})
+        elif name == 'names':
+            self.reply(200, [{"id": i, "name": data.profile(i)['name'], "category": "character"} for i in payload])
+        elif name == 'affiliation':
+            self.reply(200, [{"character_id": i, "corporation_id": data.profile(i)['corporation_id']} for i in payload if i in data.characters])
+        else:
+            self.reply(404, {"error": "Not found"})
+
+
+class MockServer(ThreadingHTTPServer):
+    """ Threaded stand-in server with per-route request counters and a fixed per-request latency """
+
+    daemon_threads = True
+
+    def __init__(self, dataset, latency=0.0, host='127.0.0.1', port=0):
+        ThreadingHTTPServer.__init__(self, (host, port), Handler)
+        self.dataset = dataset
+        self.latency = latency
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.script_queue = []
+        self.packages = deque()
+        self.published = {}
+        self.arrived = threading.Condition(self.lock)
+        self.errors = 0
+        self.window_start = time.monotonic()
+
+    @property
+    def url(self):
+        return "http://{0}:{1}".format(*self.server_address)
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] = self.requests[name] + 1
+
+    def script(self, *responses, route=None):
+        """ Answer the next requests (to `route` only, if given) with these (status, headers) pairs in order """
+
+        with self.lock:
+            self.script_queue.extend((route, status, headers) for status, headers in responses)
+
+    def scripted(self, name):
+        with self.lock:
+            for index, (route, status, headers) in enumerate(self.script_queue):
+                if route is None or route == name:
+                    del self.script_queue[index]
+                    return status, headers
+        return None
+
+    def publish(self, killIDs=None):
+        """ Queue RedisQ packages for these kills (every kill, oldest first, by default) """
+
+        killIDs = sorted(self.dataset.zkill) if killIDs is None else killIDs
+        with self.arrived:
+            for killID in killIDs:
+                self.packages.append(self.dataset.package(killID))
+                self.published[killID] = time.monotonic()
+            self.arrived.notify_all()
+
+    def listen(self, ttw):
+        with self.arrived:
+            self.arrived.wait_for(lambda: self.packages, timeout=ttw)
+            return self.packages.popleft() if self.packages else None
+
+    def error_budget(self):
+        with self.lock:
+            if time.monotonic() - self.window_start >= error_window:
+                self.window_start = time.monotonic()
+                self.errors = 0
+            return error_limit - self.errors
+
+    def error_limit(self, status):
+        """ ESI error-limit headers after a response with `status`, spending the budget on errors """
+
+        remain = self.error_budget()
+        with self.lock:
+            if status >= 400 and status != 420:
+                self.errors = self.errors + 1
+                remain = remain - 1
+            reset = int(error_window - (time.monotonic() - self.window_start)) + 1
+        return {'X-ESI-Error-Limit-Remain': str(max(0, remain)), 'X-ESI-Error-Limit-Reset': str(reset)}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info("Mock zkillboard/ESI serving {0} kills on {1}".format(len(self.dataset.zkill), self.url))
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,294 @@
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+from client import RateLimiter
+from dbactions import missing_kills_query, missing_players_query, resolve_players
+from dbpool import Writer
+from esi import fetch_kill, fetch_players
+from zkillboard import iter_killreports_query
+from config import logging_file, database_file, update_query, esi_concurrency, esi_rate_limit, esi_bulk_size, pipeline_queue_size, pipeline_batch_size, pipeline_flush_seconds, metrics_file
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Staged ingest: zkillboard pages -> ESI killmails -> spree rows -> characters.
+
+Each stage runs on its own thread(s) and hands work to the next through a
+bounded queue, so a kill moves on as soon as its inputs are ready and a slow
+stage holds back the ones feeding it. All database work goes through one
+dbpool.Writer thread.
+
+Progress lives in the database itself. The zkillboard watermark only moves
+once every page of a run is stored, and on start-up the pipeline re-queues
+kills without ESI data, kills not yet evaluated for `spree` and characters
+not yet resolved, so an interrupted run picks up where it stopped.
+"""
+
+done = object()
+
+
+def batches(source, size, wait, stop):
+    """ Groups items from a queue into lists of up to `size`, flushing early once nothing arrives for `wait` seconds """
+
+    batch = []
+    while True:
+        try:
+            item = source.get(timeout=wait)
+        except queue.Empty:
+            if batch:
+                yield batch
+                batch = []
+            if stop.is_set():
+                return
+            continue
+
+        if item is done:
+            if batch:
+                yield batch
+            return
+
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+
+class Pipeline(object):
+    """ Concurrent update of one zkillboard query through bounded, back-pressured stages """
+
+    def __init__(self, query, database=database_file, fetchers=esi_concurrency, rate=esi_rate_limit, queue_size=pipeline_queue_size):
+        self.query = query
+        self.database = database
+        self.fetchers = fetchers
+        self.limiter = RateLimiter(rate)
+        self.kills = queue.Queue(maxsize=queue_size)
+        self.killmails = queue.Queue(maxsize=queue_size)
+        self.players = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.progress = dict((stage, 0) for stage in ('pages', 'fetched', 'stored', 'sprees', 'players'))
+        self.lock = threading.Lock()
+        self.writer = None
+        self.lost = 0
+
+    def advance(self, stage, count=1):
+        with self.lock:
+            self.progress[stage] = self.progress[stage] + count
+        metrics.increment('pipeline_items_total', count, stage=stage)
+
+    def put(self, target, item):
+        """ Blocking put that gives up once the pipeline is stopping, so a failed stage cannot wedge the others """
+
+        while not self.stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def write(self, function):
+        return self.writer.call(function).result()
+
+    def stage(self, name, function, *args):
+        def run():
+            try:
+                function(*args)
+            except Exception as e:
+                logger.error("Pipeline stage {0} failed, stopping.".format(name))
+                logger.exception(e)
+                self.stop.set()
+
+        thread = threading.Thread(target=run, name='pipeline-{0}'.format(name), daemon=True)
+        thread.start()
+        return thread
+
+    def pages(self, missing):
+        """ Queue kills left without ESI data by an earlier run, then page zkillboard past the watermark """
+
+        try:
+            for kill in missing:
+                if not self.put(self.kills, kill):
+                    return
+
+            last_killID = self.write(lambda db: db.get_lastkill_query(self.query))
+            newest = None
+            page = []
+
+            try:
+                for killReport in iter_killreports_query(self.query, last_killID):
+                    page.append(killReport)
+                    if len(page) >= pipeline_batch_size:
+                        self.store_page(page)
+                        page = []
+                    if newest is None or killReport['killmail_id'] > newest:
+                        newest = killReport['killmail_id']
+                    if self.stop.is_set():
+                        return
+            except IOError as e:
+                # What was paged still goes through, the watermark stays for the next run to page down to
+                logger.error("Paging {0} stopped early ({1}), keeping its last known kill.".format(self.query, e))
+                newest = None
+            if page:
+                self.store_page(page)
+
+            if self.lost:
+                logger.error("Could not store {0} paged kills for {1}, keeping its last known kill.".format(self.lost, self.query))
+            elif newest is not None:
+                self.write(lambda db: db.set_lastkill(self.query, newest))
+        finally:
+            for _ in range(self.fetchers):
+                self.put(self.kills, done)
+
+    def store_page(self, killReports):
+        def store(db):
+            _, _, failed = db.ingest_kills(killReports)
+            killIDs = [killReport['killmail_id'] for killReport in killReports]
+            db.cursor.execute('SELECT `killID` FROM `esi` WHERE `killID` IN ({0});'.format(', '.join('?' * len(killIDs))), killIDs)
+            return failed, set(killID for killID, in db.cursor.fetchall())
+
+        # A run after an interrupted one pages kills it already has ESI data for
+        failed, known = self.write(store)
+        self.lost = self.lost + failed
+        self.advance('pages', len(killReports))
+        for killReport in killReports:
+            if killReport['killmail_id'] in known:
+                continue
+            if not self.put(self.kills, (killReport['killmail_id'], killReport['zkb']['hash'])):
+                return
+
+    def fetch(self):
+        """ ESI worker, one of `fetchers` sharing the rate limiter """
+
+        try:
+            while not self.stop.is_set():
+                try:
+                    item = self.kills.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is done:
+                    return
+
+                killID, hash = item
+                killData = fetch_kill(killID, hash, limiter=self.limiter)
+                # ESI answers an unknown or mismatched hash with an error body
+                if not isinstance(killData, dict) or killData.get('killmail_id') != killID:
+                    logger.warn("No ESI data received for killID {0}, it will be retried on the next run.".format(killID))
+                    continue
+                self.advance('fetched')
+                if not self.put(self.killmails, killData):
+                    return
+        finally:
+            self.put(self.killmails, done)
+
+    def store(self, queued):
+        """ Store and shred killmails in micro-batches, evaluate them for `spree` and pass new fighters on """
+
+        remaining = self.fetchers
+        seen = set(queued)
+
+        def evaluate(db, batch):
+            db.ingest_killdata(batch)
+            killIDs = [killData['killmail_id'] for killData in batch]
+            return db.spree_range(min(killIDs), max(killIDs))
+
+        try:
+            while remaining:
+                for batch in batches(self.killmails, pipeline_batch_size, pipeline_flush_seconds, self.stop):
+                    rows = self.write(lambda db: evaluate(db, batch))
+                    self.advance('stored', len(batch))
+                    self.advance('sprees', len(rows))
+
+                    for row in rows:
+                        for characterID in (row[1], row[4]):
+                            if characterID not in seen:
+                                seen.add(characterID)
+                                if not self.put(self.players, characterID):
+                                    return
+                # batches() returns on each worker's end marker
+                remaining = remaining - 1
+                if self.stop.is_set():
+                    return
+        finally:
+            self.put(self.players, done)
+
+    def resolve(self, missing):
+        """ Resolve characters in bulk as they appear, with per-character profiles for what bulk misses """
+
+        # Leftovers from an earlier run go first, then whatever `store` emits
+        for start in range(0, len(missing), esi_bulk_size):
+            self.resolve_batch(missing[start:start + esi_bulk_size])
+
+        for batch in batches(self.players, esi_bulk_size, pipeline_flush_seconds, self.stop):
+            self.resolve_batch(batch)
+
+    def resolve_batch(self, characterIDs):
+        resolved, unresolved = resolve_players(characterIDs)
+        profiles = list(fetch_players(unresolved))
+        self.write(lambda db: db.store_players(resolved, profiles))
+        self.advance('players', len(resolved) + sum(1 for _, profile in profiles if profile is not None))
+
+    def run(self):
+        """ Run every stage to completion, returns the per-stage progress counts """
+
+        started = time.perf_counter()
+        self.writer = Writer(self.database)
+        self.writer.start()
+        self.writer.ready.wait()
+
+        try:
+            self.write(lambda db: db.migrate())
+
+            # Catch up on whatever an interrupted run left half done
+            self.write(lambda db: db.parse_spree())
+            missing_kills = self.write(lambda db: db.cursor.execute(missing_kills_query).fetchall())
+            missing_players = [characterID for characterID, in self.write(lambda db: db.cursor.execute(missing_players_query).fetchall())]
+            logger.info("Resuming with {0} kills without ESI data and {1} unresolved players".format(len(missing_kills), len(missing_players)))
+
+            threads = [self.stage('pages', self.pages, missing_kills)]
+            threads.extend(self.stage('fetch-{0}'.format(n), self.fetch) for n in range(self.fetchers))
+            threads.append(self.stage('store', self.store, missing_players))
+            threads.append(self.stage('resolve', self.resolve, missing_players))
+
+            for thread in threads:
+                thread.join()
+
+            if not self.stop.is_set():
+                self.write(lambda db: db.fetch_missing_profiles())
+        finally:
+            self.writer.close()
+
+        logger.info("Pipeline finished in {0:.1f}s: {1}".format(time.perf_counter() - started, self.progress))
+        return dict(self.progress)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pull new kills for a zkillboard query through the staged ingest pipeline")
+    parser.add_argument('--query', default=update_query, help="zkillboard API query URL")
+    parser.add_argument('--database', default=database_file)
+    parser.add_argument('--fetchers', type=int, default=esi_concurrency, help="Concurrent ESI killmail requests")
+    parser.add_argument('--rate', type=float, default=esi_rate_limit, help="ESI requests per second")
+    args = parser.parse_args(argv)
+
+    progress = Pipeline(args.query, args.database, args.fetchers, args.rate).run()
+
+    if metrics_file:
+        metrics.write(metrics_file)
+    return progress
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+import metrics
+
+from dbactions import resolve_players
+from dbpool import Writer
+from esi import fetch_kill, fetch_players
+from pipeline import batches, done
+from zkillboard import listen
+from config import logging_file, database_file, ship_groups, metrics_file
+from config import redisq_queue_id, redisq_ttw, redisq_systems, redisq_groups, redisq_batch_size, redisq_flush_seconds, redisq_buffer_size, redisq_max_backoff
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Live updates from zkillboard's RedisQ. A listener thread long-polls for new
+kills and keeps the ones matching the configured systems and ship groups in
+a bounded buffer; when the buffer is full the listener stops polling and
+RedisQ holds the kills server side. A committer thread drains the buffer in
+micro-batches into `zkill`, `esi` and `spree` through the dbpool writer, then
+resolves the new fighters, so leaderboards move within seconds of a kill.
+Race and birthday, which bulk resolution leaves empty, are fetched from the
+profiles of each batch's new fighters on the committer thread, so the writer
+only ever runs their UPDATEs.
+
+Connection failures are retried with jittered exponential backoff, capped at
+`redisq_max_backoff` seconds, for as long as the consumer runs.
+
+    python redisq.py
+"""
+
+
+def package_report(package):
+    """ zkill-style report of a RedisQ package, as `zkill` stores them """
+
+    return {'killmail_id': package['killID'], 'zkb': package['zkb']}
+
+
+class Consumer(object):
+    """ Long-running RedisQ consumer feeding the database in micro-batches """
+
+    def __init__(self, database=database_file, queueID=redisq_queue_id, systems=redisq_systems, groups=redisq_groups, buffer_size=redisq_buffer_size):
+        self.database = database
+        self.queueID = queueID
+        self.systems = None if systems is None else frozenset(systems)
+        self.groups = groups if groups is not None else ship_groups
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.stop = threading.Event()
+        self.closed = threading.Event()
+        self.writer = None
+        self.ships = None
+        self.players = set()
+        self.progress = dict((stage, 0) for stage in ('received', 'matched', 'stored', 'sprees', 'players'))
+        self.lock = threading.Lock()
+
+    def advance(self, stage, count=1):
+        with self.lock:
+            self.progress[stage] = self.progress[stage] + count
+        metrics.increment('redisq_items_total', count, stage=stage)
+
+    def write(self, function):
+        return self.writer.call(function).result()
+
+    def matches(self, killData):
+        """ Whether a killmail is in a tracked system with a tracked ship on the victim or final blow """
+
+        if self.systems is not None and killData['solar_system_id'] not in self.systems:
+            return False
+
+        ships = [killData['victim'].get('ship_type_id')]
+        ships.extend(attacker.get('ship_type_id') for attacker in killData['attackers'] if attacker.get('final_blow'))
+        return any(shipID in self.ships for shipID in ships)
+
+    def listen(self):
+        """ Long-poll RedisQ until stopped, reconnecting with backoff after failures """
+
+        try:
+            failures = 0
+            while not self.stop.is_set():
+                try:
+                    package = listen(self.queueID, redisq_ttw)
+                except Exception as e:
+                    failures = failures + 1
+                    backoff = min(redisq_max_backoff, 2 ** failures)
+                    backoff = backoff / 2 + random.uniform(0, backoff / 2)
+                    logger.warn("RedisQ poll failed ({0}), reconnecting in {1:.1f}s".format(e, backoff))
+                    metrics.increment('redisq_reconnects_total')
+                    self.stop.wait(backoff)
+                    continue
+
+                failures = 0
+                if package is None:
+                    continue
+
+                received = time.monotonic()
+                self.advance('received')
+                killData = package.get('killmail')
+                if killData is None:
+                    # Newer RedisQ packages only point at ESI
+                    killData = fetch_kill(package['killID'], package['zkb']['hash'])
+                    if not isinstance(killData, dict) or killData.get('killmail_id') != package['killID']:
+                        logger.warn("No ESI data received for killID {0}, it will be picked up by the next update.".format(package['killID']))
+                        continue
+
+                if not self.matches(killData):
+                    continue
+
+                self.advance('matched')
+                # Already taken off RedisQ, so it waits for room even once stopping, the committer drains until `done`
+                while not self.closed.is_set():
+                    try:
+                        self.buffer.put((received, package_report(package), killData), timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            logger.error("RedisQ listener failed, stopping.")
+            logger.exception(e)
+            self.stop.set()
+        finally:
+            self.buffer.put(done)
+
+    def commit(self):
+        """ Store buffered kills in micro-batches, evaluate them for `spree`, resolve new fighters and complete their profiles """
+
+        def store(db, batch):
+            db.ingest_kills(report for _, report, _ in batch)
+            db.ingest_killdata(killData for _, _, killData in batch)
+            killIDs = [report['killmail_id'] for _, report, _ in batch]
+            return db.spree_range(min(killIDs), max(killIDs))
+
+        def store_players(db, resolved, profiles, completions):
+            db.store_players(resolved, profiles)
+            db.complete_profiles(completions)
+
+        # Runs until the listener's end marker rather than stop(), so nothing it buffered is dropped
+        for batch in batches(self.buffer, redisq_batch_size, redisq_flush_seconds, threading.Event()):
+            rows = self.write(lambda db: store(db, batch))
+            self.advance('stored', len(batch))
+            self.advance('sprees', len(rows))
+
+            fighters = set(characterID for row in rows for characterID in (row[1], row[4])) - self.players
+            if fighters:
+                resolved, unresolved = resolve_players(list(fighters))
+                profiles = list(fetch_players(unresolved))
+                completions = list(fetch_players(characterID for characterID, _, _ in resolved))
+                self.write(lambda db: store_players(db, resolved, profiles, completions))
+                self.players.update(fighters)
+                self.advance('players', len(resolved) + sum(1 for _, profile in profiles if profile is not None))
+
+            committed = time.monotonic()
+            for received, _, _ in batch:
+                metrics.observe('redisq_commit_latency_seconds', committed - received)
+
+    def run(self, duration=None):
+        """ Consume until stop() or for `duration` seconds, returns the progress counts """
+
+        self.writer = Writer(self.database)
+        self.writer.start()
+        self.writer.ready.wait()
+
+        try:
+            self.write(lambda db: db.migrate())
+            self.ships = self.write(lambda db: db.ship_index(self.groups))
+            self.players = set(characterID for characterID, in self.write(lambda db: db.cursor.execute('SELECT `characterID` FROM `character`;').fetchall()))
+
+            listener = threading.Thread(target=self.listen, name='redisq-listen', daemon=True)
+            listener.start()
+            logger.info("Consuming RedisQ queue {0}".format(self.queueID))
+
+            if duration is not None:
+                timer = threading.Timer(duration, self.stop.set)
+                timer.daemon = True
+                timer.start()
+
+            try:
+                self.commit()
+            except KeyboardInterrupt:
+                # RedisQ will not send what is buffered again, store it before stopping; a second interrupt gets through
+                logger.warn("Interrupted, storing the buffered kills before stopping")
+                self.stop.set()
+                self.commit()
+            listener.join()
+        finally:
+            self.stop.set()
+            self.closed.set()
+            self.writer.close()
+
+        logger.info("RedisQ consumer stopped: {0}".format(self.progress))
+        return dict(self.progress)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stream new kills from zkillboard RedisQ into the database")
+    parser.add_argument('--database', default=database_file)
+    parser.add_argument('--queue', default=redisq_queue_id, help="RedisQ queueID, keeps our place between restarts")
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    args = parser.parse_args()
+
+    consumer = Consumer(args.database, args.queue)
+    try:
+        consumer.run(args.duration)
+    except KeyboardInterrupt:
+        consumer.stop.set()
+
+    if metrics_file:
+        metrics.write(metrics_file)
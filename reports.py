@@ -0,0 +1,144 @@
+import csv
+import html
+import io
+import json
+import logging
+import threading
+
+import metrics
+
+from config import logging_file, report_cache_size
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+
+"""
+Renders the history, leaderboard and streak views to JSON, CSV or HTML.
+
+Rendered output is cached against `data_version`, a counter that triggers
+on `zkill`, `spree`, `character`, `ships`, `event_kill` and `event_score`
+bump on every change. A board that has not changed since the last render
+costs one primary-key lookup.
+"""
+
+reports = {
+    'history': 'SELECT * FROM `history`;',
+    'player_leaderboard': 'SELECT * FROM `player_leaderboard`;',
+    'ship_leaderboard': 'SELECT * FROM `ship_leaderboard`;',
+    'undefeated': 'SELECT * FROM `undefeated`;',
+    'player_iskboard': 'SELECT * FROM `player_iskboard`;',
+    'ship_iskboard': 'SELECT * FROM `ship_iskboard`;',
+    'streaks': 'SELECT * FROM `streaks`;',
+    'current_streaks': 'SELECT * FROM `current_streaks`;',
+    'event_history': 'SELECT * FROM `event_history`;',
+    'event_player_leaderboard': 'SELECT * FROM `event_player_leaderboard`;',
+    'event_ship_leaderboard': 'SELECT * FROM `event_ship_leaderboard`;',
+}
+
+
+def render_json(report, columns, rows):
+    return json.dumps([dict(zip(columns, row)) for row in rows])
+
+
+def render_csv(report, columns, rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def render_html(report, columns, rows):
+    lines = ['<table class="{0}">'.format(html.escape(report)), '<thead><tr>']
+    lines.extend('<th>{0}</th>'.format(html.escape(column)) for column in columns)
+    lines.append('</tr></thead><tbody>')
+    for row in rows:
+        lines.append('<tr>' + ''.join('<td>{0}</td>'.format(html.escape('' if value is None else str(value))) for value in row) + '</tr>')
+    lines.append('</tbody></table>')
+    return '\n'.join(lines)
+
+
+renderers = {
+    'json': render_json,
+    'csv': render_csv,
+    'html': render_html,
+}
+
+
+class ReportCache(object):
+    """ Renders reports from a connection or dbpool.ReadPool, reusing output until `data_version` moves """
+
+    def __init__(self, connection, size=report_cache_size):
+        self.connection = connection
+        self.size = size
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.rendered = {}
+
+    def version(self):
+        return self.connection.execute('SELECT `version` FROM `data_version` WHERE `id` = 0;').fetchone()[0]
+
+    def query(self, report, version):
+        """ Columns and rows of `report` at `version`, shared by every format """
+
+        key = (report, version)
+        with self.lock:
+            cached = self.rows.get(key)
+        if cached is not None:
+            return cached
+
+        logger.debug("Querying report %s at data version %s", report, version)
+        cursor = self.connection.execute(reports[report])
+        columns = [description[0] for description in cursor.description]
+        cached = (columns, cursor.fetchall())
+
+        with self.lock:
+            self.rows = dict((k, v) for k, v in self.rows.items() if k[1] == version)
+            self.rows[key] = cached
+        return cached
+
+    def render(self, report, format='json'):
+        """ Rendered `report` in `format`, from cache when nothing it reads has changed """
+
+        if report not in reports:
+            raise KeyError("Unknown report {0}".format(report))
+
+        version = self.version()
+        key = (report, format)
+
+        with self.lock:
+            cached = self.rendered.get(key)
+        if cached is not None and cached[0] == version:
+            metrics.increment('report_cache_total', report=report, result='hit')
+            return cached[1]
+
+        metrics.increment('report_cache_total', report=report, result='miss')
+        with metrics.timer('report_render_seconds', report=report, format=format):
+            columns, rows = self.query(report, version)
+            output = renderers[format](report, columns, rows)
+
+        with self.lock:
+            self.rendered[key] = (version, output)
+            while len(self.rendered) > self.size:
+                self.rendered.pop(next(iter(self.rendered)))
+        return output
+
+
+if __name__ == '__main__':
+    import argparse
+    import config
+    import dbpool
+
+    parser = argparse.ArgumentParser(description="Render a report from the spree database")
+    parser.add_argument('report', choices=sorted(reports))
+    parser.add_argument('--format', choices=sorted(renderers), default='json')
+    args = parser.parse_args()
+
+    print(ReportCache(dbpool.ReadPool(config.database_file, 1)).render(args.report, args.format))
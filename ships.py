@@ -0,0 +1,135 @@
+import csv
+import logging
+
+from types import MappingProxyType
+
+from config import logging_file
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Logging Configuration
+logging.basicConfig(filename=logging_file, level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+console = logging.StreamHandler()
+console.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+console.setFormatter(formatter)
+logger.addHandler(console)
+
+# invCategories.categoryID of ships, the type dumps list every other type alongside them
+ship_category = 6
+
+
+def load_csv(path):
+    """ Reads (typeID, groupID, typeName) rows from an SDE invTypes style CSV dump """
+
+    with open(path, newline='', encoding='utf-8') as handle:
+        for row in csv.DictReader(handle):
+            yield int(row['typeID']), int(row['groupID']), row['typeName']
+
+
+def load_yaml(path):
+    """ Reads types from an SDE typeIDs.yaml dump """
+
+    if yaml is None:
+        raise RuntimeError("PyYAML is required to import {0}".format(path))
+
+    with open(path, encoding='utf-8') as handle:
+        types = yaml.safe_load(handle)
+
+    for typeID, data in types.items():
+        name = data.get('name', {})
+        yield int(typeID), int(data['groupID']), name.get('en') if isinstance(name, dict) else name
+
+
+def load_group_csv(path):
+    """ Reads (groupID, categoryID) rows from an SDE invGroups style CSV dump """
+
+    with open(path, newline='', encoding='utf-8') as handle:
+        for row in csv.DictReader(handle):
+            yield int(row['groupID']), int(row['categoryID'])
+
+
+def load_group_yaml(path):
+    """ Reads groups from an SDE groupIDs.yaml dump """
+
+    if yaml is None:
+        raise RuntimeError("PyYAML is required to import {0}".format(path))
+
+    with open(path, encoding='utf-8') as handle:
+        groups = yaml.safe_load(handle)
+
+    for groupID, data in groups.items():
+        yield int(groupID), int(data['categoryID'])
+
+
+def load_ship_groups(path):
+    """ The groupIDs of the Ship category in an invGroups CSV or groupIDs YAML dump """
+
+    if path.endswith('.yaml') or path.endswith('.yml'):
+        rows = load_group_yaml(path)
+    else:
+        rows = load_group_csv(path)
+
+    return set(groupID for groupID, categoryID in rows if categoryID == ship_category)
+
+
+def load_ships(path, groups):
+    """ Reads (shipID, groupID, name) of the types in `groups` from a static data dump """
+
+    if path.endswith('.yaml') or path.endswith('.yml'):
+        rows = load_yaml(path)
+    else:
+        rows = load_csv(path)
+
+    for shipID, groupID, name in rows:
+        if groupID in groups:
+            yield shipID, groupID, name
+
+
+class ShipIndex(object):
+    """ Immutable in-memory view of `ships`, for membership checks without a query per kill """
+
+    def __init__(self, rows, groups=None):
+        ships = {}
+        for shipID, groupID, name in rows:
+            if groups is None or groupID in groups:
+                ships[shipID] = (groupID, name)
+
+        self.groups = None if groups is None else frozenset(groups)
+        self.ships = MappingProxyType(ships)
+        self.shipIDs = frozenset(ships)
+
+    def __contains__(self, shipID):
+        return shipID in self.shipIDs
+
+    def __len__(self):
+        return len(self.shipIDs)
+
+    def name(self, shipID):
+        return self.ships[shipID][1]
+
+    def group(self, shipID):
+        return self.ships[shipID][0]
+
+
+if __name__ == '__main__':
+    import argparse
+    import config
+
+    from dbactions import DBHandler
+
+    parser = argparse.ArgumentParser(description="Import ship types from a static data dump into `ships`")
+    parser.add_argument('path', help="invTypes CSV or typeIDs YAML file")
+    parser.add_argument('--group', type=int, action='append', dest='groups', help="Only import this groupID (repeatable)")
+    parser.add_argument('--groups-file', help="invGroups CSV or groupIDs YAML file, imports every group of the Ship category")
+    args = parser.parse_args()
+    if args.groups is None and args.groups_file is None:
+        parser.error("give --group or --groups-file, the type dump also lists modules, charges and structures")
+
+    db = DBHandler()
+    db.connect(config.database_file)
+    db.import_ships(args.path, args.groups, args.groups_file)
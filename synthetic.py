@@ -0,0 +1,82 @@
+import random
+
+from datetime import datetime, timedelta
+
+
+"""
+Deterministic synthetic zkillboard/ESI killmails for offline benchmarking.
+The same seed and count always produce the same reports.
+"""
+
+# groupID 25 frigates, so generated fights pass the spree ship checks
+frigates = [582, 583, 584, 585, 586, 587, 589, 590, 591, 592, 593, 594, 597, 598, 599, 602, 603, 605, 607, 608, 609]
+weapons = [2873, 2881, 3082, 3178, 3186, 484, 488, 492, 561, 562, 564]
+items = [2048, 2605, 3831, 4025, 5973, 1541, 1999, 2281, 380, 439, 31788, 31117]
+
+
+def killmail(killID, rng, players=500, system=31000382, start=datetime(2020, 3, 13, 11)):
+    """ Build one ESI killmail with a single final-blow attacker and a few support attackers """
+
+    victimID = 90000000 + rng.randrange(players)
+    attackers = []
+    for index in range(rng.randint(1, 4)):
+        attackers.append({
+            "character_id": 90000000 + rng.randrange(players),
+            "corporation_id": 98000000 + rng.randrange(50),
+            "damage_done": rng.randint(50, 3000),
+            "final_blow": index == 0,
+            "security_status": round(rng.uniform(-10, 5), 1),
+            "ship_type_id": rng.choice(frigates),
+            "weapon_type_id": rng.choice(weapons)
+        })
+    rng.shuffle(attackers)
+
+    return {
+        "attackers": attackers,
+        "killmail_id": killID,
+        "killmail_time": (start + timedelta(seconds=killID * 37 % 86400)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "solar_system_id": system,
+        "victim": {
+            "character_id": victimID,
+            "corporation_id": 98000000 + rng.randrange(50),
+            "damage_taken": sum(attacker["damage_done"] for attacker in attackers),
+            "items": [{
+                "flag": rng.choice([11, 12, 19, 20, 27, 28, 92]),
+                "item_type_id": rng.choice(items),
+                "quantity_destroyed" if rng.random() < 0.5 else "quantity_dropped": rng.randint(1, 3),
+                "singleton": 0
+            } for _ in range(rng.randint(2, 8))],
+            "position": {"x": rng.uniform(-1e12, 1e12), "y": rng.uniform(-1e11, 1e11), "z": rng.uniform(-1e12, 1e12)},
+            "ship_type_id": rng.choice(frigates)
+        }
+    }
+
+
+def zkill_report(killData, rng):
+    """ Build the zkillboard summary that points at `killData` """
+
+    value = round(rng.uniform(5e6, 8e7), 2)
+    return {
+        "killmail_id": killData["killmail_id"],
+        "zkb": {
+            "locationID": 40000000 + rng.randrange(1000),
+            "hash": "%040x" % rng.getrandbits(160),
+            "fittedValue": round(value * 0.8, 2),
+            "totalValue": value,
+            "points": rng.randint(1, 20),
+            "npc": False,
+            "solo": len(killData["attackers"]) == 1,
+            "awox": False
+        }
+    }
+
+
+def generate(count, seed=0, first_killID=80000000, **kwargs):
+    """ Yields (zkill report, ESI killmail) pairs in ascending killID order """
+
+    rng = random.Random(seed)
+    killID = first_killID
+    for _ in range(count):
+        killID = killID + rng.randint(1, 50)
+        killData = killmail(killID, rng, **kwargs)
+        yield zkill_report(killData, rng), killData
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+# Modules read these at import time, keep the log and the killmail cache out of the working tree
+config.logging_file = os.path.join(tempfile.gettempdir(), 'spree-tests.log')
+config.killcache_dir = None
+
+import benchmark
+import client
+import metrics
+
+from mockserver import Dataset, MockServer
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """ Every test starts with empty metrics and no governor history """
+
+    metrics.registry.reset()
+    client.governors.clear()
+    yield
+
+
+@pytest.fixture
+def serve():
+    """ Starts MockServers over synthetic datasets, with zkillboard/ESI/RedisQ pointed at the last one """
+
+    servers = []
+
+    def start(count=200, seed=0, latency=0.0, rate=1000):
+        server = MockServer(Dataset(count, seed), latency).start()
+        benchmark.point_at(server, rate)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def database(tmp_path):
+    """ A new database at the current schema, `ships` holding the synthetic frigates """
+
+    db = benchmark.new_database(str(tmp_path), 'test.db')
+    yield db
+    db.connection.close()
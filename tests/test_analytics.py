@@ -0,0 +1,51 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import analytics
+import columnar
+import synthetic
+
+
+def fights(times, values=None):
+    count = len(times)
+    return {
+        'killID': numpy.arange(count, dtype='int64'),
+        'time': numpy.array(times, dtype='int64'),
+        'attackerID': numpy.arange(count, dtype='int64'),
+        'attacker_shipID': numpy.zeros(count, dtype='int64'),
+        'victimID': numpy.arange(count, dtype='int64') + 1000,
+        'victim_shipID': numpy.zeros(count, dtype='int64'),
+        'value': numpy.array(values if values is not None else [1.0] * count),
+    }
+
+
+def test_activity_buckets_align_to_boundaries():
+    starts, counts, isk = analytics.activity(fights([3599, 7198], [1.0, 2.0]), bucket=3600)
+
+    assert starts.tolist() == [0, 3600]
+    assert counts.tolist() == [1, 1]
+    assert isk.tolist() == [1.0, 2.0]
+
+
+def test_activity_skips_empty_buckets():
+    starts, counts, _ = analytics.activity(fights([100, 200, 3700, 11000]), bucket=3600)
+
+    assert starts.tolist() == [0, 3600, 10800]
+    assert counts.tolist() == [2, 1, 1]
+
+
+def test_leaderboard_matches_player_score(database, tmp_path):
+    pairs = list(synthetic.generate(1000))
+    database.ingest_kills(report for report, _ in pairs)
+    database.ingest_killdata(killData for _, killData in pairs)
+    database.parse_spree()
+
+    columnar.export(database.connection, str(tmp_path))
+    players, wins, losses, isk = analytics.leaderboard(columnar.load(str(tmp_path))['fights'])
+
+    expected = dict((row[0], row[1:]) for row in database.connection.execute('SELECT `characterID`, `wins`, `losses`, `isk_destroyed` FROM `player_score`'))
+    assert len(players) == len(expected)
+    for characterID, won, lost, destroyed in zip(players.tolist(), wins.tolist(), losses.tolist(), isk.tolist()):
+        assert (won, lost) == expected[characterID][:2]
+        assert destroyed == pytest.approx(expected[characterID][2])
@@ -0,0 +1,108 @@
+import json
+
+from datetime import date
+
+import pytest
+
+import backfill
+import client
+
+
+system = 31000382
+
+
+@pytest.fixture(autouse=True)
+def fast_zkillboard(monkeypatch):
+    # The live zkillboard limit of one request a second, the mock needs none
+    monkeypatch.setattr(backfill, 'zkillboard_rate_limit', 1000)
+
+
+def write_histories(server, directory):
+    """ The mock's daily killID -> hash files, saved the way zkillboard serves them """
+
+    for day in ('20200313', '20200314'):
+        with open(str(directory / (day + '.json')), 'w') as handle:
+            json.dump(server.dataset.history(day), handle)
+
+
+def test_backfill_from_history_files(serve, database, tmp_path):
+    server = serve(count=300)
+    write_histories(server, tmp_path)
+
+    # A tenth of the kills happened somewhere else
+    elsewhere = sorted(server.dataset.esi)[::10]
+    for killID in elsewhere:
+        server.dataset.esi[killID]['solar_system_id'] = 30000142
+
+    inserted, _, _ = backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], history_dir=str(tmp_path))
+
+    assert inserted == 300 - len(elsewhere)
+    assert server.requests['page'] == 0
+    assert server.requests['history'] == 0
+    assert server.requests['killmail'] == 300
+    assert server.requests['killid'] == inserted
+
+    stored = set(killID for killID, in database.connection.execute('SELECT `killID` FROM `zkill`'))
+    assert stored == set(server.dataset.zkill) - set(elsewhere)
+    assert database.connection.execute('SELECT COUNT(*) FROM `killmail` WHERE `solarSystemID` <> ?', (system,)).fetchone()[0] == 0
+
+
+def test_backfill_skips_known_kills(serve, database, tmp_path):
+    server = serve(count=100)
+    write_histories(server, tmp_path)
+
+    backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], history_dir=str(tmp_path))
+    assert backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], history_dir=str(tmp_path)) == (0, 0, 0)
+    assert server.requests['killmail'] == 100
+
+
+def test_backfill_skips_rejected_kills(serve, database, tmp_path):
+    server = serve(count=300)
+    write_histories(server, tmp_path)
+    elsewhere = sorted(server.dataset.esi)[::10]
+    for killID in elsewhere:
+        server.dataset.esi[killID]['solar_system_id'] = 30000142
+
+    backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], history_dir=str(tmp_path))
+    assert backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], history_dir=str(tmp_path)) == (0, 0, 0)
+    assert server.requests['killmail'] == 300
+
+    # Another filter has not checked them yet
+    inserted, _, _ = backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system, 30000142], history_dir=str(tmp_path))
+    assert inserted == len(elsewhere)
+    assert server.requests['killmail'] == 300 + len(elsewhere)
+
+
+def test_backfill_stores_no_kill_without_its_value(serve, database, tmp_path, monkeypatch):
+    server = serve(count=100)
+    write_histories(server, tmp_path)
+    monkeypatch.setattr(client, 'governor_backoff', 0.01)
+    # One worker, so every scripted failure lands on the same kill
+    monkeypatch.setattr(backfill, 'zkillboard_concurrency', 1)
+    server.script(*[(503, {})] * client.http_retries, route='killid')
+
+    inserted, _, _ = backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], history_dir=str(tmp_path))
+    assert inserted == 99
+    for table in ('esi', 'killmail'):
+        stored = set(killID for killID, in database.connection.execute('SELECT `killID` FROM `{0}`'.format(table)))
+        assert stored == set(killID for killID, in database.connection.execute('SELECT `killID` FROM `zkill`'))
+
+    # Not rejected, so the next run picks it up again
+    inserted, _, _ = backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], history_dir=str(tmp_path))
+    assert inserted == 1
+    assert database.connection.execute('SELECT COUNT(*) FROM `esi`').fetchone()[0] == 100
+
+
+def test_backfill_filters_ship_groups(serve, database, tmp_path):
+    server = serve(count=100)
+    write_histories(server, tmp_path)
+
+    assert backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], groups=[26], history_dir=str(tmp_path)) == (0, 0, 0)
+    assert server.requests['killid'] == 0
+
+    inserted, _, _ = backfill.backfill(database, date(2020, 3, 13), date(2020, 3, 14), [system], groups=[25], history_dir=str(tmp_path))
+    assert inserted == 100
+
+
+def test_missing_history_file(tmp_path):
+    assert backfill.load_histories(date(2020, 3, 13), date(2020, 3, 13), str(tmp_path)) == {}
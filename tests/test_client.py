@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+import client
+import esi
+import mockserver
+
+from mockserver import Dataset, MockServer
+
+
+@pytest.fixture
+def quick_backoff(monkeypatch):
+    monkeypatch.setattr(client, 'governor_backoff', 0.01)
+    monkeypatch.setattr(client, 'governor_breaker_cooldown', 0.2)
+
+
+def first_kill(server):
+    killID = min(server.dataset.zkill)
+    return killID, server.dataset.zkill[killID]['zkb']['hash']
+
+
+def host(server):
+    return server.url.split('://')[1]
+
+
+def test_retry_after_is_honoured(serve):
+    server = serve(count=5)
+    server.script((429, {'Retry-After': '1'}), route='killmail')
+
+    started = time.perf_counter()
+    killID, hash = first_kill(server)
+    assert esi.fetch_kill(killID, hash)['killmail_id'] == killID
+    assert time.perf_counter() - started >= 0.9
+    assert server.requests['killmail'] == 2
+
+
+def test_backoff_on_server_errors(serve, quick_backoff):
+    server = serve(count=5)
+    server.script((503, {}), (502, {}), route='killmail')
+
+    killID, hash = first_kill(server)
+    assert esi.fetch_kill(killID, hash)['killmail_id'] == killID
+    assert server.requests['killmail'] == 3
+
+    # Success shrinks the doubled interval again and resets the failure count
+    budget = client.budget(host(server))
+    assert budget['failures'] == 0
+    assert budget['circuit'] == 'closed'
+
+
+def test_error_limit_headers_pause_the_host(serve, monkeypatch):
+    monkeypatch.setattr(mockserver, 'error_limit', client.governor_error_floor + 2)
+    server = serve(count=5)
+
+    for killID in range(2):
+        # Unknown killmails answer 404 and spend the error budget
+        esi.fetch_kill(killID, 'unknown')
+
+    budget = client.budget(host(server))
+    assert budget['error_limit_remain'] == client.governor_error_floor
+    assert budget['paused_for'] > 0
+    assert budget['error_limit_reset'] > 0
+
+
+def test_exhausted_error_limit_answers_420(serve, monkeypatch, quick_backoff):
+    monkeypatch.setattr(mockserver, 'error_limit', 1)
+    monkeypatch.setattr(client, 'governor_error_floor', -1)
+    server = serve(count=5)
+
+    esi.fetch_kill(1, 'unknown')
+    killID, hash = first_kill(server)
+    assert esi.fetch_kill(killID, hash) is None
+    assert client.budget(host(server))['failures'] == client.http_retries
+
+
+def test_circuit_opens_and_recovers(serve, monkeypatch, quick_backoff):
+    monkeypatch.setattr(client, 'governor_breaker_failures', 2)
+    server = serve(count=5)
+    server.script(*[(503, {})] * 2, route='killmail')
+
+    killID, hash = first_kill(server)
+    assert esi.fetch_kill(killID, hash) is None
+    assert client.budget(host(server))['circuit'] == 'open'
+    assert server.requests['killmail'] == 2
+
+    time.sleep(0.3)
+    assert client.budget(host(server))['circuit'] == 'half-open'
+    assert esi.fetch_kill(killID, hash)['killmail_id'] == killID
+    assert client.budget(host(server))['circuit'] == 'closed'
+
+
+def test_connection_errors_reach_the_circuit(monkeypatch, quick_backoff):
+    monkeypatch.setattr(client, 'governor_breaker_failures', 2)
+    server = MockServer(Dataset(5)).start()
+    port = server.server_address[1]
+    url = server.url + '/latest/characters/1/'
+    server.stop()
+
+    # Host down: connection errors count as failures and open the circuit
+    assert client.send(client.session.get, url, {}) is None
+    assert client.budget(host(server))['circuit'] == 'open'
+
+    # A probe that cannot connect reopens the circuit instead of wedging it
+    time.sleep(0.3)
+    assert client.send(client.session.get, url, {}) is None
+    assert client.governor(host(server)).probing is False
+
+    server = MockServer(Dataset(5), port=port).start()
+    try:
+        time.sleep(0.3)
+        request = client.send(client.session.get, url, {})
+        assert request is not None and request.status_code == 200
+        assert client.budget(host(server))['circuit'] == 'closed'
+    finally:
+        server.stop()
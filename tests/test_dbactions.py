@@ -0,0 +1,21 @@
+import metrics
+import synthetic
+
+
+def count(db, table):
+    return db.connection.execute('SELECT COUNT(*) FROM `{0}`'.format(table)).fetchone()[0]
+
+
+def test_failed_batches_are_reported_apart_from_skipped_rows(database):
+    killmails = [killData for _, killData in synthetic.generate(6)]
+    # Stored as a row, but cannot be shredded, so its whole batch rolls back
+    broken = {'killmail_id': 1}
+
+    assert database.ingest_killdata(killmails[:2]) == (2, 0, 0)
+    assert database.ingest_killdata(killmails[:2] + [broken] + killmails[2:], batch_size=3) == (4, 0, 3)
+    assert count(database, 'esi') == 6
+    assert count(database, 'killmail') == 6
+
+    rows = dict(((counter['labels']['method'], counter['labels']['outcome']), counter['value']) for counter in metrics.registry.dump()['counters'] if counter['name'] == 'db_rows_total')
+    assert rows[('ingest_killdata', 'failed')] == 3
+    assert rows[('ingest_killdata', 'skipped')] == 0
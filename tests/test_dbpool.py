@@ -0,0 +1,124 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import dbpool
+import synthetic
+
+
+def test_queued_writes_apply_in_order(database):
+    database.connection.close()
+    db = dbpool.Database(database.database_file)
+    try:
+        futures = [db.write('INSERT INTO `sync_state` (`query`, `last_killID`) VALUES (?, ?)', ('q{0}'.format(n), n)) for n in range(500)]
+        futures.append(db.write('UPDATE `sync_state` SET `last_killID` = `last_killID` + 1000 WHERE `query` = ?', ('q0',)))
+        assert [future.result() for future in futures] == [1] * 501
+
+        # A failing statement only fails its own future
+        duplicate = db.write('INSERT INTO `sync_state` (`query`, `last_killID`) VALUES (?, ?)', ('q1', 1))
+        following = db.write('INSERT INTO `sync_state` (`query`, `last_killID`) VALUES (?, ?)', ('q500', 500))
+        with pytest.raises(sqlite3.IntegrityError):
+            duplicate.result()
+        assert following.result() == 1
+
+        assert db.execute('SELECT COUNT(*) FROM `sync_state`').fetchone() == (501,)
+        assert db.execute('SELECT `last_killID` FROM `sync_state` WHERE `query` = ?', ('q0',)).fetchone() == (1000,)
+    finally:
+        db.close()
+
+
+def test_retried_batch_keeps_generator_rows(database):
+    database.connection.close()
+    db = dbpool.Database(database.database_file)
+    try:
+        # Hold the writer so both statements land in one batch
+        release = threading.Event()
+        db.call(lambda handler: release.wait(10))
+        rows = db.write('INSERT INTO `sync_state` (`query`, `last_killID`) VALUES (?, ?)', (('g{0}'.format(n), n) for n in range(50)), many=True)
+        db.write('INSERT INTO `sync_state` (`query`, `last_killID`) VALUES (?, ?)', ('g0', 0))
+        release.set()
+
+        assert rows.result() == 50
+        assert db.execute('SELECT COUNT(*) FROM `sync_state` WHERE `query` LIKE \'g%\'').fetchone() == (50,)
+    finally:
+        db.close()
+
+
+def test_readers_are_read_only(database):
+    pool = dbpool.ReadPool(database.database_file, 1)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            pool.execute('DELETE FROM `ships`')
+        assert pool.execute('SELECT COUNT(*) FROM `ships`').fetchone() == (len(synthetic.frigates),)
+    finally:
+        pool.close()
+
+
+def test_readers_keep_serving_during_ingest(database):
+    database.connection.close()
+    db = dbpool.Database(database.database_file)
+    # Without pilots fighting themselves, which no real killmail has
+    pairs = [(report, killData) for report, killData in synthetic.generate(6000)
+        if all(attacker['character_id'] != killData['victim']['character_id'] for attacker in killData['attackers'] if attacker['final_blow'])]
+    errors = []
+    reads = []
+    ingesting = threading.Event()
+    finished = threading.Event()
+
+    def ingest(handler):
+        ingesting.set()
+        for start in range(0, len(pairs), 500):
+            chunk = pairs[start:start + 500]
+            handler.ingest_kills(report for report, _ in chunk)
+            handler.ingest_killdata(killData for _, killData in chunk)
+        handler.parse_spree()
+        return handler.connection.execute('SELECT COUNT(*) FROM `spree`').fetchone()[0]
+
+    def read():
+        ingesting.wait()
+        while not finished.is_set():
+            started = time.perf_counter()
+            try:
+                db.execute('SELECT * FROM `player_leaderboard` LIMIT 20')
+                db.execute('SELECT COUNT(*) FROM `zkill`')
+            except Exception as e:
+                errors.append(e)
+                return
+            reads.append(time.perf_counter() - started)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+
+    try:
+        fights = db.call(ingest).result()
+    finally:
+        finished.set()
+        for reader in readers:
+            reader.join()
+        db.close()
+
+    assert fights == len(pairs)
+    assert errors == []
+    # Readers never waited for the writer's transactions to finish
+    assert len(reads) >= 100
+    assert sorted(reads)[len(reads) // 2] < 0.05
+
+
+def test_failed_call_closes_on_writer_thread(database):
+    database.connection.close()
+    writer = dbpool.Writer(database.database_file)
+    writer.start()
+    writer.ready.wait()
+
+    handler = writer.call(lambda db: db).result()
+    failed = writer.call(lambda db: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        failed.result()
+    writer.close()
+
+    assert handler.connection is None
+    # Releasing the handler off the writer thread must not touch its connection
+    handler.__del__()
@@ -0,0 +1,57 @@
+import time
+
+import esi
+
+
+def ingest_reports(db, server):
+    db.ingest_kills(server.dataset.zkill[killID] for killID in sorted(server.dataset.zkill))
+
+
+def test_fetch_missing_kills_fetches_each_kill_once(serve, database):
+    server = serve(count=300)
+    ingest_reports(database, server)
+
+    database.fetch_missing_kills()
+    assert server.requests['killmail'] == 300
+    assert database.connection.execute('SELECT COUNT(*) FROM `esi`').fetchone()[0] == 300
+    assert database.connection.execute('SELECT COUNT(*) FROM `killmail`').fetchone()[0] == 300
+
+    # Nothing is missing any more, so nothing is requested again
+    database.fetch_missing_kills()
+    assert server.requests['killmail'] == 300
+
+
+def test_fetch_missing_kills_overlaps_requests(serve, database):
+    latency = 0.05
+    server = serve(count=160, latency=latency)
+    ingest_reports(database, server)
+
+    started = time.perf_counter()
+    database.fetch_missing_kills()
+    elapsed = time.perf_counter() - started
+
+    # Eight workers, so well under the serial 160 * latency
+    assert server.requests['killmail'] == 160
+    assert elapsed < 160 * latency / 3
+
+
+def test_fetch_all_respects_rate(serve):
+    server = serve(count=60)
+    kills = [(killID, server.dataset.zkill[killID]['zkb']['hash']) for killID in sorted(server.dataset.zkill)]
+
+    started = time.perf_counter()
+    fetched = dict(esi.fetch_kills(kills, concurrency=8, rate=100))
+    elapsed = time.perf_counter() - started
+
+    assert len(fetched) == 60
+    assert all(fetched[killID]['killmail_id'] == killID for killID in fetched)
+    assert elapsed >= 59 / 100.0
+
+
+def test_fetch_all_skips_duplicate_keys(serve):
+    server = serve(count=20)
+    kills = [(killID, server.dataset.zkill[killID]['zkb']['hash']) for killID in sorted(server.dataset.zkill)]
+
+    fetched = list(esi.fetch_kills(kills + kills[:10]))
+    assert len(fetched) == 20
+    assert server.requests['killmail'] == 20
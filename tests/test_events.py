@@ -0,0 +1,65 @@
+import pytest
+
+from events import update_events
+
+
+def query_url(server):
+    return "{0}/api/systemID/31000382/groupID/25/".format(server.url)
+
+
+@pytest.fixture
+def dataset(serve, monkeypatch):
+    server = serve(count=400)
+    # The generator can pit a pilot against themselves, which no real killmail does
+    for killData in server.dataset.esi.values():
+        for attacker in killData['attackers']:
+            if attacker['final_blow'] and attacker['character_id'] == killData['victim']['character_id']:
+                attacker['character_id'] = attacker['character_id'] + 1000
+    return server
+
+
+def scores(database, eventID):
+    return database.connection.execute('SELECT `characterID`, `shipID`, `wins`, `losses`, ROUND(`isk_destroyed`, 2) FROM `event_score` '
+        'WHERE `eventID` = ? ORDER BY `characterID`, `shipID`', (eventID,)).fetchall()
+
+
+def test_open_event_matches_ship_score(dataset, database):
+    update_events(database, [{'name': 'open', 'query': query_url(dataset)}])
+    eventID = database.register_events([])['open']
+
+    expected = database.connection.execute('SELECT `characterID`, `shipID`, `wins`, `losses`, ROUND(`isk_destroyed`, 2) FROM `ship_score` '
+        'ORDER BY `characterID`, `shipID`').fetchall()
+    assert len(expected) > 0
+    assert scores(database, eventID) == expected
+
+
+def test_event_window_excludes_kills(dataset, database):
+    # Written the way a config file would, without the T and Z of killmail times
+    event = {'name': 'window', 'query': query_url(dataset), 'start': '2020-03-13 06:00:00', 'end': '2020-03-13 18:00'}
+    update_events(database, [event])
+    eventID = database.register_events([])['window']
+
+    assert database.connection.execute('SELECT `start`, `end` FROM `event` WHERE `eventID` = ?', (eventID,)).fetchone() == ('2020-03-13T06:00:00Z', '2020-03-13T18:00:00Z')
+
+    inside = dict((killID, value) for killID, time, value in database.connection.execute(
+        'SELECT K.`killID`, K.`time`, Z.`value` FROM `killmail` K JOIN `zkill` Z ON Z.`killID` = K.`killID`')
+        if '2020-03-13T06:00:00Z' <= time < '2020-03-13T18:00:00Z')
+    assert 0 < len(inside) < 400
+
+    expected = {}
+    for killID, attackerID, attacker_shipID, victimID, victim_shipID in database.connection.execute(
+            'SELECT `killID`, `attackerID`, `attacker_shipID`, `victimID`, `victim_shipID` FROM `spree`'):
+        if killID not in inside:
+            continue
+        win = expected.setdefault((attackerID, attacker_shipID), [0, 0, 0.0])
+        win[0] = win[0] + 1
+        win[2] = win[2] + inside[killID]
+        loss = expected.setdefault((victimID, victim_shipID), [0, 0, 0.0])
+        loss[1] = loss[1] + 1
+
+    assert scores(database, eventID) == sorted(key + (wins, losses, round(isk, 2)) for key, (wins, losses, isk) in expected.items())
+
+
+def test_unrecognized_event_time(database):
+    with pytest.raises(ValueError):
+        database.register_events([{'name': 'broken', 'query': 'q', 'start': 'next tuesday'}])
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import killcache
+import synthetic
+
+from killcache import KillCache
+
+
+@pytest.fixture
+def killmails():
+    return [killData for _, killData in synthetic.generate(200)]
+
+
+def orphaned(cache):
+    entries = cache.index.execute('SELECT DISTINCT `segment` FROM `entry`').fetchall()
+    return [segment for segment, in entries if not os.path.exists(cache.path(segment))]
+
+
+def test_round_trip_and_export(tmp_path, killmails):
+    cache = KillCache(str(tmp_path / 'cache'))
+    for killData in killmails:
+        assert cache.put_payload(killData['killmail_id'], 'a' * 40, killcache.codec.encode(killData, 'zlib'))
+    assert not cache.put_payload(killmails[0]['killmail_id'], 'a' * 40, b'')
+
+    assert cache.get(killmails[5]['killmail_id'], 'a' * 40) == killmails[5]
+    assert cache.get(killmails[5]['killmail_id'], 'b' * 40) is None
+
+    assert cache.export(str(tmp_path / 'kills.kmc')) == len(killmails)
+    other = KillCache(str(tmp_path / 'other'))
+    assert other.import_file(str(tmp_path / 'kills.kmc')) == len(killmails)
+    assert other.get(killmails[-1]['killmail_id'], 'a' * 40) == killmails[-1]
+    cache.close()
+    other.close()
+
+
+def test_recently_written_segments_are_kept(tmp_path, killmails):
+    directory = str(tmp_path / 'cache')
+    first = KillCache(directory, max_bytes=4096, segment_bytes=2048)
+    second = KillCache(directory, max_bytes=4096, segment_bytes=2048)
+
+    first.put(killmails[0]['killmail_id'], 'a' * 40, killmails[0])
+    for killData in killmails[1:60]:
+        second.put(killData['killmail_id'], 'a' * 40, killData)
+
+    # Over the limit, but the segment `first` writes to was just written
+    assert os.path.exists(first.path(first.active))
+    assert first.get(killmails[0]['killmail_id'], 'a' * 40) == killmails[0]
+    first.close()
+    second.close()
+
+
+def test_writer_moves_on_from_an_evicted_segment(tmp_path, killmails, monkeypatch):
+    monkeypatch.setattr(killcache, 'killcache_idle_seconds', 0)
+    directory = str(tmp_path / 'cache')
+    first = KillCache(directory, max_bytes=4096, segment_bytes=2048)
+    second = KillCache(directory, max_bytes=4096, segment_bytes=2048)
+
+    first.put(killmails[0]['killmail_id'], 'a' * 40, killmails[0])
+    evicted = first.active
+    for killData in killmails[1:60]:
+        second.put(killData['killmail_id'], 'a' * 40, killData)
+    assert not os.path.exists(first.path(evicted))
+
+    # `first` still holds the deleted file open, its next record has to land somewhere readable
+    first.put(killmails[100]['killmail_id'], 'a' * 40, killmails[100])
+    assert first.active != evicted
+    assert second.get(killmails[100]['killmail_id'], 'a' * 40) == killmails[100]
+    assert orphaned(first) == []
+    first.close()
+    second.close()
+
+
+def test_read_miss_drops_orphaned_entries(tmp_path, killmails):
+    cache = KillCache(str(tmp_path / 'cache'), segment_bytes=2048)
+    for killData in killmails[:30]:
+        cache.put(killData['killmail_id'], 'a' * 40, killData)
+
+    lost = cache.index.execute('SELECT `segment` FROM `entry` WHERE `killID` = ?', (killmails[0]['killmail_id'],)).fetchone()[0]
+    os.remove(cache.path(lost))
+
+    assert cache.get(killmails[0]['killmail_id'], 'a' * 40) is None
+    assert orphaned(cache) == []
+
+    # The kill can be cached again instead of being a permanent miss
+    assert cache.put_payload(killmails[0]['killmail_id'], 'a' * 40, killcache.codec.encode(killmails[0], 'zlib'))
+    assert cache.get(killmails[0]['killmail_id'], 'a' * 40) == killmails[0]
+    cache.close()
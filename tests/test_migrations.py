@@ -0,0 +1,147 @@
+import sqlite3
+
+import migrations
+import synthetic
+
+from dbactions import DBHandler, resolve_players
+
+
+# The tables as the first revision of dbactions created them
+baseline_schema = """
+CREATE TABLE `zkill` (
+    `killID` INT UNSIGNED NOT NULL,
+    `hash` VARCHAR(40) NOT NULL,
+    `value` REAL NOT NULL,
+    `killReport` TEXT NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+
+CREATE TABLE `esi` (
+    `killID` INT UNSIGNED NOT NULL,
+    `killReport` TEXT NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+
+CREATE TABLE `spree`(
+    `killID` INT UNSIGNED NOT NULL,
+    `attackerID` INT UNSIGNED NOT NULL,
+    `attacker_shipID` INT UNSIGNED NOT NULL,
+    `weaponID` INT UNSIGNED NOT NULL,
+    `victimID` INT UNSIGNED NOT NULL,
+    `victim_shipID` INT UNSIGNED NOT NULL,
+    `valid` INT UNSIGNED NOT NULL,
+    `eligible` INT UNSIGNED NOT NULL,
+    PRIMARY KEY (`killID`)
+);
+
+CREATE TABLE `character` (
+    `characterID` INT UNSIGNED NOT NULL,
+    `name` TEXT NOT NULL,
+    `corporationID` INT UNSIGNED NOT NULL,
+    `race` INT UNSIGNED NOT NULL,
+    `birthday` DATETIME NOT NULL,
+    PRIMARY KEY (`characterID`)
+);
+
+CREATE TABLE `ships` (
+    `shipID` INT UNSIGNED NOT NULL,
+    `name` TEXT NOT NULL,
+    PRIMARY KEY (`shipID`)
+);
+
+CREATE VIEW `history`
+AS
+SELECT S.`killID`, A.`name` AS `attacker`, SA.`name` AS `attacker_ship`, V.`name` AS `victim`, SV.`name` AS `victim_ship`, Z.`value`, S.`valid`, S.`eligible` FROM `spree` S
+    JOIN `zkill` Z ON S.`killID` = Z.`killID`
+    JOIN `character` A ON S.`attackerID` = A.`characterID`
+    JOIN `character` V ON S.`victimID` = V.`characterID`
+    JOIN `ships` SA ON S.`attacker_shipID` = SA.`shipID`
+    JOIN `ships` SV ON S.`victim_shipID` = SV.`shipID`
+ORDER BY S.`killID`;
+"""
+
+
+def baseline(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(baseline_schema)
+    connection.execute("INSERT INTO `character` VALUES (90000001, 'Old Pilot', 98000001, 1, '2015-03-24 11:37:00')")
+    connection.commit()
+    connection.close()
+
+    db = DBHandler()
+    db.connect(path)
+    return db
+
+
+def notnull(connection, table):
+    return dict((column[1], column[3]) for column in connection.execute('PRAGMA table_info(`{0}`)'.format(table)))
+
+
+def test_baseline_migrates_to_latest(tmp_path):
+    db = baseline(str(tmp_path / 'baseline.db'))
+
+    assert db.migrate() == migrations.latest
+    assert migrations.version(db.connection) == migrations.latest
+    assert notnull(db.connection, 'character') == notnull(migrations.reference(), 'character')
+    assert db.connection.execute('SELECT `name`, `race` FROM `character`').fetchall() == [('Old Pilot', 1)]
+
+    # The rebuilt table carries its data_version triggers again
+    before = db.connection.execute('SELECT `version` FROM `data_version`').fetchone()[0]
+    assert db.store_players([(1, 'a', 2)], []) == 1
+    assert db.connection.execute('SELECT `version` FROM `data_version`').fetchone()[0] > before
+
+    # Migrating an up to date database changes nothing
+    assert db.migrate() == migrations.latest
+
+
+def test_baseline_resolves_players(tmp_path, serve):
+    server = serve(count=50)
+    db = baseline(str(tmp_path / 'baseline.db'))
+    db.migrate()
+
+    characterIDs = sorted(server.dataset.characters)[:20]
+    resolved, unresolved = resolve_players(characterIDs)
+    assert not unresolved
+    assert db.store_players(resolved, []) == len(characterIDs)
+
+    db.fetch_missing_profiles()
+    rows = db.connection.execute('SELECT COUNT(*) FROM `character` WHERE `race` IS NOT NULL AND `birthday` IS NOT NULL').fetchone()[0]
+    assert rows == len(characterIDs) + 1
+    assert server.requests['character'] == len(characterIDs)
+
+
+def test_new_database_is_latest(database):
+    assert migrations.version(database.connection) == migrations.latest
+    assert database.migrate() == migrations.latest
+    assert set(synthetic.frigates) <= database.ship_index().shipIDs
+
+
+def test_views_have_no_plan_regressions(database):
+    database.connection.executemany('INSERT INTO `spree` VALUES (?, ?, 582, 0, ?, 583, 1, 1)', [(killID, killID % 50, killID % 37) for killID in range(2000)])
+    database.connection.execute('ANALYZE')
+
+    assert migrations.check_plans(database.connection) == {}
+
+
+def test_migrated_views_have_no_plan_regressions(tmp_path):
+    db = baseline(str(tmp_path / 'baseline.db'))
+    db.migrate()
+
+    assert migrations.check_plans(db.connection) == {}
+
+
+def test_correlated_queries_are_flagged(database):
+    legacy = """SELECT P.`player`,
+        (SELECT COUNT(*) FROM `spree` WHERE `attackerID` = P.`player`) AS `wins`,
+        (SELECT COUNT(*) FROM `spree` WHERE `victimID` = P.`player`) AS `losses`
+    FROM (SELECT DISTINCT `attackerID` AS `player` FROM `spree` UNION SELECT DISTINCT `victimID` FROM `spree`) AS P"""
+    nested = 'SELECT * FROM `zkill` Z JOIN `esi` E ON E.`killReport` > Z.`killReport`'
+
+    regressed = migrations.check_plans(database.connection, {'legacy': legacy, 'nested': nested})
+    assert sorted(regressed) == ['legacy', 'nested']
+
+
+def test_spree_lookups_use_indexes(database):
+    for column, index in (('attackerID', 'spree_attacker'), ('victimID', 'spree_victim')):
+        plan = migrations.explain(database.connection, 'SELECT COUNT(*) FROM `spree` WHERE `{0}` = 1'.format(column))
+        assert any(index in detail for _, _, detail in plan)
@@ -0,0 +1,96 @@
+import client
+import zkillboard
+
+from dbactions import DBHandler
+
+from pipeline import Pipeline
+
+
+def query_url(server):
+    return "{0}/api/systemID/31000382/groupID/25/".format(server.url)
+
+
+def count(db, table):
+    return db.connection.execute('SELECT COUNT(*) FROM `{0}`'.format(table)).fetchone()[0]
+
+
+def test_pipeline_ingests_everything(serve, database):
+    server = serve(count=500)
+    query = query_url(server)
+
+    progress = Pipeline(query, database.database_file, rate=1000).run()
+
+    assert progress['pages'] == 500
+    assert progress['stored'] == 500
+    assert progress['sprees'] == count(database, 'spree')
+    assert server.requests['killmail'] == 500
+    assert count(database, 'character') == len(set(row for pair in database.connection.execute('SELECT `attackerID`, `victimID` FROM `spree`') for row in pair))
+    assert database.get_lastkill_query(query) == max(server.dataset.zkill)
+
+    # Nothing new, nothing fetched
+    assert Pipeline(query, database.database_file, rate=1000).run()['stored'] == 0
+    assert server.requests['killmail'] == 500
+
+
+def test_pipeline_skips_missing_killmails(serve, database):
+    server = serve(count=300)
+    query = query_url(server)
+
+    # A zkill row whose killmail ESI does not know, queued again on every start
+    report = dict(server.dataset.zkill[min(server.dataset.zkill)], killmail_id=1)
+    database.ingest_kills([report])
+
+    pipeline = Pipeline(query, database.database_file, rate=1000)
+    progress = pipeline.run()
+
+    assert not pipeline.stop.is_set()
+    assert progress['stored'] == 300
+    assert count(database, 'esi') == 300
+    assert database.connection.execute('SELECT COUNT(*) FROM `esi` WHERE `killID` = 1').fetchone()[0] == 0
+
+
+def test_pipeline_keeps_mark_on_failed_page(serve, database, monkeypatch):
+    server = serve(count=600)
+    query = query_url(server)
+    fetch_report = zkillboard.fetch_report
+
+    def failing(url, limiter=None):
+        if url.endswith('/page/2/'):
+            server.script(*[(503, {})] * client.http_retries, route='page')
+        return fetch_report(url, limiter)
+
+    monkeypatch.setattr(client, 'governor_backoff', 0.01)
+    monkeypatch.setattr(zkillboard, 'fetch_report', failing)
+
+    assert Pipeline(query, database.database_file, rate=1000).run()['stored'] == 200
+    assert database.get_lastkill_query(query) is None
+
+    monkeypatch.undo()
+    assert Pipeline(query, database.database_file, rate=1000).run()['stored'] == 400
+    assert database.get_lastkill_query(query) == max(server.dataset.zkill)
+    assert server.requests['killmail'] == 600
+
+
+def test_pipeline_keeps_mark_on_failed_batch(serve, database, monkeypatch):
+    server = serve(count=400)
+    query = query_url(server)
+    insert_batch = DBHandler.insert_batch
+    batches = []
+
+    def failing(self, statement, batch, on_batch=None):
+        if '`zkill`' in statement:
+            batches.append(batch)
+            if len(batches) == 1:
+                return None
+        return insert_batch(self, statement, batch, on_batch)
+
+    monkeypatch.setattr(DBHandler, 'insert_batch', failing)
+
+    Pipeline(query, database.database_file, rate=1000).run()
+    assert database.get_lastkill_query(query) is None
+
+    monkeypatch.undo()
+    Pipeline(query, database.database_file, rate=1000).run()
+    assert database.get_lastkill_query(query) == max(server.dataset.zkill)
+    assert count(database, 'zkill') == 400
+    assert count(database, 'esi') == 400
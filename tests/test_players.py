@@ -0,0 +1,67 @@
+import esi
+
+from dbactions import resolve_players
+
+
+def populate(db, server):
+    db.ingest_kills(server.dataset.zkill[killID] for killID in sorted(server.dataset.zkill))
+    db.ingest_killdata(server.dataset.esi[killID] for killID in sorted(server.dataset.esi))
+    db.parse_spree()
+    return set(characterID for row in db.connection.execute('SELECT `attackerID`, `victimID` FROM `spree`') for characterID in row)
+
+
+def test_fetch_missing_players_resolves_in_bulk(serve, database):
+    server = serve(count=400)
+    players = populate(database, server)
+
+    database.fetch_missing_players()
+
+    # One names and one affiliation call cover every pilot, profiles only fill race and birthday
+    assert server.requests['names'] == 1
+    assert server.requests['affiliation'] == 1
+    assert server.requests['character'] == len(players)
+
+    rows = database.connection.execute('SELECT `characterID`, `name`, `corporationID`, `race`, `birthday` FROM `character`').fetchall()
+    assert set(row[0] for row in rows) == players
+    for characterID, name, corporationID, race, birthday in rows:
+        profile = server.dataset.profile(characterID)
+        assert (name, corporationID, race, birthday) == (profile['name'], profile['corporation_id'], profile['race_id'], profile['birthday'])
+
+    database.fetch_missing_players()
+    assert server.requests['names'] == 1
+    assert server.requests['character'] == len(players)
+
+
+def test_unresolved_players_fall_back_to_profiles(serve, database):
+    server = serve(count=50)
+    populate(database, server)
+
+    # Unknown to the bulk endpoints, the profile route still answers for it
+    stranger = 91000000
+    database.connection.execute("INSERT INTO `spree` VALUES (1, ?, 582, 0, ?, 583, 1, 1)", (stranger, sorted(server.dataset.characters)[0]))
+    database.connection.commit()
+
+    resolved, unresolved = resolve_players([stranger] + sorted(server.dataset.characters)[:5])
+    assert len(resolved) == 5
+    assert unresolved == set([stranger])
+
+    database.fetch_missing_players()
+    assert database.connection.execute('SELECT `name`, `race` FROM `character` WHERE `characterID` = ?', (stranger,)).fetchone() == ('Pilot 91000000', 1)
+
+
+def test_invalid_id_only_fails_itself(serve, database):
+    server = serve(count=400)
+    characters = sorted(server.dataset.characters)
+    stranger = 91000000
+
+    resolved, unresolved = resolve_players(characters[:100] + [stranger] + characters[100:])
+    assert unresolved == set([stranger])
+    assert len(resolved) == len(characters)
+
+    # Halving the rejected chunk down to the stranger, not one profile per pilot
+    assert server.requests['names'] <= 2 * len(characters).bit_length() + 1
+    assert server.requests['character'] == 0
+
+
+def test_bulk_requests_are_chunked():
+    assert [len(chunk) for chunk in esi.chunks(range(2500))] == [1000, 1000, 500]
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import client
+import metrics
+import redisq
+
+from redisq import Consumer
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def start(consumer):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(consumer.run()), daemon=True)
+    thread.start()
+    return thread, result
+
+
+def count(database, query):
+    return database.connection.execute(query).fetchone()[0]
+
+
+def test_consumer_stores_live_kills(serve, database, monkeypatch):
+    monkeypatch.setattr(redisq, 'redisq_ttw', 0.2)
+    server = serve(count=300)
+    server.publish()
+
+    # Incomplete before the consumer started, left to update.py rather than fetched on every batch
+    database.connection.execute('INSERT INTO `character` (`characterID`, `name`, `corporationID`) VALUES (1, \'Old\', 2)')
+    database.connection.commit()
+
+    consumer = Consumer(database.database_file, systems=None)
+    thread, result = start(consumer)
+    wait_for(lambda: consumer.progress['stored'] == 300)
+    consumer.stop.set()
+    thread.join(30)
+    assert not thread.is_alive()
+
+    assert result['received'] == 300
+    assert count(database, 'SELECT COUNT(*) FROM `zkill`') == 300
+    assert count(database, 'SELECT COUNT(*) FROM `esi`') == 300
+    assert count(database, 'SELECT COUNT(*) FROM `spree`') == result['sprees'] > 0
+    assert server.requests['killmail'] == 0
+
+    # Every new fighter gets its race and birthday, one profile request each
+    fighters = count(database, 'SELECT COUNT(*) FROM `character` WHERE `characterID` <> 1')
+    assert fighters == result['players'] > 0
+    assert count(database, 'SELECT COUNT(*) FROM `character` WHERE `race` IS NULL OR `birthday` IS NULL') == 1
+    assert server.requests['character'] == fighters
+
+    latency = [histogram for histogram in metrics.registry.dump()['histograms'] if histogram['name'] == 'redisq_commit_latency_seconds']
+    assert latency[0]['count'] == 300
+
+
+def test_consumer_filters_by_system(serve, database, monkeypatch):
+    monkeypatch.setattr(redisq, 'redisq_ttw', 0.2)
+    server = serve(count=200)
+    systemID = server.dataset.esi[min(server.dataset.esi)]['solar_system_id']
+    for killID in sorted(server.dataset.esi)[::10]:
+        server.dataset.esi[killID]['solar_system_id'] = 30000142
+    ships = database.ship_index()
+    wanted = set(killID for killID, killData in server.dataset.esi.items() if killData['solar_system_id'] == systemID
+        and any(shipID in ships for shipID in [killData['victim']['ship_type_id']] + [attacker['ship_type_id'] for attacker in killData['attackers'] if attacker.get('final_blow')]))
+    assert 0 < len(wanted) <= 180
+    server.publish()
+
+    consumer = Consumer(database.database_file, systems=[systemID])
+    thread, result = start(consumer)
+    wait_for(lambda: consumer.progress['received'] == 200 and consumer.progress['stored'] == consumer.progress['matched'])
+    consumer.stop.set()
+    thread.join(30)
+
+    assert result['matched'] == len(wanted)
+    assert set(killID for killID, in database.connection.execute('SELECT `killID` FROM `esi`')) == wanted
+
+
+def test_interrupt_stores_buffered_kills(serve, database, monkeypatch):
+    monkeypatch.setattr(redisq, 'redisq_ttw', 0.2)
+    monkeypatch.setattr(redisq, 'redisq_batch_size', 10)
+    server = serve(count=300)
+    server.publish()
+    observe = metrics.observe
+    interrupted = []
+
+    def interrupt(name, value, **labels):
+        # Ctrl-C arriving while the committer is busy, after its first batch
+        if name == 'redisq_commit_latency_seconds' and not interrupted:
+            interrupted.append(value)
+            raise KeyboardInterrupt
+        observe(name, value, **labels)
+
+    monkeypatch.setattr(metrics, 'observe', interrupt)
+    consumer = Consumer(database.database_file, systems=None)
+    thread, result = start(consumer)
+    thread.join(30)
+
+    assert not thread.is_alive()
+    assert interrupted
+    assert result['matched'] > 10
+    assert result['stored'] == result['matched']
+    assert count(database, 'SELECT COUNT(*) FROM `esi`') == result['matched']
+
+
+def test_consumer_reconnects(serve, database, monkeypatch):
+    monkeypatch.setattr(redisq, 'redisq_ttw', 0.2)
+    monkeypatch.setattr(redisq, 'redisq_max_backoff', 0.05)
+    monkeypatch.setattr(client, 'governor_backoff', 0.01)
+    server = serve(count=100)
+    # One poll that fails on every attempt, short of tripping the breaker
+    server.script(*[(503, {})] * client.http_retries, route='redisq')
+    server.publish()
+
+    consumer = Consumer(database.database_file, systems=None)
+    thread, result = start(consumer)
+    wait_for(lambda: consumer.progress['stored'] == 100)
+    consumer.stop.set()
+    thread.join(30)
+
+    reconnects = [counter['value'] for counter in metrics.registry.dump()['counters'] if counter['name'] == 'redisq_reconnects_total']
+    assert reconnects and reconnects[0] > 0
+    assert count(database, 'SELECT COUNT(*) FROM `esi`') == 100
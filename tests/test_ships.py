@@ -0,0 +1,55 @@
+import pytest
+
+import ships
+
+
+types = """typeID,groupID,typeName,published
+587,25,Rifter,1
+603,25,Merlin,1
+24690,419,Hurricane,1
+2185,55,200mm AutoCannon I,1
+35832,1657,Astrahus,1
+"""
+
+groups = """groupID,categoryID,groupName
+25,6,Frigate
+419,6,Combat Battlecruiser
+55,7,Projectile Weapon
+1657,65,Citadel
+"""
+
+
+@pytest.fixture
+def dumps(tmp_path):
+    (tmp_path / 'invTypes.csv').write_text(types)
+    (tmp_path / 'invGroups.csv').write_text(groups)
+    return str(tmp_path / 'invTypes.csv'), str(tmp_path / 'invGroups.csv')
+
+
+def stored(database, shipIDs):
+    query = 'SELECT `shipID` FROM `ships` WHERE `shipID` IN ({0})'.format(', '.join('?' * len(shipIDs)))
+    return set(shipID for shipID, in database.connection.execute(query, shipIDs))
+
+
+def test_ship_groups_come_from_the_ship_category(dumps):
+    assert ships.load_ship_groups(dumps[1]) == set([25, 419])
+    assert list(ships.load_ships(dumps[0], [25])) == [(587, 25, 'Rifter'), (603, 25, 'Merlin')]
+
+
+def test_import_keeps_only_ships(database, dumps):
+    database.import_ships(dumps[0], groups_path=dumps[1])
+
+    assert stored(database, [587, 603, 24690, 2185, 35832]) == set([587, 603, 24690])
+    index = database.ship_index()
+    assert 24690 in index
+    assert 2185 not in index
+    assert 35832 not in index
+
+
+def test_import_refuses_unfiltered_dump(database, dumps):
+    with pytest.raises(ValueError):
+        database.import_ships(dumps[0])
+    assert stored(database, [24690, 2185, 35832]) == set()
+
+    database.import_ships(dumps[0], groups=[419])
+    assert stored(database, [24690, 2185, 35832]) == set([24690])
@@ -0,0 +1,92 @@
+import dbactions
+import synthetic
+
+
+# The correlated view `streak` replaced, kept here to check the table against
+legacy_streaks = """
+CREATE TEMP VIEW `legacy_streaks` AS
+SELECT `player`, `ship`, `result`, MIN(`killid`) AS `start`, MAX(`killid`) AS `end`, COUNT(*) AS `matches`
+FROM (
+    SELECT `killid`, `player`, `ship`, `result`
+        , (SELECT COUNT(*) FROM player_results R
+            WHERE R.player = PR.player AND R.ship = PR.ship AND R.result <> PR.result AND R.killid <= PR.killid) AS `rungroup`
+    FROM player_results PR
+) A
+GROUP BY `player`, `ship`, `result`, `rungroup`
+"""
+
+columns = 'SELECT `player`, `ship`, `result`, `start`, `end`, `matches` FROM `{0}` ORDER BY `player`, `ship`, `start`'
+
+
+def populate(db, count, seed=0):
+    # The generator can pit a pilot against themselves, which no real killmail does
+    pairs = [(report, killData) for report, killData in synthetic.generate(count, seed, players=60)
+        if all(attacker['character_id'] != killData['victim']['character_id'] for attacker in killData['attackers'] if attacker['final_blow'])]
+    db.ingest_kills(report for report, _ in pairs)
+
+    # Newer half first, so the older half reaches parse_spree behind existing runs
+    middle = len(pairs) // 2
+    db.ingest_killdata(killData for _, killData in pairs[middle:])
+    db.parse_spree()
+    db.ingest_killdata(killData for _, killData in pairs[:middle])
+    db.parse_spree()
+
+    characters = set()
+    for _, killData in pairs:
+        characters.add(killData['victim']['character_id'])
+        characters.update(attacker['character_id'] for attacker in killData['attackers'])
+    db.connection.executemany('INSERT INTO `character` (`characterID`, `name`, `corporationID`) VALUES (?, ?, 0)',
+        [(characterID, "Pilot {0}".format(characterID)) for characterID in characters])
+    db.connection.executescript(legacy_streaks)
+    db.connection.commit()
+
+
+def test_streak_table_matches_legacy_view(database):
+    populate(database, 1500)
+
+    expected = database.connection.execute(columns.format('legacy_streaks')).fetchall()
+    assert len(expected) > 0
+    assert database.connection.execute(columns.format('streaks')).fetchall() == expected
+
+
+def test_rebuild_matches_incremental(database):
+    populate(database, 800, seed=3)
+
+    incremental = database.connection.execute('SELECT * FROM `streak` ORDER BY `characterID`, `shipID`, `start`').fetchall()
+    database.rebuild_streaks()
+    assert database.connection.execute('SELECT * FROM `streak` ORDER BY `characterID`, `shipID`, `start`').fetchall() == incremental
+    assert database.connection.execute(columns.format('streaks')).fetchall() == database.connection.execute(columns.format('legacy_streaks')).fetchall()
+
+
+def test_current_streaks_are_latest_runs(database):
+    populate(database, 800, seed=5)
+
+    latest = {}
+    for player, ship, result, start, end, matches in database.connection.execute(columns.format('streaks')):
+        if (player, ship) not in latest or start > latest[(player, ship)][1]:
+            latest[(player, ship)] = (result, start, end, matches)
+
+    current = database.connection.execute('SELECT `player`, `ship`, `result`, `start`, `end`, `matches` FROM `current_streaks`').fetchall()
+    assert sorted(current) == sorted(key + value for key, value in latest.items())
+
+
+def test_fights_stored_by_another_writer_are_not_counted_twice(database):
+    populate(database, 600, seed=7)
+    low, high = database.connection.execute('SELECT MIN(`killID`), MAX(`killID`) FROM `spree`').fetchone()
+
+    # Both writers evaluated these kills before either stored them
+    database.connection.execute('DELETE FROM `spree` WHERE `killID` > ?', ((low + high) // 2,))
+    database.rebuild_scores()
+    database.rebuild_streaks()
+    pending = list(dbactions.spree_rows(database.connection.execute(dbactions.spree_query, (low, high)).fetchall(), database.ship_index()))
+    assert pending
+
+    assert database.bulk_insert(dbactions.insert_spree, pending, on_batch=database.apply_spree)[0] == len(pending)
+    scores = database.connection.execute('SELECT * FROM `player_score` ORDER BY `characterID`').fetchall()
+    streaks = database.connection.execute('SELECT * FROM `streak` ORDER BY `characterID`, `shipID`, `start`').fetchall()
+
+    assert database.bulk_insert(dbactions.insert_spree, pending, on_batch=database.apply_spree) == (0, len(pending), 0)
+    assert database.spree_range(low, high) == []
+    assert database.connection.execute('SELECT * FROM `player_score` ORDER BY `characterID`').fetchall() == scores
+    assert database.connection.execute('SELECT * FROM `streak` ORDER BY `characterID`, `shipID`, `start`').fetchall() == streaks
+    assert database.check_aggregates() == []
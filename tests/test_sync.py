@@ -0,0 +1,90 @@
+import client
+import zkillboard
+
+from dbactions import DBHandler
+
+
+def query_url(server):
+    return "{0}/api/systemID/31000382/groupID/25/".format(server.url)
+
+
+def fail_page(monkeypatch, server, number):
+    """ Make every attempt at page `number` answer 503 """
+
+    fetch_report = zkillboard.fetch_report
+
+    def failing(url, limiter=None):
+        if url.endswith('/page/{0}/'.format(number)):
+            server.script(*[(503, {})] * client.http_retries, route='page')
+        return fetch_report(url, limiter)
+
+    monkeypatch.setattr(client, 'governor_backoff', 0.01)
+    monkeypatch.setattr(zkillboard, 'fetch_report', failing)
+
+
+def fail_batch(monkeypatch, table, number):
+    """ Roll back the `number`th batch inserted into `table`, as a locked or full database would """
+
+    insert_batch = DBHandler.insert_batch
+    batches = []
+
+    def failing(self, statement, batch, on_batch=None):
+        if '`{0}`'.format(table) in statement:
+            batches.append(batch)
+            if len(batches) == number:
+                return None
+        return insert_batch(self, statement, batch, on_batch)
+
+    monkeypatch.setattr(DBHandler, 'insert_batch', failing)
+
+
+def test_sync_pages_until_known_kill(serve, database):
+    server = serve(count=1000)
+    query = query_url(server)
+
+    assert database.sync_query(query) == (1000, 0)
+    assert database.get_lastkill_query(query) == max(server.dataset.zkill)
+
+    pages = server.requests['page']
+    assert database.sync_query(query) == (0, 0)
+    assert server.requests['page'] == pages + 1
+
+
+def test_failed_page_keeps_mark(serve, database, monkeypatch):
+    server = serve(count=1000)
+    query = query_url(server)
+    fail_page(monkeypatch, server, 2)
+
+    assert database.sync_query(query) == (200, 0)
+    assert database.get_lastkill_query(query) is None
+
+    monkeypatch.undo()
+    assert database.sync_query(query) == (800, 200)
+    assert database.get_lastkill_query(query) == max(server.dataset.zkill)
+    assert database.connection.execute('SELECT COUNT(*) FROM `zkill`').fetchone()[0] == 1000
+
+
+def test_failed_page_keeps_event_mark(serve, database, monkeypatch):
+    server = serve(count=600)
+    query = query_url(server)
+    eventID = database.register_events([{'name': 'test', 'query': query}])['test']
+    fail_page(monkeypatch, server, 3)
+
+    assert database.sync_event(eventID, query) == (400, 0)
+    monkeypatch.undo()
+    assert database.sync_event(eventID, query) == (200, 400)
+    assert database.connection.execute('SELECT COUNT(*) FROM `event_kill`').fetchone()[0] == 600
+
+
+def test_failed_batch_keeps_mark(serve, database, monkeypatch):
+    server = serve(count=1000)
+    query = query_url(server)
+    fail_batch(monkeypatch, 'zkill', 1)
+
+    database.sync_query(query)
+    assert database.get_lastkill_query(query) is None
+
+    monkeypatch.undo()
+    database.sync_query(query)
+    assert database.get_lastkill_query(query) == max(server.dataset.zkill)
+    assert database.connection.execute('SELECT COUNT(*) FROM `zkill`').fetchone()[0] == 1000
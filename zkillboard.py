@@ -1,9 +1,8 @@
 import logging
-import requests
 import re
-import time
 
-from config import logging_file
+from client import get_json, send, session
+from config import logging_file, zkillboard_url, redisq_url
 
 # Logging Configuration
 logging.basicConfig(filename=logging_file, level=logging.DEBUG)
@@ -15,46 +14,95 @@ console.setFormatter(formatter)
 logger.addHandler(console)
 
 
-def fetch_report(url):
+def fetch_report(url, limiter=None):
     request_headers = {
         "Accept-Encoding": "gzip",
         "User-Agent": "Biwako Acami Scrapper (biwakoacami@gmail.com)"
     }
-    logger.debug("Requesting {0}".format(url))
-    attempt = True
-    retry = 3
-
-    while attempt == True:
-        try:
-            logger.debug("Waiting 5 seconds before query")
-            time.sleep(5)
-            request = requests.get(url, headers=request_headers, timeout=30)
-            attempt = False
-        except requests.exceptions.Timeout as errt:
-            logger.error("Timeout Error: {0}".format(errt))
-            
-            retry = retry - 1
-
-            if retry == 0:
-                return
-            else:
-                logger.info("Retrying {0} more times.".format(retry))
-
-    data = request.json()
-
-    # Break if the page is empty
-    if len(data) == 0:
-        logger.warn("Received an empty page")
-    
-    return data
-
-def get_killreport(killID):
+
+    return get_json(url, request_headers, limiter)
+
+def get_killreport(killID, limiter=None):
     # Constants
-    url = "https://zkillboard.com/api/killID/{0}/".format(killID)
+    url = "{0}/api/killID/{1}/".format(zkillboard_url, killID)
+
+    return fetch_report(url, limiter)
+
+def listen(queueID, ttw=10, limiter=None):
+    """ One RedisQ long-poll: the next package for `queueID`, None when none arrived within `ttw` seconds
+
+    Not sent through get_json, a revalidated listen.php response would replay an old package.
+    """
+
+    request_headers = {
+        "Accept-Encoding": "gzip",
+        "User-Agent": "Biwako Acami Scrapper (biwakoacami@gmail.com)"
+    }
+    url = "{0}?queueID={1}&ttw={2}".format(redisq_url, queueID, ttw)
+
+    request = send(session.get, url, request_headers, limiter)
+    if request is None:
+        raise IOError("No response from RedisQ")
+    if request.status_code != 200:
+        raise IOError("RedisQ answered HTTP {0}".format(request.status_code))
+    return request.json().get('package')
+
+def get_history(day, limiter=None):
+    """ killID -> hash of every kill zkillboard recorded on `day` """
+
+    url = "{0}/api/history/{1}.json".format(zkillboard_url, day.strftime("%Y%m%d"))
+
+    return fetch_report(url, limiter)
+
+def iter_pages(uri, last_killID=None, max_pages=None):
+    """ Yields reports from a paged `uri` newest first, page by page, until an empty page or `last_killID`
+
+    Raises IOError when a page cannot be fetched, so callers can tell an
+    interrupted walk from one that reached the end.
+    """
+
+    page = 1
+    oldest = None
+
+    while max_pages is None or page <= max_pages:
+        url = uri.format(page)
+        data = fetch_report(url)
+
+        if not isinstance(data, list):
+            raise IOError("Unable to fetch page {0} of {1}".format(page, uri))
+
+        # Break if the page is empty
+        if not data:
+            break
+
+        known = False
+        for report in sorted(data, key = lambda report: report['killmail_id'], reverse = True):
+            killID = report['killmail_id']
+
+            # New kills push older ones onto the next page, those were already yielded
+            if oldest is not None and killID >= oldest:
+                continue
+
+            if last_killID is not None and killID <= last_killID:
+                known = True
+                break
+
+            oldest = killID
+            yield report
+
+        if known:
+            logger.info("Reached last known killID {0} on page {1}".format(last_killID, page))
+            break
+
+        page = page + 1
+
+
+def fetch_pages(uri, last_killID=None, max_pages=10):
+    """ Collects reports from a paged `uri`, stopping at the first page that reaches `last_killID` """
+    return list(iter_pages(uri, last_killID, max_pages))
 
-    return fetch_report(url)
 
-def get_killreports(identifier, base):
+def killreports_uri(identifier, base):
     if base == 'character':
         modifier = 'characterID'
     elif base == 'corporation':
@@ -70,24 +118,16 @@ def get_killreports(identifier, base):
     else:
         return
 
-    uri = "https://zkillboard.com/api/{0}/{1}/page/{2}/"
+    return "{0}/api/{1}/{2}/".format(zkillboard_url, modifier, identifier) + "page/{0}/"
 
-    dump = []
-
-    for page in range(1, 11):
-        url = uri.format(modifier, identifier, page)
-        data = fetch_report(url)
-        
-        # Break if the page is empty
-        if len(data) == 0:
-            break
-        
-        for report in data:
-            dump.append(report)
+def get_killreports(identifier, base, last_killID=None):
+    uri = killreports_uri(identifier, base)
+    if uri is None:
+        return
 
-    return sorted(dump, key = lambda report: report['killmail_id'], reverse = True)
+    return fetch_pages(uri, last_killID)
 
-def get_killreports_query(query):
+def get_killreports_query(query, last_killID=None):
 
     if re.search("killid", query, re.IGNORECASE):
         paged = False
@@ -97,17 +137,21 @@ def get_killreports_query(query):
         paged = True
         uri = query + "page/{0}/"
 
-        dump = []
+        return fetch_pages(uri, last_killID)
 
-        for page in range(1, 11):
-            url = uri.format(page)
-            data = fetch_report(url)
-            
-            # Break if the page is empty
-            if len(data) == 0:
-                break
-            
-            for report in data:
-                dump.append(report)
+def iter_killreports(identifier, base, last_killID=None):
+    """ Streams every report for an identifier/base combination, newest first, with no page cap """
+
+    uri = killreports_uri(identifier, base)
+    if uri is None:
+        return iter(())
+
+    return iter_pages(uri, last_killID)
+
+def iter_killreports_query(query, last_killID=None):
+    """ Streams every report for a raw zkillboard query, newest first, with no page cap """
+
+    if re.search("killid", query, re.IGNORECASE):
+        return iter(fetch_report(query) or ())
 
-        return sorted(dump, key = lambda report: report['killmail_id'], reverse = True)
\ No newline at end of file
+    return iter_pages(query + "page/{0}/", last_killID)